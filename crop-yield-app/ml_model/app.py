@@ -1,164 +1,683 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 import numpy as np
-import joblib
-import json
 from datetime import datetime
+import gzip
+import hashlib
+import hmac
 import os
+import threading
+import time
+
+from batching import BATCH_SIZE_BUCKETS, QUEUE_WAIT_BUCKETS, MicroBatcher
+from history_cube import DIMENSIONS as HISTORY_DIMENSIONS
+from metrics import MetricsRegistry, MetricsSpool
+from model_bundle import BUNDLE_PATH
+from model_store import artifact_fingerprint, artifact_source, read_artifacts
+from prediction_cache import PredictionCache
+from profiling import RequestProfiler, dump_pstats, render_collapsed, render_pstats
+from sharding import SHARD_INDEX_PATH
 
 app = Flask(__name__)
 CORS(app)
 
-# Global variables for model and encoders
-model = None
-scaler = None
-le_state = None
-le_district = None
-le_season = None
-le_crop = None
-unique_values = None
+# Active artifact set (model, encoders, unique values); replaced as a whole on reload
+active_model = None
+
+# Serve tree ensembles through the flat NumPy engine (ML_FLAT_FOREST=0 uses sklearn)
+USE_FLAT_FOREST = os.environ.get('ML_FLAT_FOREST', '1') != '0'
+
+# Only serve this model family (random_forest or hist_gradient_boosting; unset accepts either)
+MODEL_BACKEND = os.environ.get('ML_MODEL_BACKEND', '')
+
+# Serve the per-crop shards from train_model.py --sharded (ML_SHARDED=1), keeping
+# at most ML_MAX_RESIDENT_SHARDS of them loaded per process
+SHARDED = os.environ.get('ML_SHARDED', '0') == '1'
+MAX_RESIDENT_SHARDS = int(os.environ.get('ML_MAX_RESIDENT_SHARDS', 16))
+
+# Check bundle array checksums at load (ML_VERIFY_BUNDLE=0 skips it)
+VERIFY_BUNDLE = os.environ.get('ML_VERIFY_BUNDLE', '1') != '0'
+
+# Seconds between checks for a new model bundle (ML_RELOAD_INTERVAL=0 disables it)
+RELOAD_INTERVAL = float(os.environ.get('ML_RELOAD_INTERVAL', 10))
+
+# On-demand reloads via POST /admin/reload with an "X-Admin-Token" header
+# matching ML_ADMIN_TOKEN; the endpoint is disabled while it is unset
+ADMIN_TOKEN = os.environ.get('ML_ADMIN_TOKEN', '')
+
+# Browser cache lifetime of /unique-values and /districts/<state>; ETags revalidate them afterwards
+REFERENCE_MAX_AGE = int(os.environ.get('ML_REFERENCE_MAX_AGE', 300))
+
+# Upper bound on records accepted by /predict/batch
+MAX_BATCH_SIZE = int(os.environ.get('ML_MAX_BATCH_SIZE', 10000))
+
+# Quantiles returned when a request asks for "intervals": true
+DEFAULT_INTERVAL_QUANTILES = [float(q) for q in os.environ.get('ML_INTERVAL_QUANTILES', '0.05,0.95').split(',')]
+
+# Upper bound on grid points scored by one /predict/scenarios call
+MAX_SCENARIO_POINTS = int(os.environ.get('ML_MAX_SCENARIO_POINTS', 10000))
+
+# Coalesce concurrent /predict calls into batches (ML_MICRO_BATCH=1 enables it)
+MICRO_BATCH_ENABLED = os.environ.get('ML_MICRO_BATCH', '0') == '1'
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('ML_MICRO_BATCH_MAX_SIZE', 64))
+MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('ML_MICRO_BATCH_MAX_WAIT_MS', 2))
+
+# On-demand request profiling (ML_PROFILING=1): prediction requests sending
+# "X-Profile: 1", or a random ML_PROFILE_SAMPLE_RATE share of them, are run under
+# cProfile and the last ML_PROFILE_RING_SIZE captures are kept for /admin/profiles
+PROFILING_ENABLED = os.environ.get('ML_PROFILING', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.environ.get('ML_PROFILE_SAMPLE_RATE', 0))
+PROFILE_RING_SIZE = int(os.environ.get('ML_PROFILE_RING_SIZE', 20))
+PROFILE_HEADER = 'X-Profile'
+PROFILED_ENDPOINTS = {'predict', 'predict_batch', 'predict_scenarios'}
+
+# Memoized predictions for repeated inputs (ML_CACHE_SIZE=0 disables it)
+prediction_cache = PredictionCache(
+    max_size=int(os.environ.get('ML_CACHE_SIZE', 4096)),
+    ttl=float(os.environ.get('ML_CACHE_TTL', 3600))
+)
+
+# Prometheus metrics served at /metrics (ML_METRICS_ENABLED=0 disables collection)
+metrics = MetricsRegistry(enabled=os.environ.get('ML_METRICS_ENABLED', '1') != '0')
+request_seconds = metrics.histogram('ml_request_duration_seconds', "Request latency by endpoint",
+                                    labelnames=['endpoint'])
+requests_total = metrics.counter('ml_requests_total', "Requests by endpoint and status",
+                                 labelnames=['endpoint', 'status'])
+request_errors_total = metrics.counter('ml_request_errors_total', "Requests answered with a 4xx/5xx status",
+                                       labelnames=['endpoint'])
+stage_seconds = metrics.histogram('ml_predict_stage_duration_seconds', "Prediction hot-path latency by stage",
+                                  labelnames=['stage'])
+batch_size = metrics.histogram('ml_batch_size', "Records scored per model call by source",
+                               buckets=BATCH_SIZE_BUCKETS, labelnames=['source'])
+model_load_seconds = metrics.gauge('ml_model_load_seconds', "Duration of the last model load")
+model_loads_total = metrics.counter('ml_model_loads_total', "Model load attempts by result",
+                                    labelnames=['result'])
+
+# serve.py points ML_METRICS_DIR at a directory shared by its workers; /metrics on
+# any worker then reports counters and histograms summed over all of them and
+# gauges per worker (pid label). Without it the numbers cover this process only.
+METRICS_DIR = os.environ.get('ML_METRICS_DIR', '')
+metrics_spool = MetricsSpool(metrics, METRICS_DIR) if METRICS_DIR and metrics.enabled else None
+
+metrics.callback('ml_cache_hits_total', "Prediction cache hits", 'counter', lambda: prediction_cache.hits)
+metrics.callback('ml_cache_misses_total', "Prediction cache misses", 'counter', lambda: prediction_cache.misses)
+metrics.callback('ml_cache_evictions_total', "Prediction cache LRU evictions", 'counter',
+                 lambda: prediction_cache.evictions)
+
+def shard_stat(name):
+    """Counter of the active sharded engine, 0 when serving a single model"""
+    stats = getattr(active_model.engine if active_model else None, 'stats', None)
+    return stats()[name] if stats else 0
+
+metrics.callback('ml_shard_loads_total', "Model shards loaded on first use", 'counter',
+                 lambda: shard_stat('loads'))
+metrics.callback('ml_shard_evictions_total', "Model shards dropped from the resident LRU", 'counter',
+                 lambda: shard_stat('evictions'))
+metrics.callback('ml_shards_resident', "Model shards currently loaded", 'gauge',
+                 lambda: len(shard_stat('resident') or ()))
+
+# Hot-path children resolved once so each observation is a single call
+STAGES = ['parse_json', 'validate', 'cache', 'encode', 'model_predict', 'insights', 'serialize']
+_stage_timers = {stage: stage_seconds.labels(stage) for stage in STAGES}
+
+def record_stage(stage, started):
+    """Record time spent in a stage since started; returns the current time"""
+    now = time.perf_counter()
+    if metrics.enabled:
+        _stage_timers[stage].observe(now - started)
+    return now
+
+class ReferenceResponse:
+    """A JSON body serialized and gzip-compressed once, with a strong ETag per encoding"""
+    
+    def __init__(self, payload):
+        self.body = (app.json.dumps(payload) + '\n').encode()
+        self.gzip_body = gzip.compress(self.body, compresslevel=9, mtime=0)
+        digest = hashlib.sha256(self.body).hexdigest()[:20]
+        self.etag = digest
+        self.gzip_etag = f"{digest}-gzip"
+
+def build_reference_responses(unique_values):
+    """Reference-data responses for one artifact set: all values, plus districts by state"""
+    mapping = unique_values.get('district_state_mapping', {})
+    return {
+        'unique_values': ReferenceResponse(unique_values),
+        'districts': {state: ReferenceResponse({"districts": districts}) for state, districts in mapping.items()},
+        'no_districts': ReferenceResponse({"districts": []})
+    }
+
+def serve_reference(reference):
+    """Send a pre-built response, gzip-encoded if accepted, or 304 if the client's copy is current"""
+    use_gzip = request.accept_encodings['gzip'] > 0
+    etag = reference.gzip_etag if use_gzip else reference.etag
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'public, max-age={REFERENCE_MAX_AGE}',
+        'Vary': 'Accept-Encoding'
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        return Response(reference.gzip_body, mimetype='application/json', headers=headers)
+    return Response(reference.body, mimetype='application/json', headers=headers)
+
+profiler = RequestProfiler(PROFILE_RING_SIZE, PROFILE_SAMPLE_RATE) if PROFILING_ENABLED else None
+
+def start_request_profile():
+    """Profile a prediction request if it asked for it or was sampled"""
+    if request.endpoint in PROFILED_ENDPOINTS:
+        profile = profiler.start(requested=request.headers.get(PROFILE_HEADER) == '1')
+        if profile is not None:
+            g.profile = profile
+            g.profile_started = time.perf_counter()
+
+def finish_request_profile(response):
+    """Store the request's profile and tell the client its id"""
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile_id = profiler.stop(
+            profile,
+            endpoint=request.url_rule.rule,
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - g.profile_started) * 1000, 3),
+            model_version=active_model.version if active_model else None
+        )
+        response.headers['X-Profile-Id'] = profile_id
+    return response
+
+def discard_request_profile(error):
+    # Only still set when the request failed before after_request ran
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.discard(profile)
+
+# The hooks are only installed when profiling is on, so it costs nothing otherwise
+if profiler is not None:
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
+    app.teardown_request(discard_request_profile)
+    metrics.callback('ml_profiles_captured_total', "Request profiles captured", 'counter',
+                     lambda: profiler.captured)
+
+_reload_lock = threading.Lock()
+_watcher_pid = None
 
 def load_model_and_encoders():
-    """Load the trained model and encoders"""
-    global model, scaler, le_state, le_district, le_season, le_crop, unique_values
+    """Load the trained model and encoders, swapping them in atomically"""
+    global active_model
+    
+    with _reload_lock:
+        started = time.perf_counter()
+        try:
+            # Load and smoke-test the new artifact set before it serves traffic
+            artifacts = read_artifacts(USE_FLAT_FOREST, VERIFY_BUNDLE, SHARDED, MAX_RESIDENT_SHARDS)
+            if MODEL_BACKEND and artifacts.estimator != MODEL_BACKEND:
+                raise ValueError(f"artifacts hold a {artifacts.estimator} model, ML_MODEL_BACKEND is {MODEL_BACKEND}")
+            
+            # Serialize and compress the reference data once per artifact set
+            artifacts.reference_responses = build_reference_responses(artifacts.unique_values)
+            
+            # A single reference swap; in-flight requests keep the set they started with
+            active_model = artifacts
+            
+            # Cached predictions belong to the previous artifacts
+            prediction_cache.clear()
+            
+            model_load_seconds.labels().set(time.perf_counter() - started)
+            model_loads_total.labels('success').inc()
+            print(f"✅ Model and encoders loaded successfully! (version {artifacts.version})")
+            return True
+        except Exception as e:
+            model_loads_total.labels('failure').inc()
+            print(f"❌ Error loading model: {e}")
+            return False
+
+def model_artifacts_changed():
+    """True when a new model bundle or shard index has been published since the last load"""
+    source = artifact_source(USE_FLAT_FOREST, SHARDED)
+    # Only the bundle and shard index are replaced atomically; pickles may be mid-write
+    if source not in (BUNDLE_PATH, SHARD_INDEX_PATH):
+        return False
     
+    current = active_model
     try:
-        # Load model and scaler
-        model = joblib.load('crop_yield_model.pkl')
-        scaler = joblib.load('scaler.pkl')
-        
-        # Load label encoders
-        le_state = joblib.load('label_encoders/state_encoder.pkl')
-        le_district = joblib.load('label_encoders/district_encoder.pkl')
-        le_season = joblib.load('label_encoders/season_encoder.pkl')
-        le_crop = joblib.load('label_encoders/crop_encoder.pkl')
-        
-        # Load unique values
-        with open('data/unique_values.json', 'r') as f:
-            unique_values = json.load(f)
-        
-        print("✅ Model and encoders loaded successfully!")
-        return True
-    except Exception as e:
-        print(f"❌ Error loading model: {e}")
+        fingerprint = artifact_fingerprint(source)
+    except OSError:
         return False
+    return current is None or current.source != source or current.fingerprint != fingerprint
+
+def watch_model_artifacts():
+    """Poll for a new model bundle and hot-reload it"""
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            if model_artifacts_changed():
+                print("🔄 New model bundle detected, reloading...")
+                load_model_and_encoders()
+        except Exception as e:
+            print(f"Model watcher error: {e}")
+
+def start_model_watcher():
+    """Start the hot-reload thread once per process (threads do not survive fork)"""
+    global _watcher_pid
+    
+    if RELOAD_INTERVAL <= 0 or _watcher_pid == os.getpid():
+        return
+    
+    _watcher_pid = os.getpid()
+    threading.Thread(target=watch_model_artifacts, name="model-watcher", daemon=True).start()
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_seconds.labels(endpoint).observe(time.perf_counter() - started)
+        requests_total.labels(endpoint, response.status_code).inc()
+        if response.status_code >= 400:
+            request_errors_total.labels(endpoint).inc()
+    return response
 
 @app.route('/health', methods=['GET'])
 def health():
+    artifacts = active_model
     return jsonify({
-        "status": "healthy" if model is not None else "model_not_loaded",
+        "status": "healthy" if artifacts is not None else "model_not_loaded",
         "timestamp": datetime.now().isoformat(),
         "service": "Crop Yield ML API",
-        "model_loaded": model is not None
+        "model_loaded": artifacts is not None,
+        "inference_engine": artifacts.inference_engine if artifacts else None,
+        "model_backend": artifacts.estimator if artifacts else None,
+        "model_version": artifacts.version if artifacts else None,
+        "model_loaded_at": artifacts.loaded_at if artifacts else None
     })
 
 @app.route('/unique-values', methods=['GET'])
 def get_unique_values():
     """Get unique values for dropdowns"""
-    if unique_values is None:
+    artifacts = active_model
+    if artifacts is None:
         return jsonify({"error": "Model not loaded"}), 500
     
-    return jsonify(unique_values)
+    return serve_reference(artifacts.reference_responses['unique_values'])
 
 @app.route('/districts/<state>', methods=['GET'])
 def get_districts_for_state(state):
     """Get districts for a specific state"""
-    if unique_values is None:
+    artifacts = active_model
+    if artifacts is None:
         return jsonify({"error": "Model not loaded"}), 500
     
-    districts = unique_values.get('district_state_mapping', {}).get(state, [])
-    return jsonify({"districts": districts})
+    references = artifacts.reference_responses
+    return serve_reference(references['districts'].get(state, references['no_districts']))
+
+class PredictionInputError(ValueError):
+    """Raised when a prediction record fails validation"""
+
+
+def parse_prediction_input(data, artifacts):
+    """Validate one prediction record and return its normalized inputs"""
+    if not isinstance(data, dict):
+        raise PredictionInputError("Record must be a JSON object")
+    
+    # Extract input values
+    text_fields = ['state_name', 'district_name', 'season', 'crop']
+    for field in text_fields:
+        if not isinstance(data.get(field, ''), str):
+            raise PredictionInputError(f"'{field}' must be a string")
+    state_name, district_name, season, crop = (data.get(field, '').strip() for field in text_fields)
+    try:
+        crop_year = int(data.get('crop_year', 2024))
+        area = float(data.get('area', 0))
+    except (TypeError, ValueError, OverflowError):
+        raise PredictionInputError("crop_year and area must be numbers")
+    
+    # Validate inputs
+    if not all([state_name, district_name, season, crop, area > 0]):
+        raise PredictionInputError("All fields are required and area must be positive")
+    
+    # Check if values exist in training data
+    error = artifacts.encoder_index.validation_error(state_name, district_name, season, crop)
+    if error:
+        raise PredictionInputError(error)
+    
+    return {
+        "state": state_name,
+        "district": district_name,
+        "season": season,
+        "crop": crop,
+        "year": crop_year,
+        "area": area
+    }
+
+def parse_quantiles(data, artifacts):
+    """Quantiles asked for with "quantiles": [...] or "intervals": true, else None"""
+    if not isinstance(data, dict) or ('quantiles' not in data and not data.get('intervals')):
+        return None
+    if not artifacts.supports_intervals:
+        raise PredictionInputError(f"Prediction intervals need a random_forest model, not {artifacts.estimator}")
+    
+    quantiles = data.get('quantiles', DEFAULT_INTERVAL_QUANTILES)
+    try:
+        quantiles = [float(q) for q in quantiles]
+    except (TypeError, ValueError):
+        quantiles = []
+    if not quantiles or len(quantiles) > 20 or not all(0 <= q <= 1 for q in quantiles):
+        raise PredictionInputError("'quantiles' must be a list of 1 to 20 numbers between 0 and 1")
+    return quantiles
+
+def predict_intervals(records, artifacts, quantiles):
+    """Mean prediction plus std and quantiles across the trees, from one pass over the forest"""
+    started = time.perf_counter()
+    features_scaled = build_feature_matrix(records, artifacts)
+    started = record_stage('encode', started)
+    mean, std, values = artifacts.predict_intervals(features_scaled, quantiles)
+    record_stage('model_predict', started)
+    intervals = [
+        {
+            "std": round(float(std[i]), 2),
+            "quantiles": {f"{q:g}": round(float(values[j, i]), 2) for j, q in enumerate(quantiles)}
+        }
+        for i in range(len(records))
+    ]
+    return mean, intervals
+
+def parse_sweep(value, name, integer=False):
+    """Values of one swept field: a number, a list, or {"start", "stop", "step" | "num"} (stop inclusive)"""
+    try:
+        if isinstance(value, dict):
+            start, stop = float(value['start']), float(value['stop'])
+            step = float(value.get('step', 1))
+            num = int(value['num']) if 'num' in value else None
+        else:
+            values = np.asarray(value if isinstance(value, list) else [value], dtype=float)
+    except (KeyError, TypeError, ValueError):
+        raise PredictionInputError(f"'{name}' must be a number, a list of numbers or a start/stop range")
+    
+    if isinstance(value, dict):
+        if num is None and not step > 0:
+            raise PredictionInputError(f"'{name}' step must be positive")
+        try:
+            count = num if num is not None else int(np.floor((stop - start) / step + 1e-9)) + 1
+        except (ValueError, OverflowError):
+            raise PredictionInputError(f"'{name}' range must have finite start and stop values")
+        if count > MAX_SCENARIO_POINTS:
+            raise PredictionInputError(f"'{name}' range has more than {MAX_SCENARIO_POINTS} values")
+        values = np.linspace(start, stop, max(count, 0)) if num is not None else start + step * np.arange(max(count, 0))
+    
+    if values.ndim != 1 or not len(values):
+        raise PredictionInputError(f"'{name}' must have at least one value")
+    if integer:
+        # Casting would silently truncate e.g. 2020.5 to 2020
+        if not np.all(np.isfinite(values)) or np.any(values != np.round(values)):
+            raise PredictionInputError(f"'{name}' values must be whole numbers")
+        return values.astype(np.int64)
+    return values
+
+def build_feature_matrix(records, artifacts):
+    """Encode a list of validated records into one scaled feature matrix"""
+    return artifacts.encoder_index.encode(records)
+
+def predict_records(records, artifacts):
+    """Predict production for validated records, serving repeats from the cache"""
+    predictions = np.empty(len(records))
+    keys = [(artifacts.version,) + PredictionCache.key(r) for r in records]
+    
+    started = time.perf_counter()
+    misses = []
+    for i, key in enumerate(keys):
+        cached = prediction_cache.get(key)
+        if cached is None:
+            misses.append(i)
+        else:
+            predictions[i] = cached
+    started = record_stage('cache', started)
+    
+    # Score every miss in one model call
+    if misses:
+        features_scaled = build_feature_matrix([records[i] for i in misses], artifacts)
+        started = record_stage('encode', started)
+        predictions[misses] = artifacts.predict(features_scaled)
+        record_stage('model_predict', started)
+        for i in misses:
+            prediction_cache.put(keys[i], float(predictions[i]))
+    
+    return predictions
+
+def predict_submitted(items):
+    """Score micro-batched (artifacts, record) pairs, one model call per artifact set"""
+    predictions = [None] * len(items)
+    groups = {}
+    for i, (artifacts, _) in enumerate(items):
+        groups.setdefault(id(artifacts), (artifacts, []))[1].append(i)
+    
+    for artifacts, indices in groups.values():
+        scored = predict_records([items[i][1] for i in indices], artifacts)
+        for i, value in zip(indices, scored):
+            predictions[i] = value
+    return predictions
+
+micro_batcher = MicroBatcher(
+    predict_submitted,
+    max_batch_size=MICRO_BATCH_MAX_SIZE,
+    max_wait=MICRO_BATCH_MAX_WAIT_MS / 1000,
+    batch_sizes=batch_size.labels('micro_batch'),
+    queue_wait=metrics.histogram('ml_micro_batch_queue_wait_seconds', "Time /predict records wait to be batched",
+                                 buckets=QUEUE_WAIT_BUCKETS).labels()
+) if MICRO_BATCH_ENABLED else None
+
+def build_prediction_response(inputs, predicted_production, interval=None):
+    """Build the /predict response body for one record"""
+    area = inputs['area']
+    predicted_production = float(predicted_production)
+    
+    # Calculate yield per hectare
+    yield_per_hectare = predicted_production / area if area > 0 else 0
+    
+    # Generate insights and recommendations
+    insights = generate_insights(inputs['state'], inputs['district'], inputs['season'],
+                                 inputs['crop'], predicted_production, yield_per_hectare)
+    
+    return {
+        "success": True,
+        "prediction": {
+            "predicted_production": round(predicted_production, 2),
+            "yield_per_hectare": round(yield_per_hectare, 2),
+            "area_hectares": area,
+            "unit": "tons",
+            **({"interval": interval} if interval is not None else {})
+        },
+        "inputs": inputs,
+        "insights": insights,
+        "prediction_timestamp": datetime.now().isoformat()
+    }
 
 @app.route('/predict', methods=['POST'])
 def predict():
     try:
-        if model is None:
+        artifacts = active_model
+        if artifacts is None:
             return jsonify({"error": "Model not loaded. Please train the model first."}), 500
         
+        started = time.perf_counter()
         data = request.get_json()
+        started = record_stage('parse_json', started)
         
-        # Extract input values
-        state_name = data.get('state_name', '').strip()
-        district_name = data.get('district_name', '').strip()
-        season = data.get('season', '').strip()
-        crop = data.get('crop', '').strip()
-        crop_year = int(data.get('crop_year', 2024))
-        area = float(data.get('area', 0))
+        try:
+            inputs = parse_prediction_input(data, artifacts)
+            quantiles = parse_quantiles(data, artifacts)
+        except PredictionInputError as e:
+            return jsonify({"error": str(e)}), 400
+        record_stage('validate', started)
         
-        # Validate inputs
-        if not all([state_name, district_name, season, crop, area > 0]):
-            return jsonify({"error": "All fields are required and area must be positive"}), 400
+        # Make prediction, sharing a model call with concurrent requests if enabled;
+        # intervals need the per-tree values, so they skip the cache and batcher, and
+        # profiled requests score inline so the model calls land in their profile
+        interval = None
+        if quantiles is not None:
+            predictions, intervals = predict_intervals([inputs], artifacts, quantiles)
+            predicted_production, interval = predictions[0], intervals[0]
+        elif micro_batcher is not None and not (profiler and 'profile' in g):
+            predicted_production = micro_batcher.submit((artifacts, inputs))
+        else:
+            predicted_production = predict_records([inputs], artifacts)[0]
         
-        # Check if values exist in training data
-        if state_name not in unique_values['states']:
-            return jsonify({"error": f"State '{state_name}' not found in training data"}), 400
+        started = time.perf_counter()
+        body = build_prediction_response(inputs, predicted_production, interval)
+        started = record_stage('insights', started)
+        response = jsonify(body)
+        record_stage('serialize', started)
+        return response, 200
         
-        if district_name not in unique_values['districts']:
-            return jsonify({"error": f"District '{district_name}' not found in training data"}), 400
+    except Exception as e:
+        print(f"Prediction error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch():
+    """Score many records with a single vectorized model call"""
+    try:
+        artifacts = active_model
+        if artifacts is None:
+            return jsonify({"error": "Model not loaded. Please train the model first."}), 500
         
-        if season not in unique_values['seasons']:
-            return jsonify({"error": f"Season '{season}' not found in training data"}), 400
+        started = time.perf_counter()
+        data = request.get_json()
+        started = record_stage('parse_json', started)
+        records = data.get('records') if isinstance(data, dict) else data
         
-        if crop not in unique_values['crops']:
-            return jsonify({"error": f"Crop '{crop}' not found in training data"}), 400
+        if not isinstance(records, list) or not records:
+            return jsonify({"error": "Request body must contain a non-empty 'records' list"}), 400
         
-        # Encode categorical variables
-        state_encoded = le_state.transform([state_name])[0]
-        district_encoded = le_district.transform([district_name])[0]
-        season_encoded = le_season.transform([season])[0]
-        crop_encoded = le_crop.transform([crop])[0]
+        if len(records) > MAX_BATCH_SIZE:
+            return jsonify({"error": f"Batch too large: {len(records)} records (max {MAX_BATCH_SIZE})"}), 413
         
-        # Normalize year (assuming training data range)
-        year_min = 2000  # Approximate minimum year from dataset
-        year_max = 2024  # Approximate maximum year
-        year_normalized = (crop_year - year_min) / (year_max - year_min)
+        # Intervals are requested once for the whole batch
+        try:
+            quantiles = parse_quantiles(data, artifacts)
+        except PredictionInputError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Create feature vector
-        features = np.array([[
-            state_encoded,
-            district_encoded,
-            season_encoded,
-            crop_encoded,
-            year_normalized,
-            area
-        ]])
+        # Validate every record, keeping per-row errors instead of failing the batch
+        results = [None] * len(records)
+        valid_rows = []
+        valid_inputs = []
+        for i, record in enumerate(records):
+            try:
+                if not isinstance(record, dict):
+                    raise PredictionInputError("Record must be a JSON object")
+                valid_inputs.append(parse_prediction_input(record, artifacts))
+                valid_rows.append(i)
+            except (ValueError, TypeError) as e:
+                results[i] = {"success": False, "index": i, "error": str(e)}
+        record_stage('validate', started)
         
-        # Scale features
-        features_scaled = scaler.transform(features)
+        # One encode/scale/predict pass over every valid row
+        if valid_inputs:
+            if metrics.enabled:
+                batch_size.labels('batch_endpoint').observe(len(valid_inputs))
+            if quantiles is not None:
+                predictions, intervals = predict_intervals(valid_inputs, artifacts, quantiles)
+            else:
+                predictions, intervals = predict_records(valid_inputs, artifacts), [None] * len(valid_inputs)
+            started = time.perf_counter()
+            for i, inputs, predicted_production, interval in zip(valid_rows, valid_inputs, predictions, intervals):
+                results[i] = build_prediction_response(inputs, predicted_production, interval)
+            record_stage('insights', started)
         
-        # Make prediction
-        predicted_production = model.predict(features_scaled)[0]
+        started = time.perf_counter()
+        response = jsonify({
+            "success": True,
+            "count": len(records),
+            "succeeded": len(valid_inputs),
+            "failed": len(records) - len(valid_inputs),
+            "results": results
+        })
+        record_stage('serialize', started)
+        return response, 200
         
-        # Calculate yield per hectare
-        yield_per_hectare = predicted_production / area if area > 0 else 0
+    except Exception as e:
+        print(f"Batch prediction error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/predict/scenarios', methods=['POST'])
+def predict_scenarios():
+    """Score every season x crop year x area combination for one district and crop in one model call"""
+    try:
+        artifacts = active_model
+        if artifacts is None:
+            return jsonify({"error": "Model not loaded. Please train the model first."}), 500
         
-        # Generate insights and recommendations
-        insights = generate_insights(state_name, district_name, season, crop, predicted_production, yield_per_hectare)
+        started = time.perf_counter()
+        data = request.get_json()
+        started = record_stage('parse_json', started)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+        
+        try:
+            state_name = str(data.get('state_name', '')).strip()
+            district_name = str(data.get('district_name', '')).strip()
+            crop = str(data.get('crop', '')).strip()
+            seasons = data.get('season', '')
+            seasons = [str(season).strip() for season in (seasons if isinstance(seasons, list) else [seasons])]
+            years = parse_sweep(data.get('crop_year', 2024), 'crop_year', integer=True)
+            areas = parse_sweep(data.get('area', 0), 'area')
+            
+            if not seasons:
+                raise PredictionInputError("'season' must have at least one value")
+            if not all([state_name, district_name, crop, *seasons]) or not (areas > 0).all():
+                raise PredictionInputError("All fields are required and every area must be positive")
+            for season in seasons:
+                error = artifacts.encoder_index.validation_error(state_name, district_name, season, crop)
+                if error:
+                    raise PredictionInputError(error)
+        except PredictionInputError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        n_points = len(seasons) * len(years) * len(areas)
+        if n_points > MAX_SCENARIO_POINTS:
+            return jsonify({"error": f"Scenario grid too large: {n_points} points (max {MAX_SCENARIO_POINTS})"}), 413
+        started = record_stage('validate', started)
+        
+        # Full grid in row-major (season, crop_year, area) order, scored in one pass
+        season_index, year_grid, area_grid = np.meshgrid(np.arange(len(seasons)), years, areas, indexing='ij')
+        features_scaled = artifacts.encoder_index.encode_columns(
+            np.full(n_points, state_name, dtype=object),
+            np.full(n_points, district_name, dtype=object),
+            np.asarray(seasons, dtype=object)[season_index.ravel()],
+            np.full(n_points, crop, dtype=object),
+            year_grid.ravel(),
+            area_grid.ravel()
+        )
+        started = record_stage('encode', started)
+        if metrics.enabled:
+            batch_size.labels('scenarios').observe(n_points)
+        predicted_production = artifacts.predict(features_scaled)
+        started = record_stage('model_predict', started)
         
-        response = {
+        response = jsonify({
             "success": True,
-            "prediction": {
-                "predicted_production": round(predicted_production, 2),
-                "yield_per_hectare": round(yield_per_hectare, 2),
-                "area_hectares": area,
-                "unit": "tons"
-            },
-            "inputs": {
-                "state": state_name,
-                "district": district_name,
-                "season": season,
-                "crop": crop,
-                "year": crop_year,
-                "area": area
-            },
-            "insights": insights,
+            "inputs": {"state": state_name, "district": district_name, "crop": crop},
+            "axes": {"season": seasons, "crop_year": years.tolist(), "area": areas.tolist()},
+            "shape": [len(seasons), len(years), len(areas)],
+            "predicted_production": np.round(predicted_production, 2).tolist(),
+            "yield_per_hectare": np.round(predicted_production / area_grid.ravel(), 2).tolist(),
+            "unit": "tons",
+            "model_version": artifacts.version,
             "prediction_timestamp": datetime.now().isoformat()
-        }
-        
-        return jsonify(response), 200
+        })
+        record_stage('serialize', started)
+        return response, 200
         
     except Exception as e:
-        print(f"Prediction error: {e}")
+        print(f"Scenario prediction error: {e}")
         return jsonify({"error": str(e)}), 500
 
 def generate_insights(state, district, season, crop, production, yield_per_hectare):
@@ -206,17 +725,163 @@ def generate_insights(state, district, season, crop, production, yield_per_hecta
     
     return insights
 
+def history_response(by):
+    """Aggregate the active history cube by one dimension using the request's filters"""
+    artifacts = active_model
+    if artifacts is None or artifacts.history is None:
+        return jsonify({"error": "Historical statistics not available; run train_model.py"}), 503
+    cube = artifacts.history
+    
+    try:
+        filters = {}
+        # Each dimension filters on a comma-separated list of values
+        for dim in HISTORY_DIMENSIONS:
+            values = [value.strip() for value in request.args.get(dim, '').split(',') if value.strip()]
+            if values:
+                filters[dim] = [int(value) for value in values] if dim == 'year' else values
+        for bound in ['year_min', 'year_max']:
+            if request.args.get(bound):
+                filters[bound] = int(request.args[bound])
+        quantiles = [float(q) for q in request.args.get('quantiles', '0.25,0.5,0.75').split(',')]
+        if not all(0 <= q <= 1 for q in quantiles):
+            raise ValueError("quantiles must be between 0 and 1")
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+    
+    unknown = cube.unknown_value(filters)
+    if unknown:
+        return jsonify({"error": f"{unknown[0].title()} '{unknown[1]}' not found in the historical data"}), 400
+    
+    result = cube.aggregate(filters, by, quantiles)
+    return jsonify({
+        "success": True,
+        "by": by,
+        "filters": filters,
+        "groups": result["groups"],
+        "production": np.round(result["production"], 2).tolist(),
+        "area": np.round(result["area"], 2).tolist(),
+        "yield_per_hectare": np.round(result["yield"], 4).tolist(),
+        "yield_quantiles": {q: np.round(values, 4).tolist() for q, values in result["yield_quantiles"].items()},
+        "records": result["records"].tolist(),
+        "unit": "tons",
+        "history_built_at": cube.manifest["created_at"]
+    })
+
+@app.route('/history/trends', methods=['GET'])
+def history_trends():
+    """Yearly historical production, area and yield, filtered by state/district/crop/season"""
+    return history_response('year')
+
+@app.route('/history/compare', methods=['GET'])
+def history_compare():
+    """Historical totals compared across crops, states, districts, seasons or years (?by=)"""
+    by = request.args.get('by', 'crop')
+    if by not in HISTORY_DIMENSIONS:
+        return jsonify({"error": f"'by' must be one of {', '.join(HISTORY_DIMENSIONS)}"}), 400
+    return history_response(by)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss/eviction counters for the prediction cache"""
+    return jsonify(prediction_cache.stats())
+
+@app.route('/batching/stats', methods=['GET'])
+def batching_stats():
+    """Batch size and queue wait histograms for the /predict micro-batcher"""
+    if micro_batcher is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **micro_batcher.stats()})
+
+@app.route('/shards/stats', methods=['GET'])
+def shards_stats():
+    """Resident shards and load/eviction counters when serving per-crop shards"""
+    artifacts = active_model
+    if artifacts is None or artifacts.inference_engine != 'sharded_flat_forest':
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **artifacts.engine.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Latency histograms and counters in the Prometheus text format"""
+    if not metrics.enabled:
+        return jsonify({"error": "Metrics are disabled"}), 404
+    body = metrics_spool.render() if metrics_spool is not None else metrics.render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/reload', methods=['POST'])
+def reload_model():
+    """Reload the model artifacts on demand and swap them in"""
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Reloading is disabled; set ML_ADMIN_TOKEN to enable it"}), 404
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), ADMIN_TOKEN.encode()):
+        return jsonify({"error": "Invalid or missing X-Admin-Token"}), 403
+    
+    if not load_model_and_encoders():
+        return jsonify({"error": "Reload failed; still serving the previous model"}), 500
+    
+    artifacts = active_model
+    return jsonify({
+        "success": True,
+        "model_version": artifacts.version,
+        "model_loaded_at": artifacts.loaded_at
+    })
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """Request profiles captured by the worker answering this call, newest first"""
+    if profiler is None:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    return jsonify({**profiler.stats(), "profiles": profiler.summaries()})
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """One profile (or 'latest') as pstats text, collapsed stacks or a binary .prof file"""
+    if profiler is None:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    
+    entry = profiler.get(profile_id)
+    if entry is None:
+        # Under serve.py each worker keeps its own ring; ids start with the worker's pid
+        return jsonify({"error": f"Profile '{profile_id}' not found in worker {os.getpid()}"}), 404
+    
+    output_format = request.args.get('format', 'pstats')
+    if output_format == 'pstats':
+        try:
+            limit = int(request.args.get('limit', 50))
+            report = render_pstats(entry['stats'], request.args.get('sort', 'cumulative'), limit)
+        except (KeyError, ValueError):
+            return jsonify({"error": "'sort' must be a pstats sort key and 'limit' an integer"}), 400
+        return Response(report, mimetype='text/plain')
+    if output_format == 'collapsed':
+        return Response(render_collapsed(entry['stats']), mimetype='text/plain')
+    if output_format == 'prof':
+        return Response(dump_pstats(entry['stats']), mimetype='application/octet-stream', headers={
+            'Content-Disposition': f"attachment; filename=profile-{entry['id']}.prof"
+        })
+    return jsonify({"error": "'format' must be pstats, collapsed or prof"}), 400
+
 @app.route('/', methods=['GET'])
 def home():
     return jsonify({
         "service": "Crop Yield Prediction ML API",
         "status": "running",
-        "model_loaded": model is not None,
+        "model_loaded": active_model is not None,
         "endpoints": [
             "/health",
             "/unique-values", 
             "/districts/<state>",
-            "/predict"
+            "/predict",
+            "/predict/batch",
+            "/predict/scenarios",
+            "/history/trends",
+            "/history/compare",
+            "/cache/stats",
+            "/batching/stats",
+            "/shards/stats",
+            "/metrics",
+            "/admin/reload",
+            "/admin/profiles",
+            "/admin/profiles/<id>"
         ]
     })
 
@@ -229,4 +894,7 @@ if __name__ == '__main__':
     else:
         print("⚠️  Model not loaded. Please train the model first.")
     
+    # Pick up new bundles from train_model.py without a restart
+    start_model_watcher()
+    
     app.run(host='0.0.0.0', port=8000, debug=False)
@@ -0,0 +1,98 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import Histogram
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+QUEUE_WAIT_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1]
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-record predictions into vectorized batches
+
+    Callers block in ``submit`` while a background thread collects queued
+    records and hands them to ``predict_fn`` as one list. A batch is flushed
+    once it holds ``max_batch_size`` records or ``max_wait`` seconds after
+    its first record was queued, whichever comes first.
+
+    Pass ``batch_sizes`` / ``queue_wait`` histograms to report into an
+    existing metrics registry.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait=0.002, batch_sizes=None, queue_wait=None):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_sizes = batch_sizes or Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_wait = queue_wait or Histogram(QUEUE_WAIT_BUCKETS)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, record, timeout=None):
+        """Queue one record and block until its prediction is ready"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((record, future, time.perf_counter()))
+        return future.result(timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        batch = [first]
+        deadline = first[2] + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # Past the deadline: take whatever is already queued
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self.batch_sizes.observe(len(batch))
+            for _, _, queued_at in batch:
+                self.queue_wait.observe(started - queued_at)
+
+            try:
+                results = self.predict_fn([record for record, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        """Configuration plus batch size and queue wait (seconds) histograms"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_seconds": self.max_wait,
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_seconds": self.queue_wait.snapshot()
+        }
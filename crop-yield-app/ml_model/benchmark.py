@@ -0,0 +1,379 @@
+"""Local benchmark suite for the ML API and model training
+
+Serving: drives app.py in-process (Flask test client) and over a local
+socket (a threaded server started here, or --url for a running one, e.g.
+serve.py) with synthetic requests drawn from data/unique_values.json, and
+reports p50/p95/p99 latency and requests per second for single, batch and
+concurrent /predict traffic.
+
+Training: fits the configured model on synthetic datasets of growing size
+with different n_jobs, each in a fresh process, and reports preparation
+and fit time plus peak resident memory.
+
+Results are written as JSON; --compare prints the change against an
+earlier run.
+
+    python benchmark.py
+    python benchmark.py --skip-training --url http://127.0.0.1:8000
+    python benchmark.py --train-sizes 20000 100000 --train-jobs 1 4 --compare benchmark_results.json
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+UNIQUE_VALUES_PATH = 'data/unique_values.json'
+RESULTS_PATH = 'benchmark_results.json'
+
+# Latency and throughput fields compared by --compare (higher is better for rps)
+COMPARED_FIELDS = ['p50_ms', 'p95_ms', 'p99_ms', 'rps']
+
+
+def load_unique_values(path=UNIQUE_VALUES_PATH):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def synthetic_records(unique_values, n, seed=0):
+    """/predict bodies with valid state/district pairs, random seasons, crops, years and areas"""
+    rng = random.Random(seed)
+    pairs = [(state, district) for state, districts in unique_values['district_state_mapping'].items()
+             for district in districts]
+    records = []
+    for _ in range(n):
+        state, district = rng.choice(pairs)
+        records.append({
+            "state_name": state,
+            "district_name": district,
+            "season": rng.choice(unique_values['seasons']),
+            "crop": rng.choice(unique_values['crops']),
+            "crop_year": rng.randint(2000, 2024),
+            "area": round(rng.uniform(1, 500), 2)
+        })
+    return records
+
+
+def summarize(latencies, elapsed, rows_per_request=1):
+    """Latency percentiles (ms) and throughput for one scenario"""
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "mean_ms": float(latencies.mean()),
+        "max_ms": float(latencies.max()),
+        "rps": len(latencies) / elapsed,
+        "rows_per_second": len(latencies) * rows_per_request / elapsed
+    }
+
+
+class InProcessClient:
+    """POSTs JSON through the Flask test client (no network, one client per thread)"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    def post(self, path, body):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.flask_app.test_client()
+        response = client.post(path, json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+
+
+class SocketClient:
+    """POSTs JSON over HTTP to a local server, one connection per thread"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self._local = threading.local()
+
+    def post(self, path, body):
+        payload = json.dumps(body)
+        for attempt in range(2):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                connection = self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                connection.request('POST', path, payload, {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed the connection (HTTP/1.0); reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"{path} returned {response.status}: {data[:200]!r}")
+        if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+            connection.close()
+            self._local.connection = None
+
+
+def run_scenario(client, path, bodies, threads=1, rows_per_request=1):
+    """Send every body (split over threads) and summarize the latencies"""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(share):
+        local = []
+        for body in share:
+            started = time.perf_counter()
+            client.post(path, body)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(bodies[i::threads],)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return summarize(latencies, time.perf_counter() - started, rows_per_request)
+
+
+def benchmark_client(client, unique_values, n_requests, batch_size, n_batches, threads, seed=0):
+    """Single, batch and concurrent /predict scenarios against one client"""
+    records = synthetic_records(unique_values, n_requests, seed)
+    batch_records = synthetic_records(unique_values, batch_size * n_batches, seed + 1)
+    batches = [{"records": batch_records[i:i + batch_size]} for i in range(0, len(batch_records), batch_size)]
+
+    # Warm up lazily loaded state (shards, page cache) before timing
+    run_scenario(client, '/predict', records[:min(20, n_requests)])
+    results = {
+        "single": run_scenario(client, '/predict', records),
+        "batch": run_scenario(client, '/predict/batch', batches, rows_per_request=batch_size),
+        "concurrent": run_scenario(client, '/predict', synthetic_records(unique_values, n_requests, seed + 2),
+                                   threads=threads)
+    }
+    results["concurrent"]["threads"] = threads
+    results["batch"]["batch_size"] = batch_size
+    return results
+
+
+def start_local_server(flask_app):
+    """Threaded HTTP server for flask_app on a free local port; returns (server, url)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="benchmark-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def benchmark_serving(unique_values, n_requests=500, batch_size=100, n_batches=20, threads=8, url=None,
+                      use_cache=False):
+    """Serving scenarios in-process and over a socket"""
+    import app as ml_app
+    if not ml_app.load_model_and_encoders():
+        raise SystemExit("❌ No model to benchmark; run train_model.py first")
+    artifacts = ml_app.active_model
+    if not use_cache:
+        # Measure the model path rather than the prediction cache
+        ml_app.prediction_cache.max_size = 0
+
+    print(f"⏱️  In-process: {n_requests} single, {n_batches} x {batch_size} batch, {threads} threads")
+    results = {
+        "model_version": artifacts.version,
+        "inference_engine": artifacts.inference_engine,
+        "model_backend": artifacts.estimator,
+        "prediction_cache": use_cache,
+        "in_process": benchmark_client(InProcessClient(ml_app.app), unique_values, n_requests, batch_size,
+                                       n_batches, threads)
+    }
+
+    server = None
+    if url is None:
+        server, url = start_local_server(ml_app.app)
+    print(f"⏱️  Socket ({url})...")
+    try:
+        results["socket"] = benchmark_client(SocketClient(url), unique_values, n_requests, batch_size,
+                                             n_batches, threads, seed=10)
+        results["socket"]["url"] = url if server is None else "local werkzeug server"
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+def synthetic_dataset(unique_values, n_rows, seed=0):
+    """Raw crop production rows (as in data/crop_production.csv) with a crop and area driven target"""
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    pairs = [(state, district) for state, districts in unique_values['district_state_mapping'].items()
+             for district in districts]
+    crops = np.array(unique_values['crops'])
+    crop_yield = rng.lognormal(0.5, 1.0, len(crops))
+
+    pair_index = rng.integers(len(pairs), size=n_rows)
+    crop_index = rng.integers(len(crops), size=n_rows)
+    area = np.round(rng.lognormal(5, 1.5, n_rows), 1) + 0.1
+    return pd.DataFrame({
+        'State_Name': [pairs[i][0] for i in pair_index],
+        'District_Name': [pairs[i][1] for i in pair_index],
+        'Crop_Year': rng.integers(1997, 2015, n_rows),
+        'Season': np.array(unique_values['seasons'])[rng.integers(len(unique_values['seasons']), size=n_rows)],
+        'Crop': crops[crop_index],
+        'Area': area,
+        'Production': np.round(area * crop_yield[crop_index] * rng.lognormal(0, 0.3, n_rows), 1)
+    })
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if platform.system() == 'Darwin' else peak / 1024
+
+
+def _training_run(unique_values, n_rows, n_jobs, backend):
+    """One training measurement; runs in a fresh process so peak memory is its own"""
+    from preprocessing import clean_crop_data, prepare_features
+    from train_model import DEFAULT_PARAMS, build_model, fit_scaler
+
+    df = synthetic_dataset(unique_values, n_rows)
+    baseline_rss = _peak_rss_mb()
+
+    started = time.perf_counter()
+    data = prepare_features(clean_crop_data(df))
+    prepare_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    scaler = fit_scaler(backend, data['X'])
+    model = build_model(backend, DEFAULT_PARAMS[backend], data['encoders'], n_jobs=n_jobs)
+    model.fit(scaler.transform(data['X']), data['y'])
+    fit_seconds = time.perf_counter() - started
+
+    return {
+        "rows": n_rows,
+        "training_rows": int(len(data['y'])),
+        "n_jobs": n_jobs,
+        "backend": backend,
+        "prepare_seconds": prepare_seconds,
+        "fit_seconds": fit_seconds,
+        # Peak includes the interpreter, imports and the raw frame (baseline)
+        "baseline_rss_mb": baseline_rss,
+        "peak_rss_mb": _peak_rss_mb()
+    }
+
+
+def benchmark_training(unique_values, sizes, jobs, backend='random_forest'):
+    """Training time and peak memory for every (dataset size, n_jobs) pair"""
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for n_rows in sizes:
+        for n_jobs in jobs:
+            print(f"⏱️  Training {backend} on {n_rows:,} synthetic rows with n_jobs={n_jobs}...")
+            with context.Pool(1) as pool:
+                result = pool.apply(_training_run, (unique_values, n_rows, n_jobs, backend))
+            print(f"   prepare {result['prepare_seconds']:.2f}s, fit {result['fit_seconds']:.2f}s, "
+                  f"peak {result['peak_rss_mb']:.0f} MB")
+            results.append(result)
+    return results
+
+
+def environment():
+    import sklearn
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scikit_learn": sklearn.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def print_serving(results):
+    print(f"\n📊 Serving ({results['model_backend']}, {results['inference_engine']}, model {results['model_version']})")
+    print(f"{'':24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'rows/s':>12}")
+    for transport in ['in_process', 'socket']:
+        for scenario in ['single', 'batch', 'concurrent']:
+            row = results[transport][scenario]
+            print(f"{transport + ' ' + scenario:24}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+                  f"{row['p99_ms']:>10.2f}{row['rps']:>10.0f}{row['rows_per_second']:>12,.0f}")
+
+
+def compare_runs(current, previous):
+    """Relative change of the serving latency/throughput fields against an earlier run"""
+    print(f"\n⚖️  Versus {previous['environment']['timestamp']}:")
+    for transport in ['in_process', 'socket']:
+        for scenario in ['single', 'batch', 'concurrent']:
+            try:
+                now, before = current['serving'][transport][scenario], previous['serving'][transport][scenario]
+            except (KeyError, TypeError):
+                continue
+            changes = ', '.join(f"{field} {(now[field] - before[field]) / before[field] * 100:+.1f}%"
+                                for field in COMPARED_FIELDS if before.get(field))
+            print(f"   {transport} {scenario}: {changes}")
+
+    before = {(run['rows'], run['n_jobs']): run for run in previous.get('training') or []}
+    for run in current.get('training') or []:
+        old = before.get((run['rows'], run['n_jobs']))
+        if old:
+            print(f"   training {run['rows']:,} rows n_jobs={run['n_jobs']}: "
+                  f"fit {(run['fit_seconds'] - old['fit_seconds']) / old['fit_seconds'] * 100:+.1f}%, "
+                  f"peak memory {(run['peak_rss_mb'] - old['peak_rss_mb']) / old['peak_rss_mb'] * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ML API and model training")
+    parser.add_argument('--output', default=RESULTS_PATH, help="JSON file for the results")
+    parser.add_argument('--compare', help="earlier results JSON to compare against")
+    parser.add_argument('--skip-serving', action='store_true')
+    parser.add_argument('--skip-training', action='store_true')
+    parser.add_argument('--requests', type=int, default=500, help="requests per single/concurrent scenario")
+    parser.add_argument('--batch-size', type=int, default=100, help="records per /predict/batch request")
+    parser.add_argument('--batches', type=int, default=20, help="/predict/batch requests")
+    parser.add_argument('--threads', type=int, default=8, help="client threads for the concurrent scenario")
+    parser.add_argument('--url', help="benchmark a running server over the socket instead of starting one")
+    parser.add_argument('--cache', action='store_true', help="keep the prediction cache enabled")
+    parser.add_argument('--train-sizes', type=int, nargs='+', default=[10_000, 50_000, 100_000])
+    parser.add_argument('--train-jobs', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument('--backend', default='random_forest', help="model family for the training runs")
+    args = parser.parse_args()
+
+    # Compared runs should load before the new results overwrite them
+    previous = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            previous = json.load(f)
+
+    unique_values = load_unique_values()
+    results = {"environment": environment(), "serving": None, "training": None}
+    if not args.skip_serving:
+        results["serving"] = benchmark_serving(unique_values, args.requests, args.batch_size, args.batches,
+                                               args.threads, args.url, args.cache)
+        print_serving(results["serving"])
+    if not args.skip_training:
+        results["training"] = benchmark_training(unique_values, args.train_sizes, args.train_jobs, args.backend)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✅ Wrote {args.output}")
+
+    if previous is not None:
+        compare_runs(results, previous)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Score large CSV/Parquet files offline with the deployed model
+
+Reads the input in chunks, validates and encodes each chunk with the same
+artifacts and rules as the API's /predict, scores the chunks in a pool of
+worker processes and writes the predictions chunk by chunk. Rows that fail
+validation go to a separate rejected-rows CSV with their 0-based input
+row number and the API's error message. At most two chunks per worker are in flight, so memory stays flat
+however large the input is.
+
+Input columns are the /predict fields (state_name, district_name, season,
+crop, crop_year, area); the training CSV's column names are accepted too.
+
+    python bulk_score.py plan.csv predictions.csv
+    python bulk_score.py plan.parquet predictions.parquet --jobs 8
+"""
+import argparse
+import os
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from model_store import read_artifacts
+warnings.filterwarnings('ignore')
+
+# Training CSV column -> /predict field
+COLUMN_ALIASES = {
+    'State_Name': 'state_name',
+    'District_Name': 'district_name',
+    'Season': 'season',
+    'Crop': 'crop',
+    'Crop_Year': 'crop_year',
+    'Area': 'area'
+}
+
+# Same default as /predict when crop_year is missing
+DEFAULT_CROP_YEAR = 2024
+
+DEFAULT_CHUNKSIZE = 100_000
+
+# Artifacts of this worker process, loaded on its first chunk
+_worker_artifacts = None
+
+
+def _load_worker_artifacts(sharded):
+    global _worker_artifacts
+    if _worker_artifacts is None:
+        _worker_artifacts = read_artifacts(sharded=sharded)
+    return _worker_artifacts
+
+
+def _numeric(chunk, column, default):
+    """Column as floats: missing cells get default, unparseable ones NaN"""
+    if column not in chunk:
+        return pd.Series(float(default), index=chunk.index)
+    raw = chunk[column]
+    return pd.to_numeric(raw, errors='coerce').mask(raw.isna(), default)
+
+
+def validate_chunk(chunk, encoder_index):
+    """Normalized inputs and a per-row error message (None for valid rows)
+
+    Applies the /predict rules column-wise; messages for unknown values come
+    from EncoderIndex.validation_error, as in the API.
+    """
+    chunk = chunk.rename(columns=COLUMN_ALIASES)
+    text = {
+        column: (chunk[column].fillna('').astype(str).str.strip() if column in chunk
+                 else pd.Series('', index=chunk.index))
+        for column in ['state_name', 'district_name', 'season', 'crop']
+    }
+    inputs = pd.DataFrame({
+        'state': text['state_name'],
+        'district': text['district_name'],
+        'season': text['season'],
+        'crop': text['crop'],
+        'year': _numeric(chunk, 'crop_year', DEFAULT_CROP_YEAR),
+        'area': _numeric(chunk, 'area', 0.0)
+    })
+
+    errors = np.full(len(inputs), None, dtype=object)
+    # Years must be whole numbers (as int() requires in the API); inf would also break the int64 cast
+    year = inputs['year'].to_numpy(dtype=float)
+    area = inputs['area'].to_numpy(dtype=float)
+    malformed = ~np.isfinite(year) | (year != np.round(year)) | ~np.isfinite(area)
+    errors[malformed] = "crop_year and area must be numbers"
+
+    complete = ((inputs[['state', 'district', 'season', 'crop']] != '').all(axis=1) & (inputs['area'] > 0)).to_numpy()
+    errors[~malformed & ~complete] = "All fields are required and area must be positive"
+
+    # Membership checks; districts are only valid within their state
+    state_districts = {f"{state}\x1f{district}" for state, districts in encoder_index.districts_by_state.items()
+                       for district in districts}
+    known = (inputs['state'].isin(encoder_index.states)
+             & (inputs['state'] + '\x1f' + inputs['district']).isin(state_districts)
+             & inputs['season'].isin(encoder_index.seasons)
+             & inputs['crop'].isin(encoder_index.crops)).to_numpy()
+    for i in np.flatnonzero(~known & (errors == None)):  # noqa: E711
+        row = inputs.iloc[i]
+        errors[i] = encoder_index.validation_error(row['state'], row['district'], row['season'], row['crop'])
+
+    inputs['year'] = np.where(malformed, 0, year).astype(np.int64)
+    return inputs, errors
+
+
+def score_chunk(chunk, first_row, sharded=False, quantiles=None):
+    """Validate, encode and score one chunk in a worker; returns (scored, rejected) frames
+
+    With ``quantiles`` the std and quantiles across the forest's trees are
+    added as production_std and production_q<quantile> columns.
+    """
+    artifacts = _load_worker_artifacts(sharded)
+    inputs, errors = validate_chunk(chunk, artifacts.encoder_index)
+    valid = errors == None  # noqa: E711
+
+    scored = inputs[valid]
+    predictions = np.empty(len(scored))
+    interval_columns = {}
+    if len(scored):
+        features_scaled = artifacts.encoder_index.encode_columns(
+            *(scored[column].to_numpy() for column in ['state', 'district', 'season', 'crop', 'year', 'area']))
+        if quantiles:
+            predictions, std, values = artifacts.predict_intervals(features_scaled, quantiles)
+            interval_columns['production_std'] = np.round(std, 2)
+            for q, column in zip(quantiles, values):
+                interval_columns[f"production_q{q:g}"] = np.round(column, 2)
+        else:
+            predictions = artifacts.predict(features_scaled)
+    elif quantiles:
+        interval_columns = {'production_std': [], **{f"production_q{q:g}": [] for q in quantiles}}
+    scored = scored.assign(
+        predicted_production=np.round(predictions, 2),
+        yield_per_hectare=np.round(predictions / scored['area'].to_numpy(), 2),
+        **interval_columns,
+        model_version=artifacts.version
+    )
+
+    rejected = chunk[~valid].copy()
+    rejected.insert(0, 'row', first_row + np.flatnonzero(~valid))
+    rejected['error'] = errors[~valid]
+    return scored, rejected
+
+
+def read_chunks(path, chunksize):
+    """(chunk, first row number) pairs from a CSV or Parquet file"""
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("❌ Parquet input needs pyarrow (pip install pyarrow)")
+        first_row = 0
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            chunk = batch.to_pandas()
+            yield chunk, first_row
+            first_row += len(chunk)
+        return
+
+    first_row = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype={column: str for column in
+                                                              ['state_name', 'district_name', 'season', 'crop',
+                                                               'State_Name', 'District_Name', 'Season', 'Crop']}):
+        yield chunk, first_row
+        first_row += len(chunk)
+
+
+class ChunkWriter:
+    """Appends DataFrames to one CSV or Parquet file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self._parquet = None
+        self._tmp_path = f"{path}.tmp-{os.getpid()}"
+
+    def write(self, frame):
+        if self.path.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self._tmp_path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            frame.to_csv(self._tmp_path, mode='a' if self.rows else 'w', header=not self.rows, index=False)
+        self.rows += len(frame)
+
+    def close(self, complete=True):
+        """Move the finished file into place (nothing is written for zero rows); else discard it"""
+        if self._parquet is not None:
+            self._parquet.close()
+        if not os.path.exists(self._tmp_path):
+            return
+        if complete:
+            os.replace(self._tmp_path, self.path)
+        else:
+            os.remove(self._tmp_path)
+
+
+def rejected_path_for(output_path):
+    stem = output_path.rsplit('.', 1)[0]
+    return f"{stem}.rejected.csv"
+
+
+def bulk_score(input_path, output_path, rejected_path=None, chunksize=DEFAULT_CHUNKSIZE, n_jobs=None, sharded=False,
+               quantiles=None):
+    """Score every row of input_path; returns (scored rows, rejected rows)"""
+    if output_path.endswith('.parquet'):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SystemExit("❌ Parquet output needs pyarrow (pip install pyarrow)")
+
+    rejected_path = rejected_path or rejected_path_for(output_path)
+    n_jobs = n_jobs or os.cpu_count() or 1
+    started = time.time()
+
+    # Load once here so missing artifacts fail before any worker starts
+    artifacts = read_artifacts(sharded=sharded)
+    if quantiles and not artifacts.supports_intervals:
+        raise SystemExit(f"❌ Prediction intervals need a random_forest model, not {artifacts.estimator}")
+    print(f"📦 Scoring {input_path} with model {artifacts.version} on {n_jobs} processes...")
+
+    writer = ChunkWriter(output_path)
+    rejected_writer = ChunkWriter(rejected_path)
+    chunks = read_chunks(input_path, chunksize)
+    if n_jobs == 1:
+        global _worker_artifacts
+        _worker_artifacts = artifacts
+        results = (score_chunk(chunk, first_row, sharded, quantiles) for chunk, first_row in chunks)
+    else:
+        # Ordered results; pre_dispatch bounds the chunks read ahead of the writer
+        results = Parallel(n_jobs=n_jobs, backend='loky', return_as='generator', pre_dispatch='2*n_jobs')(
+            delayed(score_chunk)(chunk, first_row, sharded, quantiles) for chunk, first_row in chunks
+        )
+
+    complete = False
+    try:
+        for scored, rejected in results:
+            writer.write(scored)
+            if len(rejected):
+                rejected_writer.write(rejected)
+            total = writer.rows + rejected_writer.rows
+            print(f"   {total:,} rows ({total / (time.time() - started):,.0f} rows/s)", end='\r')
+        complete = True
+    finally:
+        # A failed run leaves no partial output behind
+        writer.close(complete)
+        rejected_writer.close(complete)
+
+    elapsed = time.time() - started
+    total = writer.rows + rejected_writer.rows
+    print(f"\n✅ Scored {writer.rows:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s) "
+          f"→ {output_path}")
+    if rejected_writer.rows:
+        print(f"⚠️  Rejected {rejected_writer.rows:,} rows → {rejected_path}")
+    return writer.rows, rejected_writer.rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a CSV/Parquet file of prediction inputs offline")
+    parser.add_argument('input', help="CSV or .parquet file with the /predict fields")
+    parser.add_argument('output', help="CSV or .parquet file for the predictions")
+    parser.add_argument('--rejected', help="CSV for rows that fail validation (default: <output>.rejected.csv)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="rows per chunk")
+    parser.add_argument('--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--sharded', action='store_true', help="score with the per-crop shards (shards/index.json)")
+    parser.add_argument('--quantiles', type=float, nargs='+', metavar='Q',
+                        help="add prediction intervals: std and these quantiles across the trees (e.g. 0.05 0.95)")
+    args = parser.parse_args()
+
+    bulk_score(args.input, args.output, args.rejected, args.chunksize, args.jobs, args.sharded, args.quantiles)
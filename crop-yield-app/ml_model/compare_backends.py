@@ -0,0 +1,111 @@
+"""Compare the model backends on the same train/test split
+
+Trains every backend from train_model.py on the persisted split (or a fresh
+80/20 split) and reports training time, artifact size, single-row and batch
+predict latency and the evaluate_model.py metrics. Nothing is saved except
+an optional JSON report.
+
+    python compare_backends.py
+    python compare_backends.py --output backend_comparison.json
+"""
+import argparse
+import json
+import pickle
+import time
+import warnings
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from evaluate_model import regression_metrics
+from forest_engine import FlatForest, compare_latency, verify_parity
+from preprocessing import load_prepared_data, load_split
+from train_model import DEFAULT_PARAMS, MODEL_BACKENDS, build_model, fit_scaler
+warnings.filterwarnings('ignore')
+
+
+def benchmark_backend(backend, data, train_index, test_index, batch_size=1000):
+    """Train one backend and measure it; returns a flat dict of results"""
+    X_train, X_test = data['X'][train_index], data['X'][test_index]
+    y_train, y_test = data['y'][train_index], data['y'][test_index]
+    scaler = fit_scaler(backend, X_train)
+    X_train_scaled = scaler.transform(X_train)
+    X_test_scaled = scaler.transform(X_test)
+
+    print(f"🤖 Training {backend}...")
+    model = build_model(backend, DEFAULT_PARAMS[backend], data['encoders'])
+    started = time.perf_counter()
+    model.fit(X_train_scaled, y_train)
+    train_seconds = time.perf_counter() - started
+
+    # Served through the same flat engine as in production
+    engine = FlatForest.from_sklearn(model)
+    verify_parity(model, engine, n_rows=256)
+    timings = compare_latency(model, engine, batch_size=batch_size, X=X_test_scaled)
+
+    return {
+        'backend': backend,
+        'train_seconds': train_seconds,
+        'n_trees': engine.n_trees,
+        'n_nodes': engine.n_nodes,
+        'bundle_mb': sum(array.nbytes for array in engine.arrays().values()) / 1e6,
+        'pickle_mb': len(pickle.dumps(model)) / 1e6,
+        **timings,
+        **{key: float(value) for key, value in regression_metrics(y_test, engine.predict(X_test_scaled)).items()}
+    }
+
+
+def print_comparison(results):
+    rows = [
+        ('Training time (s)', 'train_seconds', '{:.2f}'),
+        ('Trees / iterations', 'n_trees', '{}'),
+        ('Nodes', 'n_nodes', '{:,}'),
+        ('Bundle arrays (MB)', 'bundle_mb', '{:.2f}'),
+        ('Pickle (MB)', 'pickle_mb', '{:.2f}'),
+        ('Single row, flat (ms)', 'flat_single_ms', '{:.3f}'),
+        ('Single row, sklearn (ms)', 'sklearn_single_ms', '{:.3f}'),
+        ('Batch, flat (ms)', 'flat_batch_ms', '{:.2f}'),
+        ('Batch, sklearn (ms)', 'sklearn_batch_ms', '{:.2f}'),
+        ('R²', 'r2', '{:.4f}'),
+        ('RMSE (tons)', 'rmse', '{:,.0f}'),
+        ('MAE (tons)', 'mae', '{:,.0f}'),
+        ('MAPE (%)', 'mape', '{:.1f}'),
+        ('Explained variance', 'ev_score', '{:.4f}'),
+        ('Max error (tons)', 'max_error', '{:,.0f}'),
+        ('Within 20% (%)', 'within_20_percent', '{:.1f}')
+    ]
+    print("\n" + "=" * 76)
+    print(f"{'':28}" + ''.join(f"{result['backend']:>24}" for result in results))
+    print("=" * 76)
+    for label, key, fmt in rows:
+        print(f"{label:28}" + ''.join(f"{fmt.format(result[key]):>24}" for result in results))
+    print(f"\nBatch size: {results[0]['batch_size']} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare model backends on the same split")
+    parser.add_argument('--backends', nargs='+', choices=MODEL_BACKENDS, default=MODEL_BACKENDS)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--output', help="write the results as JSON")
+    args = parser.parse_args()
+
+    split = load_split()
+    data = load_prepared_data(streaming=bool(split and split['streaming']))
+    if split is not None and split['cache_key'] == data['cache_key']:
+        print("📐 Using the train/test split of the last training run")
+        train_index, test_index = split['train_index'], split['test_index']
+    else:
+        train_index, test_index = train_test_split(np.arange(len(data['y'])), test_size=0.2, random_state=42)
+
+    results = [benchmark_backend(backend, data, train_index, test_index, args.batch_size)
+               for backend in args.backends]
+    print_comparison(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import json
+import numpy as np
+
+# Categorical columns in the order they appear in the feature matrix
+CATEGORICAL_FIELDS = ['state', 'district', 'season', 'crop']
+
+# Where train_model.py writes the label encoder vocabularies
+ENCODER_CLASSES_PATH = 'label_encoders/encoder_classes.json'
+
+
+def save_encoder_classes(encoders, path=ENCODER_CLASSES_PATH):
+    """Persist fitted label encoder vocabularies as plain JSON"""
+    with open(path, 'w') as f:
+        json.dump({field: encoders[field].classes_.tolist() for field in CATEGORICAL_FIELDS}, f, indent=2)
+
+
+def load_encoder_classes(path=ENCODER_CLASSES_PATH):
+    """Load label encoder vocabularies written by save_encoder_classes"""
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class EncoderIndex:
+    """Hash-map based replacement for LabelEncoder.transform + StandardScaler.transform
+
+    Codes are the positions in each encoder's ``classes_`` so they match what
+    the model was trained on. Validation uses the served ``unique_values``
+    with districts checked per state.
+    """
+
+    def __init__(self, classes, unique_values, scaler_mean, scaler_scale, year_min, year_max):
+        self.codes = {
+            field: {name: code for code, name in enumerate(classes[field])}
+            for field in CATEGORICAL_FIELDS
+        }
+        self.states = frozenset(unique_values['states'])
+        self.seasons = frozenset(unique_values['seasons'])
+        self.crops = frozenset(unique_values['crops'])
+        self.districts_by_state = {
+            state: frozenset(districts)
+            for state, districts in unique_values.get('district_state_mapping', {}).items()
+        }
+        self.mean = np.asarray(scaler_mean, dtype=float)
+        self.scale = np.asarray(scaler_scale, dtype=float)
+        self.year_min = year_min
+        self.year_max = year_max
+
+    def validation_error(self, state, district, season, crop):
+        """Return an error message for unknown values, or None if the record is valid"""
+        if state not in self.states:
+            return f"State '{state}' not found in training data"
+
+        if district not in self.districts_by_state.get(state, ()):
+            return f"District '{district}' not found in training data for state '{state}'"
+
+        if season not in self.seasons:
+            return f"Season '{season}' not found in training data"
+
+        if crop not in self.crops:
+            return f"Crop '{crop}' not found in training data"
+
+        return None
+
+    def encode(self, records):
+        """Build the scaled (n, 6) feature matrix for validated records"""
+        state_codes = self.codes['state']
+        district_codes = self.codes['district']
+        season_codes = self.codes['season']
+        crop_codes = self.codes['crop']
+        features = np.array([
+            [
+                state_codes[r['state']],
+                district_codes[r['district']],
+                season_codes[r['season']],
+                crop_codes[r['crop']],
+                r['year'],
+                r['area']
+            ]
+            for r in records
+        ], dtype=float)
+        features[:, 4] = (features[:, 4] - self.year_min) / (self.year_max - self.year_min)
+
+        features -= self.mean
+        features /= self.scale
+        return features
+
+    def encode_columns(self, states, districts, seasons, crops, years, areas):
+        """Columnar encode(): validated values as equal-length arrays"""
+        features = np.empty((len(years), len(CATEGORICAL_FIELDS) + 2))
+        for column, (field, values) in enumerate(zip(CATEGORICAL_FIELDS, (states, districts, seasons, crops))):
+            codes = self.codes[field]
+            features[:, column] = np.fromiter(map(codes.__getitem__, values), dtype=float, count=len(values))
+        features[:, 4] = (np.asarray(years, dtype=float) - self.year_min) / (self.year_max - self.year_min)
+        features[:, 5] = areas
+
+        features -= self.mean
+        features /= self.scale
+        return features
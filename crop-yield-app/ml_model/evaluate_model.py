@@ -1,8 +1,6 @@
-import pandas as pd
+import os
 import numpy as np
-from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import cross_val_score
 from sklearn.metrics import (
     mean_squared_error, 
     r2_score, 
@@ -11,79 +9,98 @@ from sklearn.metrics import (
     explained_variance_score,
     max_error
 )
-import joblib
+from joblib import parallel_config
 import warnings
+from model_bundle import BUNDLE_PATH, load_bundle
+from model_store import read_artifacts
+from preprocessing import load_prepared_data, load_split
+from sharding import SHARD_INDEX_PATH, load_shard_index
+from train_model import DEFAULT_PARAMS, build_model
 warnings.filterwarnings('ignore')
 
-def evaluate_crop_yield_model():
+def regression_metrics(y_test, y_pred):
+    """The evaluation metrics reported below, as a dict"""
+    errors = np.abs(y_test - y_pred)
+    mse = mean_squared_error(y_test, y_pred)
+    return {
+        'r2': r2_score(y_test, y_pred),
+        'mse': mse,
+        'rmse': np.sqrt(mse),
+        'mae': mean_absolute_error(y_test, y_pred),
+        'mape': mean_absolute_percentage_error(y_test, y_pred) * 100,
+        'ev_score': explained_variance_score(y_test, y_pred),
+        'max_error': max_error(y_test, y_pred),
+        'within_10_percent': np.mean(errors <= 0.1 * y_test) * 100,
+        'within_20_percent': np.mean(errors <= 0.2 * y_test) * 100,
+        'within_50_percent': np.mean(errors <= 0.5 * y_test) * 100
+    }
+
+def cross_validate_parallel(X, y, folds=5, n_jobs=None, backend='random_forest', encoders=None, params=None):
+    """k-fold R² scores with the folds trained in parallel worker processes
+    
+    joblib dumps X and y to a memory-mapped temp file once, so every worker
+    maps the same feature matrix instead of receiving its own copy. ``params``
+    are the evaluated model's hyperparameters (default: the backend defaults).
+    """
+    n_jobs = n_jobs or min(folds, os.cpu_count() or 1)
+    # One core per fold; nested tree parallelism would oversubscribe the CPUs
+    model = build_model(backend, params or DEFAULT_PARAMS[backend], encoders, n_jobs=1)
+    with parallel_config(backend='loky', max_nbytes='1M', mmap_mode='r'):
+        return cross_val_score(model, X, y, cv=folds, scoring='r2', n_jobs=n_jobs)
+
+def other_artifact_version(source):
+    """Version of the shard index if source is the global bundle and vice versa, or None"""
+    try:
+        if source == SHARD_INDEX_PATH:
+            return load_bundle(verify=False)['manifest']['version'] if os.path.exists(BUNDLE_PATH) else None
+        return load_shard_index()['version'] if os.path.exists(SHARD_INDEX_PATH) else None
+    except Exception:
+        return None
+
+def evaluate_crop_yield_model(use_cache=True, cv_folds=0, cv_jobs=None, sharded=False):
+    # Test rows are the ones held out by the last train_model.py run
+    split = load_split()
+    if split is None:
+        print("❌ No saved train/test split found; run train_model.py first")
+        return None
+    
+    # Load the deployed model (global bundle or shard index) instead of training a new one,
+    # and only score it on the split of the run that trained it
+    artifacts = read_artifacts(sharded=sharded)
+    if split['model_version'] is None:
+        print("⚠️  The saved split does not record its model; assuming it belongs to the deployed one")
+    elif split['model_version'] != artifacts.version:
+        loaded_shards = artifacts.source == SHARD_INDEX_PATH
+        print(f"❌ The saved split belongs to model {split['model_version']}, not {artifacts.version} "
+              f"({'shard index' if loaded_shards else 'global bundle'})")
+        if split['model_version'] == other_artifact_version(artifacts.source):
+            print(f"   Evaluate the {'global bundle' if loaded_shards else 'shard index'} instead "
+                  f"({'without' if loaded_shards else 'with'} --sharded)")
+        else:
+            print("   It belongs to an older model; run train_model.py again")
+        return None
+    
     print("🌾 Loading crop production dataset...")
     
-    # Load the dataset
-    df = pd.read_csv('data/crop_production.csv')
-    
-    # Clean the data (same as training)
-    df = df.dropna()
-    df['Area'] = pd.to_numeric(df['Area'], errors='coerce')
-    df['Production'] = pd.to_numeric(df['Production'], errors='coerce')
-    df['Crop_Year'] = pd.to_numeric(df['Crop_Year'], errors='coerce')
-    df = df.dropna(subset=['Area', 'Production', 'Crop_Year'])
-    df = df[(df['Area'] > 0) & (df['Production'] > 0) & (df['Crop_Year'] > 1900)]
-    
-    df['State_Name'] = df['State_Name'].str.strip()
-    df['District_Name'] = df['District_Name'].str.strip()
-    df['Season'] = df['Season'].str.strip()
-    df['Crop'] = df['Crop'].str.strip()
-    
-    df = df[(df['State_Name'] != '') & (df['District_Name'] != '') & 
-            (df['Season'] != '') & (df['Crop'] != '')]
-    
-    # Create features
-    le_state = LabelEncoder()
-    le_district = LabelEncoder()
-    le_season = LabelEncoder()
-    le_crop = LabelEncoder()
-    
-    df['state_encoded'] = le_state.fit_transform(df['State_Name'])
-    df['district_encoded'] = le_district.fit_transform(df['District_Name'])
-    df['season_encoded'] = le_season.fit_transform(df['Season'])
-    df['crop_encoded'] = le_crop.fit_transform(df['Crop'])
-    
-    df['year_normalized'] = (df['Crop_Year'] - df['Crop_Year'].min()) / (df['Crop_Year'].max() - df['Crop_Year'].min())
-    df['yield_per_hectare'] = df['Production'] / df['Area']
-    
-    q95 = df['yield_per_hectare'].quantile(0.95)
-    df = df[df['yield_per_hectare'] <= q95]
-    
-    # Select features
-    feature_columns = ['state_encoded', 'district_encoded', 'season_encoded', 
-                      'crop_encoded', 'year_normalized', 'Area']
-    
-    X = df[feature_columns]
-    y = df['Production']
-    
-    # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
-    # Scale features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
-    
-    # Train model
-    print("🤖 Training Random Forest model...")
-    model = RandomForestRegressor(
-        n_estimators=100,
-        max_depth=20,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1
-    )
-    
-    model.fit(X_train_scaled, y_train)
+    # Load, clean and encode the dataset (same pipeline and cache as training)
+    data = load_prepared_data(use_cache=use_cache, mmap_mode='r', streaming=split['streaming'])
+    if data['cache_key'] != split['cache_key']:
+        print("❌ The dataset changed since the model was trained; run train_model.py again")
+        return None
+    
+    X = data['X']
+    y = data['y']
+    
+    print(f"📦 Evaluating model {artifacts.version} ({artifacts.estimator}, {artifacts.inference_engine})")
+    
+    # Scale features with the scaler saved alongside the model
+    encoder_index = artifacts.encoder_index
+    X_test_scaled = (X[split['test_index']] - encoder_index.mean) / encoder_index.scale
+    y_test = np.asarray(y[split['test_index']], dtype=float)
     
     # Make predictions
-    y_pred = model.predict(X_test_scaled)
+    y_pred = artifacts.predict(X_test_scaled)
+    results = regression_metrics(y_test, y_pred)
     
     # Calculate comprehensive regression metrics
     print("\n" + "="*60)
@@ -91,55 +108,64 @@ def evaluate_crop_yield_model():
     print("="*60)
     
     # 1. R² Score (Coefficient of Determination)
-    r2 = r2_score(y_test, y_pred)
+    r2 = results['r2']
     print(f"\n1. R² Score (Coefficient of Determination): {r2:.4f}")
     print(f"   → Model explains {r2*100:.2f}% of the variance in crop production")
     print(f"   → This is your primary accuracy metric")
     
     # 2. Mean Squared Error (MSE)
-    mse = mean_squared_error(y_test, y_pred)
+    mse = results['mse']
     print(f"\n2. Mean Squared Error (MSE): {mse:,.2f}")
     print(f"   → Average squared difference between predicted and actual values")
     
     # 3. Root Mean Squared Error (RMSE)
-    rmse = np.sqrt(mse)
+    rmse = results['rmse']
     print(f"\n3. Root Mean Squared Error (RMSE): {rmse:,.2f} tons")
     print(f"   → Average prediction error in the same units as production (tons)")
     
     # 4. Mean Absolute Error (MAE)
-    mae = mean_absolute_error(y_test, y_pred)
+    mae = results['mae']
     print(f"\n4. Mean Absolute Error (MAE): {mae:,.2f} tons")
     print(f"   → Average absolute difference between predicted and actual values")
     
     # 5. Mean Absolute Percentage Error (MAPE)
-    mape = mean_absolute_percentage_error(y_test, y_pred) * 100
+    mape = results['mape']
     print(f"\n5. Mean Absolute Percentage Error (MAPE): {mape:.2f}%")
     print(f"   → Average percentage error in predictions")
     
     # 6. Explained Variance Score
-    ev_score = explained_variance_score(y_test, y_pred)
+    ev_score = results['ev_score']
     print(f"\n6. Explained Variance Score: {ev_score:.4f}")
     print(f"   → Proportion of variance explained by the model")
     
     # 7. Max Error
-    max_err = max_error(y_test, y_pred)
+    max_err = results['max_error']
     print(f"\n7. Maximum Error: {max_err:,.2f} tons")
     print(f"   → Largest prediction error in the test set")
     
-    # 8. Cross-Validation Score
-    print(f"\n8. Cross-Validation R² Score (5-fold):")
-    cv_scores = cross_val_score(model, X_train_scaled, y_train, cv=5, scoring='r2')
-    print(f"   → CV Scores: {cv_scores}")
-    print(f"   → Mean CV R²: {cv_scores.mean():.4f} ± {cv_scores.std():.4f}")
+    # 8. Cross-Validation Score (opt-in: trains one model per fold)
+    if cv_folds:
+        print(f"\n8. Cross-Validation R² Score ({cv_folds}-fold):")
+        X_train_scaled = (X[split['train_index']] - encoder_index.mean) / encoder_index.scale
+        model_params = (artifacts.manifest or {}).get('model_params')
+        if model_params is None:
+            print(f"   ⚠️  Model {artifacts.version} does not record its parameters; "
+                  f"using the {artifacts.estimator} defaults")
+        cv_scores = cross_validate_parallel(X_train_scaled, y[split['train_index']], cv_folds, cv_jobs,
+                                            artifacts.estimator, data['encoders'], model_params)
+        print(f"   → CV Scores: {cv_scores}")
+        print(f"   → Mean CV R²: {cv_scores.mean():.4f} ± {cv_scores.std():.4f}")
+    else:
+        cv_scores = None
+        print(f"\n8. Cross-Validation R² Score: skipped (pass --cv to run it)")
     
     # 9. Additional Metrics
     print(f"\n9. Additional Performance Metrics:")
     
-    # Calculate percentage of predictions within different error ranges
-    errors = np.abs(y_test - y_pred)
-    within_10_percent = np.mean(errors <= 0.1 * y_test) * 100
-    within_20_percent = np.mean(errors <= 0.2 * y_test) * 100
-    within_50_percent = np.mean(errors <= 0.5 * y_test) * 100
+    # Percentage of predictions within different error ranges
+    within_10_percent = results['within_10_percent']
+    within_20_percent = results['within_20_percent']
+    within_50_percent = results['within_50_percent']
     
     print(f"   → Predictions within 10% of actual: {within_10_percent:.1f}%")
     print(f"   → Predictions within 20% of actual: {within_20_percent:.1f}%")
@@ -176,12 +202,21 @@ def evaluate_crop_yield_model():
         'mape': mape,
         'ev_score': ev_score,
         'max_error': max_err,
-        'cv_mean': cv_scores.mean(),
-        'cv_std': cv_scores.std(),
+        'cv_mean': cv_scores.mean() if cv_scores is not None else None,
+        'cv_std': cv_scores.std() if cv_scores is not None else None,
         'within_10_percent': within_10_percent,
         'within_20_percent': within_20_percent,
         'within_50_percent': within_50_percent
     }
 
 if __name__ == "__main__":
-    evaluate_crop_yield_model()
+    import argparse
+    parser = argparse.ArgumentParser(description="Evaluate the crop yield model")
+    parser.add_argument('--no-cache', action='store_true', help="re-parse the CSV instead of using data/cache")
+    parser.add_argument('--cv', type=int, nargs='?', const=5, default=0, metavar='FOLDS',
+                        help="also run k-fold cross-validation (default 5 folds)")
+    parser.add_argument('--cv-jobs', type=int, default=None, help="worker processes for --cv (default: one per fold)")
+    parser.add_argument('--sharded', action='store_true', help="evaluate the per-crop shards (shards/index.json)")
+    args = parser.parse_args()
+    
+    evaluate_crop_yield_model(use_cache=not args.no_cache, cv_folds=args.cv, cv_jobs=args.cv_jobs, sharded=args.sharded)
@@ -0,0 +1,357 @@
+import argparse
+import time
+
+import numpy as np
+
+# Rows evaluated per pass; bounds the (n_trees, rows) working arrays
+DEFAULT_CHUNK_SIZE = 4096
+
+
+def _unpack_bitset(words):
+    """Bool array with one entry per bit of a uint32 bitset"""
+    return np.unpackbits(np.asarray(words, dtype='<u4').view(np.uint8), bitorder='little').astype(bool)
+
+
+def _boosting_inputs(model):
+    """Original column of every feature a HistGradientBoosting model's trees use
+
+    Recent sklearn versions ordinal-encode the categorical columns (moved to
+    the front) before binning; for those the raw category values behind each
+    encoded feature are returned as well, else None.
+    """
+    preprocessor = getattr(model, '_preprocessor', None)
+    if preprocessor is None:
+        return np.arange(model.n_features_in_), None
+
+    columns, categories = [], {}
+    for _, transformer, selection in preprocessor.transformers_:
+        selection = np.asarray(selection)
+        selected = np.flatnonzero(selection) if selection.dtype == bool else selection
+        if transformer == 'drop' or not len(selected):
+            continue
+        for i, raw_categories in enumerate(getattr(transformer, 'categories_', [])):
+            categories[len(columns) + i] = np.asarray(raw_categories).astype(np.intp)
+        columns.extend(selected)
+    return np.array(columns, dtype=np.intp), categories
+
+
+class FlatForest:
+    """Tree ensemble stored as contiguous node arrays and evaluated with NumPy
+
+    All trees share one set of arrays; ``roots`` holds the index of each
+    tree's root node. ``children`` interleaves (right, left) pairs so one
+    gather picks the next node. Leaves point to themselves, so every tree
+    can be walked in lock-step for ``max_depth`` steps without branching.
+
+    Random forests average their trees. Boosted ensembles (``baseline`` set)
+    add the tree outputs to the baseline and may split on categories: a
+    node with ``bitset_index >= 0`` goes left when the bit for the integer
+    category is set in its row of ``category_bitsets``. Codes outside the
+    bitset width (32 bits per column of ``category_bitsets``), negative ones
+    and NaN are read as the last code, which no category uses, so they take
+    the missing-value direction as in sklearn.
+
+    Arrays are kept in the dtypes used for evaluation, so memory-mapped
+    arrays from a model bundle are used as-is without private copies.
+    """
+
+    # Array name -> dtype, as stored in a model bundle
+    ARRAY_DTYPES = {
+        'feature': np.intp,
+        'threshold': np.float64,
+        'children': np.intp,
+        'value': np.float64,
+        'roots': np.intp
+    }
+
+    # Only present for ensembles with categorical splits
+    CATEGORICAL_ARRAY_DTYPES = {
+        'bitset_index': np.intp,
+        'category_bitsets': np.uint32
+    }
+
+    def __init__(self, feature, threshold, children, value, roots, max_depth,
+                 bitset_index=None, category_bitsets=None, baseline=None):
+        self.feature = np.ascontiguousarray(feature, dtype=np.intp)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.children = np.ascontiguousarray(children, dtype=np.intp)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.roots = np.ascontiguousarray(roots, dtype=np.intp)
+        self.max_depth = int(max_depth)
+        self.bitset_index = None
+        self.category_bitsets = None
+        if bitset_index is not None:
+            self.bitset_index = np.ascontiguousarray(bitset_index, dtype=np.intp)
+            self.category_bitsets = np.ascontiguousarray(category_bitsets, dtype=np.uint32)
+        self.baseline = None if baseline is None else float(baseline)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def boosted(self):
+        return self.baseline is not None
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Export a fitted sklearn forest, single tree or HistGradientBoosting regressor"""
+        if hasattr(model, '_predictors'):
+            return cls._from_hist_gradient_boosting(model)
+
+        estimators = getattr(model, 'estimators_', None)
+        if estimators is None:
+            estimators = [model]
+
+        features, thresholds, children, values, roots = [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in estimators:
+            tree = estimator.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("Only single-output regressors are supported")
+
+            node_ids = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+
+            # Leaves loop back to themselves so extra steps are no-ops
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            left = np.where(is_leaf, node_ids, tree.children_left) + offset
+            right = np.where(is_leaf, node_ids, tree.children_right) + offset
+            children.append(np.stack([right, left], axis=1).ravel())
+            values.append(tree.value[:, 0, 0])
+            roots.append(offset)
+
+            offset += tree.node_count
+            max_depth = max(max_depth, tree.max_depth)
+
+        return cls(
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.concatenate(children),
+            np.concatenate(values),
+            np.array(roots),
+            max_depth
+        )
+
+    @classmethod
+    def _from_hist_gradient_boosting(cls, model):
+        if model.loss not in ('squared_error', 'absolute_error', 'quantile'):
+            raise ValueError(f"Loss '{model.loss}' has a non-identity link and is not supported")
+
+        columns, categories = _boosting_inputs(model)
+        known_bitsets, feature_bitset = model._bin_mapper.make_known_categories_bitsets()
+        # Bitsets are re-indexed by the raw category codes the engine receives,
+        # keeping at least one unused code past the largest for unknown ones
+        n_raw = 256 if not categories else 32 * -(-max(int(c.max()) + 2 for c in categories.values()) // 32)
+
+        features, thresholds, children, values, roots = [], [], [], [], []
+        bitset_index, category_bitsets = [], []
+        offset = 0
+        n_bitsets = 0
+        max_depth = 0
+        for predictors in model._predictors:
+            if len(predictors) != 1:
+                raise ValueError("Only single-output regressors are supported")
+            nodes = predictors[0].nodes
+            raw_left_bitsets = predictors[0].raw_left_cat_bitsets
+
+            node_ids = np.arange(len(nodes))
+            is_leaf = nodes['is_leaf'].astype(bool)
+            features.append(np.where(is_leaf, 0, columns[nodes['feature_idx']]))
+            thresholds.append(np.where(is_leaf, 0.0, nodes['num_threshold']))
+            left = np.where(is_leaf, node_ids, nodes['left']) + offset
+            right = np.where(is_leaf, node_ids, nodes['right']) + offset
+            children.append(np.stack([right, left], axis=1).ravel())
+            values.append(nodes['value'])
+            roots.append(offset)
+
+            categorical = np.flatnonzero(nodes['is_categorical'].astype(bool) & ~is_leaf)
+            index = np.full(len(nodes), -1, dtype=np.intp)
+            index[categorical] = n_bitsets + np.arange(len(categorical))
+            bitset_index.append(index)
+            for node in categorical:
+                feature = nodes['feature_idx'][node]
+                missing_left = bool(nodes['missing_go_to_left'][node])
+                # Unknown categories follow the missing-value direction, as in sklearn
+                go_left = _unpack_bitset(raw_left_bitsets[nodes['bitset_idx'][node]])
+                go_left |= ~_unpack_bitset(known_bitsets[feature_bitset[feature]]) & missing_left
+                if categories:
+                    by_code = np.full(n_raw, missing_left)
+                    by_code[categories[feature]] = go_left[:len(categories[feature])]
+                    go_left = by_code
+                category_bitsets.append(np.packbits(go_left, bitorder='little').view('<u4'))
+            n_bitsets += len(categorical)
+
+            offset += len(nodes)
+            max_depth = max(max_depth, int(nodes['depth'].max()))
+
+        return cls(
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.concatenate(children),
+            np.concatenate(values),
+            np.array(roots),
+            max_depth,
+            bitset_index=np.concatenate(bitset_index) if n_bitsets else None,
+            category_bitsets=np.array(category_bitsets, dtype=np.uint32) if n_bitsets else None,
+            baseline=float(np.ravel(model._baseline_prediction)[0])
+        )
+
+    @classmethod
+    def from_arrays(cls, arrays, max_depth, baseline=None):
+        """Rebuild an engine from arrays() output, e.g. memory-mapped bundle arrays"""
+        optional = {name: arrays[name] for name in cls.CATEGORICAL_ARRAY_DTYPES if name in arrays}
+        return cls(max_depth=max_depth, baseline=baseline,
+                   **{name: arrays[name] for name in cls.ARRAY_DTYPES}, **optional)
+
+    def arrays(self):
+        """Node arrays by name, in the dtypes listed in ARRAY_DTYPES (and CATEGORICAL_ARRAY_DTYPES)"""
+        arrays = {name: getattr(self, name) for name in self.ARRAY_DTYPES}
+        if self.bitset_index is not None:
+            arrays.update({name: getattr(self, name) for name in self.CATEGORICAL_ARRAY_DTYPES})
+        return arrays
+
+    def is_leaf(self):
+        """Boolean mask of leaf nodes"""
+        return self.children[1::2] == np.arange(self.n_nodes)
+
+    def tree_predictions(self, X, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Leaf value of every tree for every row, shape (n_trees, n_rows)"""
+        # sklearn forests compare float32 inputs against float64 thresholds;
+        # histogram boosting compares the float64 inputs
+        X = np.ascontiguousarray(X, dtype=np.float64 if self.boosted else np.float32)
+        n_rows, n_features = X.shape
+        out = np.empty((self.n_trees, n_rows), dtype=np.float64)
+
+        for start in range(0, n_rows, chunk_size):
+            chunk = X[start:start + chunk_size]
+            n_chunk = chunk.shape[0]
+            flat = chunk.ravel()
+            row_offsets = (np.arange(n_chunk, dtype=np.intp) * n_features)[None, :]
+            nodes = np.repeat(self.roots[:, None], n_chunk, axis=1)
+            for _ in range(self.max_depth):
+                values = flat[row_offsets + self.feature[nodes]]
+                go_left = values <= self.threshold[nodes]
+                if self.bitset_index is not None:
+                    bitsets = self.bitset_index[nodes]
+                    categorical = bitsets >= 0
+                    codes = values[categorical].astype(np.intp)
+                    width = 32 * self.category_bitsets.shape[1]
+                    codes = np.where((codes >= 0) & (codes < width), codes, width - 1)
+                    words = self.category_bitsets[bitsets[categorical], codes >> 5]
+                    go_left[categorical] = (words >> (codes & 31)) & 1
+                nodes = self.children[2 * nodes + go_left]
+            out[:, start:start + n_chunk] = self.value[nodes]
+
+        return out
+
+    def predict(self, X):
+        """Mean (forests) or baseline plus sum (boosting) of the trees, equivalent to model.predict"""
+        if self.boosted:
+            return self.baseline + self.tree_predictions(X).sum(axis=0)
+        return self.tree_predictions(X).mean(axis=0)
+
+    def predict_intervals(self, X, quantiles):
+        """Mean, std and quantiles across the trees from one tree_predictions pass
+
+        Returns (mean, std, values) with values shaped (len(quantiles), n_rows).
+        Only forests qualify: boosted trees are additive corrections, not
+        independent estimates of the target.
+        """
+        if self.boosted:
+            raise ValueError("Prediction intervals need a random forest, not a boosted model")
+        trees = self.tree_predictions(X)
+        return trees.mean(axis=0), trees.std(axis=0), np.quantile(trees, quantiles, axis=0)
+
+
+def _parity_inputs(engine, n_features, n_rows, seed=0):
+    """Random rows plus rows that land exactly on split thresholds"""
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((n_rows, n_features))
+
+    internal = ~engine.is_leaf()
+    edge = X[:n_rows // 2]
+    for column in range(n_features):
+        thresholds = engine.threshold[internal & (engine.feature == column)]
+        if len(thresholds):
+            edge[:, column] = rng.choice(thresholds, len(edge)).astype(np.float32)
+
+    # Categorical columns take the integer codes their bitsets cover, plus
+    # negative and out-of-range (unseen) codes
+    if engine.bitset_index is not None:
+        n_codes = 32 * engine.category_bitsets.shape[1]
+        for column in np.unique(engine.feature[engine.bitset_index >= 0]):
+            X[:, column] = rng.integers(-2, n_codes + 40, n_rows)
+    return X
+
+
+def verify_parity(model, engine=None, n_rows=2000, rtol=1e-9, atol=1e-6):
+    """Check the flat engine reproduces model.predict; returns the max abs difference"""
+    engine = engine or FlatForest.from_sklearn(model)
+    X = _parity_inputs(engine, model.n_features_in_, n_rows)
+    expected = model.predict(X)
+    actual = engine.predict(X)
+    if not np.allclose(actual, expected, rtol=rtol, atol=atol):
+        raise AssertionError(f"Flat forest mismatch: max abs diff {np.abs(actual - expected).max()}")
+    return float(np.abs(actual - expected).max())
+
+
+def _time_call(fn, repeat):
+    """Median wall time of fn() in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def compare_latency(model, engine=None, batch_size=1000, repeat=50, X=None):
+    """Median single-row and batch latency for sklearn vs the flat engine
+
+    Rows are taken from X when given (needed for categorical features),
+    else drawn at random.
+    """
+    engine = engine or FlatForest.from_sklearn(model)
+    if X is None:
+        rng = np.random.default_rng(1)
+        X = rng.standard_normal((batch_size, model.n_features_in_))
+    row = X[:1]
+    batch = X[:batch_size]
+    return {
+        "sklearn_single_ms": _time_call(lambda: model.predict(row), repeat),
+        "flat_single_ms": _time_call(lambda: engine.predict(row), repeat),
+        "sklearn_batch_ms": _time_call(lambda: model.predict(batch), max(repeat // 5, 3)),
+        "flat_batch_ms": _time_call(lambda: engine.predict(batch), max(repeat // 5, 3)),
+        "batch_size": batch_size
+    }
+
+
+if __name__ == "__main__":
+    import joblib
+
+    parser = argparse.ArgumentParser(description="Check and benchmark the flat forest engine")
+    parser.add_argument('--model', default='crop_yield_model.pkl')
+    parser.add_argument('--rows', type=int, default=2000, help="rows used for the parity check")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"🌲 Loading {args.model}...")
+    model = joblib.load(args.model)
+    engine = FlatForest.from_sklearn(model)
+    print(f"Exported {engine.n_trees} {'boosted ' if engine.boosted else ''}trees, "
+          f"{engine.n_nodes:,} nodes, max depth {engine.max_depth}")
+
+    max_diff = verify_parity(model, engine, n_rows=args.rows)
+    print(f"✅ Parity check passed on {args.rows} rows (max abs diff {max_diff:.2e})")
+
+    timings = compare_latency(model, engine, batch_size=args.batch_size)
+    print("⏱️  Median latency (ms):")
+    print(f"   single row: sklearn {timings['sklearn_single_ms']:.2f} | flat {timings['flat_single_ms']:.2f}")
+    print(f"   batch of {args.batch_size}: sklearn {timings['sklearn_batch_ms']:.2f} | flat {timings['flat_batch_ms']:.2f}")
@@ -0,0 +1,98 @@
+"""Builds the historical statistics cube served by history_cube.py
+
+Training-side only: aggregating the raw CSV needs pandas and the
+preprocessing module, which the API does not import.
+"""
+import numpy as np
+import pandas as pd
+
+from history_cube import DIMENSION_COLUMNS, DIMENSIONS, HISTORY_CUBE_PATH, HistoryCube, load_history_cube, save_history_cube
+from preprocessing import DATA_PATH, DEFAULT_CHUNKSIZE, clean_crop_data
+
+# Raw columns identifying one cell
+CELL_KEYS = list(DIMENSION_COLUMNS.values()) + ['Crop_Year']
+
+
+def aggregate_cells(df):
+    """Cells (CELL_KEYS, production, area, records) of cleaned rows"""
+    return df.groupby(CELL_KEYS, sort=False).agg(
+        production=('Production', 'sum'),
+        area=('Area', 'sum'),
+        records=('Production', 'size')
+    )
+
+
+def cube_from_cells(cells, source_key=None):
+    """HistoryCube from a frame of cells with CELL_KEYS columns"""
+    arrays, vocabularies = {}, {}
+    for dim, column in DIMENSION_COLUMNS.items():
+        codes, names = pd.factorize(cells[column], sort=True)
+        arrays[dim] = codes
+        vocabularies[dim] = names.tolist()
+    arrays['year'] = cells['Crop_Year'].to_numpy()
+    for column in ['production', 'area', 'records']:
+        arrays[column] = cells[column].to_numpy()
+    return HistoryCube.from_arrays(arrays, vocabularies, source_key)
+
+
+def build_history_cube(csv_path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE, source_key=None):
+    """Aggregate the CSV chunk by chunk into a HistoryCube"""
+    parts = [aggregate_cells(clean_crop_data(chunk)) for chunk in pd.read_csv(csv_path, chunksize=chunksize)]
+    # Cells split across chunks are summed once more
+    cells = pd.concat(parts).groupby(level=list(range(len(CELL_KEYS))), sort=False).sum().reset_index()
+    return cube_from_cells(cells, source_key)
+
+
+def refresh_history_cube(csv_path=DATA_PATH, source_key=None, path=HISTORY_CUBE_PATH):
+    """Rebuild the saved cube unless it was built from the same prepared data (source_key)"""
+    try:
+        current = load_history_cube(path)
+    except Exception:
+        current = None
+    if source_key is not None and current is not None and current.manifest.get('source_key') == source_key:
+        return current
+    cube = build_history_cube(csv_path, source_key=source_key)
+    save_history_cube(cube, path)
+    return cube
+
+
+def merge_history_rows(raw, path=HISTORY_CUBE_PATH):
+    """Fold new raw CSV rows into the saved cube without re-reading the whole CSV
+
+    Only the new rows are cleaned and aggregated; their cells are added to
+    the matching cells of the cube, or appended as new ones. Without a
+    saved cube this is a full rebuild.
+    """
+    current = load_history_cube(path, mmap_mode=None)
+    if current is None:
+        return refresh_history_cube(path=path)
+    cells = aggregate_cells(clean_crop_data(raw.copy())).reset_index()
+
+    # Merged vocabularies stay sorted, so existing codes are remapped
+    arrays, vocabularies = {}, {}
+    for dim, column in DIMENSION_COLUMNS.items():
+        names = sorted(set(current.vocabularies[dim]).union(cells[column]))
+        codes = {name: code for code, name in enumerate(names)}
+        remap = np.array([codes[name] for name in current.vocabularies[dim]], dtype=np.int32)
+        arrays[dim] = np.concatenate([remap[current.arrays[dim]], cells[column].map(codes).to_numpy(dtype=np.int32)])
+        vocabularies[dim] = names
+    arrays['year'] = np.concatenate([current.arrays['year'], cells['Crop_Year'].to_numpy(dtype=np.int32)])
+    for column in ['production', 'area', 'records']:
+        arrays[column] = np.concatenate([current.arrays[column], cells[column].to_numpy(dtype=np.float64)])
+
+    # New rows for an existing cell add to its totals; cells are matched on
+    # one int64 key built from the dimension codes
+    year_min = int(arrays['year'].min())
+    sizes = [len(vocabularies[dim]) for dim in DIMENSION_COLUMNS] + [int(arrays['year'].max()) - year_min + 1]
+    key = np.zeros(len(arrays['year']), dtype=np.int64)
+    for dim, size in zip(DIMENSIONS, sizes):
+        key = key * size + (arrays[dim] - (year_min if dim == 'year' else 0))
+    cell_keys, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    merged = {dim: arrays[dim][first] for dim in DIMENSIONS}
+    for column in ['production', 'area', 'records']:
+        merged[column] = np.bincount(inverse, weights=arrays[column], minlength=len(cell_keys))
+    merged['records'] = np.rint(merged['records'])
+
+    cube = HistoryCube.from_arrays(merged, vocabularies)
+    save_history_cube(cube, path)
+    return cube
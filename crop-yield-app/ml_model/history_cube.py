@@ -0,0 +1,178 @@
+"""Precomputed statistics over the historical crop production data
+
+train_model.py aggregates data/crop_production.csv (cleaned, without the
+training outlier filter) into one cell per state x district x crop x
+season x year holding total production, area and the number of records;
+the builders live in history_builder.py so serving needs only NumPy.
+The cells are stored as columns sorted by crop, with offset indexes by
+crop and by state, so the API answers trend and comparison queries by
+slicing and np.bincount instead of scanning raw rows. Yield quantiles are
+taken over the cells of each group (e.g. across districts and seasons for
+one year).
+"""
+import os
+from datetime import datetime
+
+import joblib
+import numpy as np
+
+HISTORY_CUBE_PATH = 'history_cube.joblib'
+HISTORY_FORMAT_VERSION = 1
+
+# Categorical dimensions -> raw CSV column; 'year' is the fifth dimension
+DIMENSION_COLUMNS = {
+    'state': 'State_Name',
+    'district': 'District_Name',
+    'crop': 'Crop',
+    'season': 'Season'
+}
+DIMENSIONS = list(DIMENSION_COLUMNS) + ['year']
+
+# Per-cell columns: dimension codes (and the year), then the totals
+CELL_COLUMNS = DIMENSIONS + ['production', 'area', 'records']
+
+DEFAULT_QUANTILES = [0.25, 0.5, 0.75]
+
+
+def _offsets(sorted_codes, n_codes):
+    """Start of every code's run in sorted_codes, plus the end"""
+    return np.searchsorted(sorted_codes, np.arange(n_codes + 1)).astype(np.intp)
+
+
+class HistoryCube:
+    """Columnar aggregate cube with crop and state offset indexes"""
+
+    def __init__(self, arrays, vocabularies, manifest):
+        self.arrays = arrays
+        self.vocabularies = vocabularies
+        self.manifest = manifest
+        self.codes = {dim: {name: code for code, name in enumerate(names)} for dim, names in vocabularies.items()}
+
+    @property
+    def n_cells(self):
+        return len(self.arrays['year'])
+
+    @classmethod
+    def from_arrays(cls, arrays, vocabularies, source_key=None):
+        """Build from CELL_COLUMNS arrays; dimension values are codes into vocabularies"""
+        arrays = {
+            **{dim: np.asarray(arrays[dim], dtype=np.int32) for dim in DIMENSIONS},
+            'production': np.asarray(arrays['production'], dtype=np.float64),
+            'area': np.asarray(arrays['area'], dtype=np.float64),
+            'records': np.asarray(arrays['records'], dtype=np.int32)
+        }
+
+        # Crop-major order so one crop is one contiguous slice
+        order = np.lexsort([arrays[dim] for dim in reversed(['crop', 'state', 'district', 'season', 'year'])])
+        arrays = {name: array[order] for name, array in arrays.items()}
+        arrays['crop_offsets'] = _offsets(arrays['crop'], len(vocabularies['crop']))
+        arrays['state_order'] = np.argsort(arrays['state'], kind='stable').astype(np.intp)
+        arrays['state_offsets'] = _offsets(arrays['state'][arrays['state_order']], len(vocabularies['state']))
+
+        manifest = {
+            "format_version": HISTORY_FORMAT_VERSION,
+            "created_at": datetime.now().isoformat(),
+            "source_key": source_key,
+            "cells": int(len(order)),
+            "records": int(arrays['records'].sum()),
+            "year_min": int(arrays['year'].min()) if len(order) else None,
+            "year_max": int(arrays['year'].max()) if len(order) else None
+        }
+        return cls(arrays, vocabularies, manifest)
+
+    def rows(self, filters):
+        """Cell indices matching filters: {dimension: [names or years]}, 'year_min', 'year_max'
+
+        A crop or state filter is answered from its offset index; the other
+        filters only mask that slice.
+        """
+        arrays = self.arrays
+        if filters.get('crop'):
+            codes = [self.codes['crop'][name] for name in filters['crop']]
+            offsets = arrays['crop_offsets']
+            rows = np.concatenate([np.arange(offsets[code], offsets[code + 1]) for code in codes])
+            indexed = 'crop'
+        elif filters.get('state'):
+            codes = [self.codes['state'][name] for name in filters['state']]
+            offsets = arrays['state_offsets']
+            rows = np.concatenate([arrays['state_order'][offsets[code]:offsets[code + 1]] for code in codes])
+            indexed = 'state'
+        else:
+            rows = np.arange(self.n_cells)
+            indexed = None
+
+        keep = np.ones(len(rows), dtype=bool)
+        for dim in DIMENSION_COLUMNS:
+            if dim != indexed and filters.get(dim):
+                codes = [self.codes[dim][name] for name in filters[dim]]
+                keep &= np.isin(arrays[dim][rows], codes)
+        years = arrays['year'][rows]
+        if filters.get('year'):
+            keep &= np.isin(years, filters['year'])
+        if filters.get('year_min') is not None:
+            keep &= years >= filters['year_min']
+        if filters.get('year_max') is not None:
+            keep &= years <= filters['year_max']
+        return rows[keep]
+
+    def unknown_value(self, filters):
+        """(dimension, name) of the first filter value not in the history, or None"""
+        for dim in DIMENSION_COLUMNS:
+            for name in filters.get(dim) or []:
+                if name not in self.codes[dim]:
+                    return dim, name
+        return None
+
+    def aggregate(self, filters, by, quantiles=DEFAULT_QUANTILES):
+        """Totals, area-weighted yield and cell-yield quantiles per value of ``by``, as columns"""
+        rows = self.rows(filters)
+        keys = self.arrays[by][rows]
+        groups, inverse = np.unique(keys, return_inverse=True)
+        # bincount returns int64 for empty input even with weights
+        production = np.bincount(inverse, weights=self.arrays['production'][rows],
+                                 minlength=len(groups)).astype(np.float64)
+        area = np.bincount(inverse, weights=self.arrays['area'][rows], minlength=len(groups)).astype(np.float64)
+        records = np.bincount(inverse, weights=self.arrays['records'][rows], minlength=len(groups))
+        cells = np.bincount(inverse, minlength=len(groups))
+
+        # Linear-interpolated quantiles of the cell yields, all groups at once
+        cell_yield = self.arrays['production'][rows] / self.arrays['area'][rows]
+        order = np.lexsort((cell_yield, inverse))
+        sorted_yield = cell_yield[order]
+        starts = np.cumsum(cells) - cells
+        yield_quantiles = {}
+        for q in quantiles:
+            position = starts + q * (cells - 1)
+            lower = np.floor(position).astype(np.intp)
+            upper = np.minimum(lower + 1, starts + cells - 1)
+            fraction = position - lower
+            yield_quantiles[f"{q:g}"] = sorted_yield[lower] * (1 - fraction) + sorted_yield[upper] * fraction
+
+        names = groups.tolist() if by == 'year' else [self.vocabularies[by][code] for code in groups]
+        return {
+            "by": by,
+            "groups": names,
+            "production": production,
+            "area": area,
+            "yield": np.divide(production, area, out=np.zeros_like(production), where=area > 0),
+            "records": records.astype(np.int64),
+            "cells": cells,
+            "yield_quantiles": yield_quantiles
+        }
+
+
+def save_history_cube(cube, path=HISTORY_CUBE_PATH):
+    """Write the cube next to path and rename it into place"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    joblib.dump({"manifest": cube.manifest, "arrays": cube.arrays, "vocabularies": cube.vocabularies}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_history_cube(path=HISTORY_CUBE_PATH, mmap_mode='r'):
+    """Load a saved cube (arrays memory-mapped), or None if none was built"""
+    if not os.path.exists(path):
+        return None
+    saved = joblib.load(path, mmap_mode=mmap_mode)
+    if saved['manifest'].get('format_version') != HISTORY_FORMAT_VERSION:
+        raise ValueError(f"Unsupported history cube format {saved['manifest'].get('format_version')!r}")
+    return HistoryCube(saved['arrays'], saved['vocabularies'], saved['manifest'])
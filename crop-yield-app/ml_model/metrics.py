@@ -0,0 +1,358 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# Buffered observations per metric before they are folded into the totals
+FLUSH_THRESHOLD = 1024
+
+# Default latency buckets in seconds, tuned for sub-millisecond stages
+LATENCY_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5]
+
+
+class Histogram:
+    """Fixed-bucket histogram with cumulative (Prometheus-style) buckets
+
+    ``observe`` only appends to a deque (atomic under the GIL, no lock);
+    pending values are bucketed in bulk with NumPy when the buffer fills
+    up or a snapshot is taken. This keeps hot-path timers to ~100 ns.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._bounds = np.asarray(self.buckets, dtype=float)
+        self._counts = np.zeros(len(self.buckets) + 1, dtype=np.int64)
+        self._sum = 0.0
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        pending = self._pending
+        pending.append(value)
+        if len(pending) >= FLUSH_THRESHOLD:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            n = len(self._pending)
+            if not n:
+                return
+            popleft = self._pending.popleft
+            values = np.fromiter((popleft() for _ in range(n)), dtype=float, count=n)
+            indices = np.searchsorted(self._bounds, values, side='left')
+            self._counts += np.bincount(indices, minlength=len(self._counts))
+            self._sum += float(values.sum())
+
+    def snapshot(self):
+        """Cumulative counts per upper bound, plus total count and sum"""
+        self._flush()
+        with self._lock:
+            counts = self._counts.tolist()
+            total = self._sum
+
+        cumulative = []
+        running = 0
+        for bound, count in zip(self.buckets + ['+Inf'], counts):
+            running += count
+            cumulative.append([bound, running])
+        return {"buckets": cumulative, "count": running, "sum": total}
+
+
+class Counter:
+    """Monotonically increasing counter; increments are lock-free appends"""
+
+    def __init__(self):
+        self._value = 0
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        pending = self._pending
+        pending.append(amount)
+        if len(pending) >= FLUSH_THRESHOLD:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            popleft = self._pending.popleft
+            self._value += sum(popleft() for _ in range(len(self._pending)))
+
+    @property
+    def value(self):
+        self._flush()
+        return self._value
+
+
+class Gauge:
+    """Value that can be set to anything"""
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class MetricFamily:
+    """A named metric with one child per combination of label values"""
+
+    def __init__(self, name, help_text, kind, labelnames, factory):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        # Raw label values -> child, so hot paths skip the str() conversion
+        self._lookup = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Child metric for these label values"""
+        child = self._lookup.get(values)
+        if child is None:
+            with self._lock:
+                key = tuple(str(v) for v in values)
+                child = self._children.setdefault(key, self._factory())
+                self._lookup[values] = child
+        return child
+
+    def collect(self):
+        """Current values as plain data (histograms as Histogram.snapshot() dicts)"""
+        samples = [[list(values), child.snapshot() if self.kind == 'histogram' else child.value]
+                   for values, child in sorted(self._children.items())]
+        return {"name": self.name, "help": self.help_text, "kind": self.kind,
+                "labelnames": list(self.labelnames), "samples": samples}
+
+
+def render_families(families):
+    """Prometheus text format for collected families"""
+    lines = []
+    for family in families:
+        name, labelnames = family['name'], family['labelnames']
+        lines.extend([f"# HELP {name} {family['help']}", f"# TYPE {name} {family['kind']}"])
+        for values, value in family['samples']:
+            if family['kind'] == 'histogram':
+                for bound, count in value['buckets']:
+                    labels = _format_labels(labelnames, values, [('le', bound)])
+                    lines.append(f"{name}_bucket{labels} {count}")
+                labels = _format_labels(labelnames, values)
+                lines.append(f"{name}_sum{labels} {value['sum']}")
+                lines.append(f"{name}_count{labels} {value['count']}")
+            else:
+                lines.append(f"{name}{_format_labels(labelnames, values)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def _add_values(kind, total, value):
+    if kind != 'histogram':
+        return total + value
+    return {
+        "buckets": [[bound, count + other] for (bound, count), (_, other) in zip(total['buckets'], value['buckets'])],
+        "count": total['count'] + value['count'],
+        "sum": total['sum'] + value['sum']
+    }
+
+
+def merge_families(snapshots, include_gauges=True):
+    """Combine collected families of several processes, given as (pid, families) pairs
+
+    Counters and histograms are summed. Gauges are per process, so they
+    keep a ``pid`` label (or are left out without ``include_gauges``).
+    """
+    merged = {}
+    for pid, families in snapshots:
+        for family in families:
+            kind = family['kind']
+            if kind == 'gauge' and not include_gauges:
+                continue
+            entry = merged.get(family['name'])
+            if entry is None:
+                labelnames = family['labelnames'] + (['pid'] if kind == 'gauge' and pid is not None else [])
+                entry = merged[family['name']] = {**family, "labelnames": labelnames, "samples": {}}
+            for values, value in family['samples']:
+                if kind == 'gauge':
+                    key = tuple(values) + ((str(pid),) if pid is not None else ())
+                    entry['samples'][key] = value
+                    continue
+                key = tuple(values)
+                current = entry['samples'].get(key)
+                entry['samples'][key] = value if current is None else _add_values(kind, current, value)
+    return [{**entry, "samples": [[list(key), value] for key, value in sorted(entry['samples'].items())]}
+            for entry in merged.values()]
+
+
+class MetricsRegistry:
+    """Collection of metric families rendered in the Prometheus text format"""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._families = []
+        self._callbacks = []
+
+    def _add(self, family):
+        self._families.append(family)
+        return family
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(MetricFamily(name, help_text, 'counter', labelnames, Counter))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(MetricFamily(name, help_text, 'gauge', labelnames, Gauge))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self._add(MetricFamily(name, help_text, 'histogram', labelnames, lambda: Histogram(buckets)))
+
+    def callback(self, name, help_text, kind, fn):
+        """Metric whose value is read from fn() at render time"""
+        self._callbacks.append((name, help_text, kind, fn))
+
+    def collect(self):
+        """Every family and callback as plain data, for render_families / merge_families"""
+        families = [family.collect() for family in self._families]
+        for name, help_text, kind, fn in self._callbacks:
+            families.append({"name": name, "help": help_text, "kind": kind, "labelnames": [], "samples": [[[], fn()]]})
+        return families
+
+    def render(self):
+        return render_families(self.collect())
+
+
+# Where the spool keeps the summed values of exited processes
+ARCHIVE_NAME = 'archive.json'
+
+
+def reset_spool(directory):
+    """Create an empty spool directory, dropping files of a previous server"""
+    os.makedirs(directory, exist_ok=True)
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            os.remove(entry.path)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MetricsSpool:
+    """Shares one registry's values between the worker processes of a server
+
+    Each process writes its collect() output to ``<directory>/<pid>.json``,
+    from a background thread every ``interval`` seconds and whenever it
+    renders. ``render`` merges the files of all processes, so counters and
+    histograms cover the whole server whichever worker is scraped; other
+    workers' values are at most ``interval`` seconds old. Files of exited
+    workers are summed into an archive so totals never go backwards; their
+    gauges are dropped.
+    """
+
+    def __init__(self, registry, directory, interval=1.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._started_pid = None
+        # Serializes the publisher thread and request threads of one process
+        self._write_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _write_json(self, path, data):
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _read_json(self, path):
+        """Contents of a spool file, or None if it vanished or cannot be parsed"""
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _locked(self, exclusive):
+        # Only serve.py (POSIX-only gunicorn) uses the spool, so app.py still imports on Windows
+        import fcntl
+        lock = open(os.path.join(self.directory, '.lock'), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return lock
+
+    def write(self):
+        """Publish this process's current values"""
+        with self._write_lock:
+            self._write_json(os.path.join(self.directory, f"{os.getpid()}.json"), self.registry.collect())
+
+    def compact(self, stale_pids=()):
+        """Fold the files of exited processes (and stale_pids) into the archive"""
+        with self._locked(exclusive=True):
+            archive_path = os.path.join(self.directory, ARCHIVE_NAME)
+            stale = []
+            for entry in os.scandir(self.directory):
+                name, ext = os.path.splitext(entry.name)
+                if ext == '.json' and name.isdigit() and (int(name) in stale_pids or not _pid_alive(int(name))):
+                    stale.append(entry.path)
+            if not stale:
+                return
+
+            snapshots = []
+            for path in ([archive_path] if os.path.exists(archive_path) else []) + stale:
+                snapshot = self._read_json(path)
+                if snapshot is not None:
+                    snapshots.append((None, snapshot))
+            self._write_json(archive_path, merge_families(snapshots, include_gauges=False))
+            for path in stale:
+                os.remove(path)
+
+    def start(self):
+        """Start publishing from a daemon thread; once per process"""
+        if self._started_pid == os.getpid():
+            return
+        self._started_pid = os.getpid()
+
+        # A file under this pid belongs to an exited process that had the same pid
+        self.compact(stale_pids={os.getpid()})
+        self.write()
+        threading.Thread(target=self._run, name="metrics-spool", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except Exception as e:
+                print(f"⚠️  Could not publish metrics: {e}")
+
+    def render(self):
+        """Prometheus text merged across every process of the server"""
+        self.write()
+        self.compact()
+        snapshots = []
+        with self._locked(exclusive=False):
+            for entry in os.scandir(self.directory):
+                name, ext = os.path.splitext(entry.name)
+                snapshot = self._read_json(entry.path) if ext == '.json' else None
+                if snapshot is not None:
+                    snapshots.append((int(name) if name.isdigit() else None, snapshot))
+        # This process first, so families keep the registry's order
+        snapshots.sort(key=lambda snapshot: (snapshot[0] != os.getpid(), snapshot[0] or 0))
+        return render_families(merge_families(snapshots))
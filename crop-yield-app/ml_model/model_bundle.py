@@ -0,0 +1,103 @@
+import hashlib
+import os
+from datetime import datetime
+
+import joblib
+import numpy as np
+
+from forest_engine import FlatForest
+
+# Single-file serving artifact written by train_model.py
+BUNDLE_PATH = 'crop_yield_bundle.joblib'
+
+# Bump when the bundle layout changes incompatibly. Forest bundles are still
+# written as version 1 so older servers keep loading them; boosted bundles
+# are version 2 so older servers refuse them instead of averaging the trees.
+BUNDLE_FORMAT_VERSION = 2
+SUPPORTED_FORMAT_VERSIONS = (1, 2)
+
+
+class BundleError(Exception):
+    """Raised when a model bundle is missing, incompatible or corrupt"""
+
+
+def _array_checksum(array):
+    return hashlib.sha256(np.ascontiguousarray(array).data).hexdigest()
+
+
+def save_bundle(engine, encoder_classes, scaler, unique_values, year_min, year_max,
+                feature_columns, metrics=None, yield_cutoff=None, training_rows=None, model_params=None,
+                path=BUNDLE_PATH):
+    """Write the serving artifacts as one versioned, memory-mappable file
+
+    The file is written next to ``path`` and renamed into place, so readers
+    never see a partially written bundle. ``yield_cutoff`` and
+    ``training_rows`` are recorded for incremental updates and
+    ``model_params`` (the estimator's hyperparameters) for evaluation.
+    Returns the manifest.
+    """
+    arrays = engine.arrays()
+    checksums = {name: _array_checksum(array) for name, array in arrays.items()}
+    digest = hashlib.sha256(''.join(checksums[name] for name in sorted(checksums)).encode()).hexdigest()
+    created_at = datetime.now()
+
+    manifest = {
+        "format_version": BUNDLE_FORMAT_VERSION if engine.boosted else 1,
+        "version": f"{created_at.strftime('%Y%m%d%H%M%S')}-{digest[:8]}",
+        "created_at": created_at.isoformat(),
+        "model_type": "flat_forest",
+        "estimator": "hist_gradient_boosting" if engine.boosted else "random_forest",
+        "baseline": engine.baseline,
+        "n_trees": engine.n_trees,
+        "n_nodes": engine.n_nodes,
+        "max_depth": engine.max_depth,
+        "feature_columns": list(feature_columns),
+        "year_min": int(year_min),
+        "year_max": int(year_max),
+        "metrics": metrics or {},
+        "yield_cutoff": yield_cutoff,
+        "training_rows": training_rows,
+        "model_params": model_params,
+        "checksums": checksums
+    }
+
+    bundle = {
+        "manifest": manifest,
+        "arrays": arrays,
+        "encoder_classes": encoder_classes,
+        "scaler": {
+            "mean": np.asarray(scaler.mean_, dtype=float).tolist(),
+            "scale": np.asarray(scaler.scale_, dtype=float).tolist()
+        },
+        "unique_values": unique_values
+    }
+
+    # Uncompressed so the arrays can be memory-mapped on load
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    joblib.dump(bundle, tmp_path)
+    os.replace(tmp_path, path)
+    return manifest
+
+
+def load_bundle(path=BUNDLE_PATH, mmap_mode='r', verify=True):
+    """Load a bundle, memory-mapping its tree arrays
+
+    Processes that map the same file share one page-cache copy of the trees.
+    With ``verify`` the array checksums in the manifest are checked.
+    """
+    if not os.path.exists(path):
+        raise BundleError(f"Model bundle '{path}' not found")
+
+    bundle = joblib.load(path, mmap_mode=mmap_mode)
+    manifest = bundle.get('manifest', {})
+    if manifest.get('format_version') not in SUPPORTED_FORMAT_VERSIONS:
+        raise BundleError(f"Unsupported bundle format {manifest.get('format_version')!r}")
+
+    arrays = bundle['arrays']
+    if verify:
+        for name, expected in manifest['checksums'].items():
+            if _array_checksum(arrays[name]) != expected:
+                raise BundleError(f"Checksum mismatch for bundle array '{name}'")
+
+    bundle['engine'] = FlatForest.from_arrays(arrays, manifest['max_depth'], baseline=manifest.get('baseline'))
+    return bundle
@@ -0,0 +1,226 @@
+import json
+import os
+from datetime import datetime
+
+import joblib
+import numpy as np
+
+from encoding import CATEGORICAL_FIELDS, ENCODER_CLASSES_PATH, EncoderIndex, load_encoder_classes
+from forest_engine import FlatForest, verify_parity
+from history_cube import load_history_cube
+from model_bundle import BUNDLE_PATH, load_bundle
+from sharding import SHARD_INDEX_PATH, ShardedForest, load_shard_index
+
+# Artifacts written by older versions of train_model.py
+LEGACY_MODEL_PATH = 'crop_yield_model.pkl'
+
+
+class ModelArtifacts:
+    """One consistent set of serving artifacts
+
+    Requests take a reference to the active instance once and use it
+    throughout, so swapping in a new instance never mixes a model with
+    another version's encoders.
+    """
+
+    def __init__(self, model, engine, encoder_index, unique_values, manifest, source, fingerprint):
+        self.model = model
+        self.engine = engine
+        self.encoder_index = encoder_index
+        self.unique_values = unique_values
+        self.manifest = manifest
+        self.source = source
+        self.fingerprint = fingerprint
+        # Historical statistics cube, when train_model.py has built one
+        self.history = None
+        # Pre-serialized /unique-values and /districts bodies, filled in by the API before it swaps this set in
+        self.reference_responses = None
+        self.version = manifest['version'] if manifest else f"legacy-{fingerprint[1]}"
+        self.loaded_at = datetime.now().isoformat()
+
+    @property
+    def inference_engine(self):
+        if isinstance(self.engine, ShardedForest):
+            return "sharded_flat_forest"
+        return "flat_forest" if self.engine is not None else "sklearn"
+
+    @property
+    def estimator(self):
+        """Model family: random_forest or hist_gradient_boosting"""
+        if self.manifest:
+            return self.manifest.get('estimator', 'random_forest')
+        return 'hist_gradient_boosting' if hasattr(self.model, '_predictors') else 'random_forest'
+
+    def predict(self, features_scaled):
+        """Run the inference engine on a scaled feature matrix"""
+        if self.engine is not None:
+            return self.engine.predict(features_scaled)
+        return self.model.predict(features_scaled)
+
+    @property
+    def supports_intervals(self):
+        """Prediction intervals come from the spread of a forest's trees"""
+        return self.estimator == 'random_forest'
+
+    def predict_intervals(self, features_scaled, quantiles):
+        """(mean, std, quantile values) across the trees; see FlatForest.predict_intervals"""
+        if self.engine is not None:
+            return self.engine.predict_intervals(features_scaled, quantiles)
+        # sklearn fallback (ML_FLAT_FOREST=0): one call per tree
+        trees = np.stack([tree.predict(features_scaled) for tree in self.model.estimators_])
+        return trees.mean(axis=0), trees.std(axis=0), np.quantile(trees, quantiles, axis=0)
+
+    def smoke_test(self):
+        """Score one known-valid record; raises if the artifacts are unusable"""
+        state = sorted(self.encoder_index.districts_by_state)[0]
+        record = {
+            "state": state,
+            "district": sorted(self.encoder_index.districts_by_state[state])[0],
+            "season": sorted(self.encoder_index.seasons)[0],
+            "crop": sorted(self.encoder_index.crops)[0],
+            "year": self.encoder_index.year_max,
+            "area": 1.0
+        }
+        prediction = self.predict(self.encoder_index.encode([record]))
+        if len(prediction) != 1 or not np.isfinite(prediction[0]):
+            raise ValueError(f"Smoke prediction returned {prediction!r}")
+
+
+def artifact_source(use_flat_forest=True, sharded=False):
+    """Path whose contents define the artifacts read_artifacts() would load now"""
+    if sharded and os.path.exists(SHARD_INDEX_PATH):
+        return SHARD_INDEX_PATH
+    if use_flat_forest and os.path.exists(BUNDLE_PATH):
+        return BUNDLE_PATH
+    return LEGACY_MODEL_PATH
+
+
+def artifact_fingerprint(path):
+    """Identity of an artifact file; changes whenever it is replaced"""
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def load_forest_engine(model, use_flat_forest=True):
+    """Build the flat inference engine for a tree ensemble, or None to use sklearn"""
+    if not use_flat_forest or not (hasattr(model, 'estimators_') or hasattr(model, '_predictors')):
+        return None
+
+    try:
+        engine = FlatForest.from_sklearn(model)
+        verify_parity(model, engine, n_rows=64)
+        return engine
+    except Exception as e:
+        print(f"⚠️  Flat forest engine unavailable, using sklearn: {e}")
+        return None
+
+
+def read_bundle_artifacts(verify=True):
+    """Read the serving artifacts from the memory-mapped model bundle"""
+    fingerprint = artifact_fingerprint(BUNDLE_PATH)
+    bundle = load_bundle(verify=verify)
+    manifest = bundle['manifest']
+    encoder_index = EncoderIndex(
+        bundle['encoder_classes'],
+        bundle['unique_values'],
+        bundle['scaler']['mean'],
+        bundle['scaler']['scale'],
+        year_min=manifest['year_min'],
+        year_max=manifest['year_max']
+    )
+    return ModelArtifacts(bundle['engine'], bundle['engine'], encoder_index,
+                          bundle['unique_values'], manifest, BUNDLE_PATH, fingerprint)
+
+
+def read_sharded_artifacts(verify=True, max_resident_shards=16):
+    """Read the shard index; shard bundles are loaded lazily as crops are requested"""
+    fingerprint = artifact_fingerprint(SHARD_INDEX_PATH)
+    index = load_shard_index()
+    unique_values = index['unique_values']
+    encoder_index = EncoderIndex(
+        index['encoder_classes'],
+        unique_values,
+        index['scaler']['mean'],
+        index['scaler']['scale'],
+        year_min=index['year_min'],
+        year_max=index['year_max']
+    )
+    engine = ShardedForest(index, root=os.path.dirname(SHARD_INDEX_PATH), max_resident=max_resident_shards,
+                           verify=verify)
+    return ModelArtifacts(None, engine, encoder_index, unique_values, index, SHARD_INDEX_PATH, fingerprint)
+
+
+def read_legacy_artifacts(use_flat_forest=True):
+    """Read the separate model, scaler and encoder pickles
+
+    The pickles are written alongside the model bundle, so when one exists
+    its vocabularies, scaler and year range are used; the sklearn path
+    (ML_FLAT_FOREST=0) then encodes inputs exactly like the flat engine.
+    """
+    fingerprint = artifact_fingerprint(LEGACY_MODEL_PATH)
+
+    # Load model and scaler
+    model = joblib.load(LEGACY_MODEL_PATH)
+    if os.path.exists(BUNDLE_PATH):
+        bundle = load_bundle(verify=False)
+        manifest = bundle['manifest']
+        encoder_index = EncoderIndex(
+            bundle['encoder_classes'],
+            bundle['unique_values'],
+            bundle['scaler']['mean'],
+            bundle['scaler']['scale'],
+            year_min=manifest['year_min'],
+            year_max=manifest['year_max']
+        )
+        engine = load_forest_engine(model, use_flat_forest)
+        return ModelArtifacts(model, engine, encoder_index, bundle['unique_values'], manifest, LEGACY_MODEL_PATH,
+                              fingerprint)
+
+    scaler = joblib.load('scaler.pkl')
+
+    # Load label encoder vocabularies (older artifacts only have the pickles)
+    if os.path.exists(ENCODER_CLASSES_PATH):
+        classes = load_encoder_classes()
+    else:
+        classes = {
+            field: joblib.load(f'label_encoders/{field}_encoder.pkl').classes_.tolist()
+            for field in CATEGORICAL_FIELDS
+        }
+
+    # Load unique values
+    with open('data/unique_values.json', 'r') as f:
+        unique_values = json.load(f)
+
+    encoder_index = EncoderIndex(
+        classes,
+        unique_values,
+        scaler.mean_,
+        scaler.scale_,
+        # Training year range is not recorded alongside the pickles
+        year_min=2000,
+        year_max=2024
+    )
+
+    # Export the forest to flat arrays, keeping sklearn if parity fails
+    engine = load_forest_engine(model, use_flat_forest)
+    return ModelArtifacts(model, engine, encoder_index, unique_values, None, LEGACY_MODEL_PATH, fingerprint)
+
+
+def read_artifacts(use_flat_forest=True, verify=True, sharded=False, max_resident_shards=16):
+    """Load and smoke-test a complete artifact set, preferring shards (if asked for), then the bundle"""
+    source = artifact_source(use_flat_forest, sharded)
+    if source == SHARD_INDEX_PATH:
+        artifacts = read_sharded_artifacts(verify, max_resident_shards)
+    elif source == BUNDLE_PATH:
+        artifacts = read_bundle_artifacts(verify)
+    else:
+        artifacts = read_legacy_artifacts(use_flat_forest)
+
+    artifacts.smoke_test()
+    
+    # Analytics are optional; a bad cube must not keep the model from serving
+    try:
+        artifacts.history = load_history_cube()
+    except Exception as e:
+        print(f"⚠️  Historical statistics unavailable: {e}")
+    return artifacts
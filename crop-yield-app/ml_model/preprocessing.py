@@ -0,0 +1,489 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+from encoding import CATEGORICAL_FIELDS
+
+DATA_PATH = 'data/crop_production.csv'
+CACHE_DIR = 'data/cache'
+
+# Cleaned datasets kept in CACHE_DIR, newest first; older entries are deleted
+MAX_CACHE_ENTRIES = 4
+
+# Row indices of the train/test split used by the last training run
+SPLIT_PATH = 'data/train_test_split.npz'
+
+# Bump whenever the cleaning/feature steps below change
+PIPELINE_VERSION = 1
+
+FEATURE_COLUMNS = ['state_encoded', 'district_encoded', 'season_encoded',
+                   'crop_encoded', 'year_normalized', 'Area']
+
+# Raw text column behind each categorical field
+TEXT_COLUMNS = {
+    'state': 'State_Name',
+    'district': 'District_Name',
+    'season': 'Season',
+    'crop': 'Crop'
+}
+
+# Rows per chunk in streaming mode
+DEFAULT_CHUNKSIZE = 250_000
+
+# Bucket width (relative) of the streaming yield quantile sketch
+SKETCH_ACCURACY = 0.005
+
+
+def clean_crop_data(df):
+    """Drop invalid rows and normalize the raw crop production columns"""
+    # Remove rows with missing values
+    df = df.dropna()
+
+    # Clean numeric columns
+    df['Area'] = pd.to_numeric(df['Area'], errors='coerce')
+    df['Production'] = pd.to_numeric(df['Production'], errors='coerce')
+    df['Crop_Year'] = pd.to_numeric(df['Crop_Year'], errors='coerce')
+
+    # Remove rows with invalid numeric values
+    df = df.dropna(subset=['Area', 'Production', 'Crop_Year'])
+
+    # Remove rows with zero or negative values
+    df = df[(df['Area'] > 0) & (df['Production'] > 0) & (df['Crop_Year'] > 1900)]
+
+    # Clean text columns
+    df['State_Name'] = df['State_Name'].str.strip()
+    df['District_Name'] = df['District_Name'].str.strip()
+    df['Season'] = df['Season'].str.strip()
+    df['Crop'] = df['Crop'].str.strip()
+
+    # Remove rows with empty text values
+    return df[(df['State_Name'] != '') & (df['District_Name'] != '') &
+              (df['Season'] != '') & (df['Crop'] != '')]
+
+
+def build_unique_values(df):
+    """Dropdown values and the state -> districts mapping served by the API"""
+    unique_states = sorted(df['State_Name'].unique())
+
+    # Create a mapping for districts by state
+    district_state_mapping = {}
+    for state in unique_states:
+        districts = sorted(df[df['State_Name'] == state]['District_Name'].unique())
+        district_state_mapping[state] = districts
+
+    return {
+        'states': unique_states,
+        'districts': sorted(df['District_Name'].unique()),
+        'seasons': sorted(df['Season'].unique()),
+        'crops': sorted(df['Crop'].unique()),
+        'district_state_mapping': district_state_mapping
+    }
+
+
+def encoders_from_classes(classes):
+    """Rebuild fitted LabelEncoders from their saved vocabularies"""
+    encoders = {}
+    for field in CATEGORICAL_FIELDS:
+        encoder = LabelEncoder()
+        encoder.classes_ = np.array(classes[field], dtype=object)
+        encoders[field] = encoder
+    return encoders
+
+
+def prepare_features(df, outlier_quantile=0.95):
+    """Encode, normalize and filter a cleaned frame into the model matrix"""
+    # Encode categorical variables
+    encoders = {field: LabelEncoder() for field in CATEGORICAL_FIELDS}
+    for field, column in TEXT_COLUMNS.items():
+        df[f'{field}_encoded'] = encoders[field].fit_transform(df[column])
+
+    # Create additional features
+    year_min = df['Crop_Year'].min()
+    year_max = df['Crop_Year'].max()
+    df['year_normalized'] = (df['Crop_Year'] - year_min) / (year_max - year_min)
+
+    # Calculate yield per hectare
+    df['yield_per_hectare'] = df['Production'] / df['Area']
+
+    # Remove outliers from yield_per_hectare (keep 95th percentile)
+    cutoff = df['yield_per_hectare'].quantile(outlier_quantile)
+    df = df[df['yield_per_hectare'] <= cutoff]
+
+    return {
+        'X': df[FEATURE_COLUMNS].to_numpy(dtype=np.float64),
+        'y': df['Production'].to_numpy(dtype=np.float64),
+        'encoders': encoders,
+        'year_min': int(year_min),
+        'year_max': int(year_max),
+        'yield_cutoff': float(cutoff),
+        'unique_values': build_unique_values(df)
+    }
+
+
+class QuantileSketch:
+    """Mergeable log-bucketed quantile sketch for positive values (DDSketch-style)
+
+    Every value is counted in the bucket ``ceil(log_gamma(value))``, so a
+    quantile is located with at most ``relative_accuracy`` relative error
+    while memory only grows with the log-range of the data.
+    """
+
+    def __init__(self, relative_accuracy=SKETCH_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self.gamma)
+        self.buckets = {}
+        self.count = 0
+
+    def add(self, values):
+        keys, counts = np.unique(np.ceil(np.log(values) / self._log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.count += len(values)
+
+    def bucket_of_rank(self, rank):
+        """Key of the bucket holding the value with this 0-based rank"""
+        running = 0
+        for key in sorted(self.buckets):
+            running += self.buckets[key]
+            if running > rank:
+                return key
+        raise ValueError("Rank outside of the sketch")
+
+    def quantile(self, q):
+        """Approximate quantile (bucket midpoint)"""
+        key = self.bucket_of_rank(q * (self.count - 1))
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def exact_quantile(self, values, q):
+        """Linearly interpolated quantile of the sketched values, as pandas computes it
+
+        The sketch narrows the search to a few buckets, so only the values
+        inside them are sorted.
+        """
+        rank = q * (self.count - 1)
+        low_rank, high_rank = int(np.floor(rank)), int(np.ceil(rank))
+        # One bucket of slack on each side absorbs rounding in the log
+        lower = self.gamma ** (self.bucket_of_rank(low_rank) - 2)
+        upper = self.gamma ** (self.bucket_of_rank(high_rank) + 1)
+
+        below = np.count_nonzero(values <= lower)
+        candidates = np.sort(values[(values > lower) & (values <= upper)])
+        low = candidates[low_rank - below]
+        high = candidates[high_rank - below]
+        return float(low + (high - low) * (rank - low_rank))
+
+
+class Vocabulary:
+    """Category names collected incrementally with provisional first-seen ids"""
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def lookup(self, names):
+        """Provisional ids for names, registering unseen ones"""
+        ids = np.empty(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            code = self.ids.get(name)
+            if code is None:
+                code = self.ids[name] = len(self.names)
+                self.names.append(name)
+            ids[i] = code
+        return ids
+
+    def sorted_remap(self):
+        """Sorted class list and provisional id -> LabelEncoder code array"""
+        classes = sorted(self.names)
+        position = {name: code for code, name in enumerate(classes)}
+        return classes, np.array([position[name] for name in self.names], dtype=np.int32)
+
+
+def _clean_chunk(chunk, vocabularies):
+    """Apply clean_crop_data() to one chunk; returns compact arrays of the kept rows"""
+    chunk = chunk.dropna()
+    area = pd.to_numeric(chunk['Area'], errors='coerce').to_numpy(dtype=np.float64)
+    production = pd.to_numeric(chunk['Production'], errors='coerce').to_numpy(dtype=np.float64)
+    year = pd.to_numeric(chunk['Crop_Year'], errors='coerce').to_numpy(dtype=np.float64)
+
+    with np.errstate(invalid='ignore'):
+        valid = (area > 0) & (production > 0) & (year > 1900)
+
+    # Strip categories once per chunk instead of once per row
+    text = {}
+    for field, column in TEXT_COLUMNS.items():
+        values = chunk[column].astype('category')
+        stripped = values.cat.categories.astype(str).str.strip()
+        codes = values.cat.codes.to_numpy()
+        non_empty = np.append(np.asarray(stripped != ''), False)
+        valid &= non_empty[codes]
+        text[field] = (stripped, codes)
+
+    # Only rows that survive cleaning contribute to the vocabularies
+    compact = {}
+    for field, (stripped, codes) in text.items():
+        kept = codes[valid]
+        used = np.unique(kept)
+        lookup = np.full(len(stripped), -1, dtype=np.int32)
+        lookup[used] = vocabularies[field].lookup(stripped[used].tolist())
+        compact[field] = lookup[kept]
+
+    compact['year'] = year[valid].astype(np.int16)
+    compact['area'] = area[valid].astype(np.float32)
+    compact['production'] = production[valid].astype(np.float32)
+    # Yield stays float64 so the outlier cutoff matches the in-memory pipeline
+    compact['yield'] = production[valid] / area[valid]
+    return compact
+
+
+def stream_prepared_data(csv_path=DATA_PATH, outlier_quantile=0.95, chunksize=DEFAULT_CHUNKSIZE):
+    """Chunked equivalent of prepare_features(clean_crop_data(read_csv(...)))
+
+    Text columns are read as categoricals and kept rows are stored as
+    int32 codes, int16 years and float32 area/production, so peak memory
+    follows the compact matrix rather than the raw CSV. Vocabularies grow
+    chunk by chunk and are remapped to sorted LabelEncoder order at the
+    end; the outlier cutoff is located with a QuantileSketch.
+    """
+    vocabularies = {field: Vocabulary() for field in CATEGORICAL_FIELDS}
+    sketch = QuantileSketch()
+    parts = {key: [] for key in CATEGORICAL_FIELDS + ['year', 'area', 'production', 'yield']}
+    rows_read = 0
+
+    reader = pd.read_csv(csv_path, chunksize=chunksize,
+                         dtype={column: 'category' for column in TEXT_COLUMNS.values()})
+    for chunk in reader:
+        rows_read += len(chunk)
+        compact = _clean_chunk(chunk, vocabularies)
+        sketch.add(compact['yield'])
+        for key, values in compact.items():
+            parts[key].append(values)
+        print(f"   ... {rows_read:,} rows read, {sketch.count:,} kept")
+
+    columns = {key: np.concatenate(values) for key, values in parts.items()}
+    del parts
+    print(f"Cleaned dataset rows: {len(columns['year']):,}")
+
+    # Year range is taken before the outlier filter, as in prepare_features()
+    year_min = int(columns['year'].min())
+    year_max = int(columns['year'].max())
+
+    # Remove outliers from yield_per_hectare (keep 95th percentile)
+    cutoff = sketch.exact_quantile(columns['yield'], outlier_quantile)
+    keep = columns.pop('yield') <= cutoff
+    n_kept = int(keep.sum())
+
+    # Encoders are fit on all cleaned rows, like LabelEncoder before the filter
+    classes = {}
+    X = np.empty((n_kept, len(FEATURE_COLUMNS)), dtype=np.float32)
+    for column, field in enumerate(CATEGORICAL_FIELDS):
+        classes[field], remap = vocabularies[field].sorted_remap()
+        columns[field] = remap[columns[field][keep]]
+        X[:, column] = columns[field]
+    X[:, 4] = (columns['year'][keep] - year_min) / (year_max - year_min)
+    X[:, 5] = columns['area'][keep]
+    y = columns['production'][keep]
+    print(f"Final dataset shape: {X.shape}")
+
+    return {
+        'X': X,
+        'y': y,
+        'encoders': encoders_from_classes(classes),
+        'year_min': year_min,
+        'year_max': year_max,
+        'yield_cutoff': float(cutoff),
+        'unique_values': _unique_values_from_codes(columns, classes)
+    }
+
+
+def _unique_values_from_codes(columns, classes):
+    """build_unique_values() for encoded columns of the kept rows"""
+    def names(field, codes):
+        return [classes[field][code] for code in np.unique(codes)]
+
+    n_districts = max(len(classes['district']), 1)
+    pairs = np.unique(columns['state'].astype(np.int64) * n_districts + columns['district'])
+    district_state_mapping = {}
+    for pair in pairs.tolist():
+        state, district = divmod(pair, n_districts)
+        district_state_mapping.setdefault(classes['state'][state], []).append(classes['district'][district])
+
+    return {
+        'states': names('state', columns['state']),
+        'districts': names('district', columns['district']),
+        'seasons': names('season', columns['season']),
+        'crops': names('crop', columns['crop']),
+        'district_state_mapping': district_state_mapping
+    }
+
+
+def _file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(csv_path, settings, csv_digest=None):
+    """Hash of the source CSV contents and the pipeline settings"""
+    payload = json.dumps({'csv': csv_digest or _file_digest(csv_path), 'settings': settings}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _save_cache(path, data, settings, source, csv_digest):
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, 'X.npy'), data['X'])
+    np.save(os.path.join(tmp_path, 'y.npy'), data['y'])
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump({
+            'settings': settings,
+            'source': source,
+            'csv_digest': csv_digest,
+            'classes': {field: data['encoders'][field].classes_.tolist() for field in CATEGORICAL_FIELDS},
+            'year_min': data['year_min'],
+            'year_max': data['year_max'],
+            'yield_cutoff': data['yield_cutoff'],
+            'unique_values': data['unique_values']
+        }, f)
+
+    # Publish the whole directory at once so readers never see a partial cache
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def prune_cache(cache_dir, keep, source, csv_digest, max_entries=MAX_CACHE_ENTRIES):
+    """Delete cached datasets of older contents of ``source`` and all but the newest ``max_entries``
+
+    ``keep`` (the entry just published) is never deleted, nor are the
+    temporary directories of writers still in progress. Processes that
+    have a deleted entry memory-mapped keep reading it until they close it.
+    """
+    others = []
+    for name in os.listdir(cache_dir):
+        if name == keep or '.tmp-' in name:
+            continue
+        path = os.path.join(cache_dir, name)
+        meta_path = os.path.join(path, 'meta.json')
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            modified = os.stat(meta_path).st_mtime
+        except (OSError, ValueError):
+            continue
+
+        if meta.get('source') == source and meta.get('csv_digest') != csv_digest:
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            others.append((modified, path))
+
+    # The kept entry counts towards the limit
+    others.sort(reverse=True)
+    for _, path in others[max(max_entries - 1, 0):]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _publish_cache(cache_dir, key, data, settings, source, csv_digest):
+    os.makedirs(cache_dir, exist_ok=True)
+    _save_cache(os.path.join(cache_dir, key), data, settings, source, csv_digest)
+    prune_cache(cache_dir, key, source, csv_digest)
+
+
+def _load_cache(path, mmap_mode=None):
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    return {
+        'X': np.load(os.path.join(path, 'X.npy'), mmap_mode=mmap_mode),
+        'y': np.load(os.path.join(path, 'y.npy'), mmap_mode=mmap_mode),
+        'encoders': encoders_from_classes(meta['classes']),
+        'year_min': meta['year_min'],
+        'year_max': meta['year_max'],
+        'yield_cutoff': meta['yield_cutoff'],
+        'unique_values': meta['unique_values']
+    }
+
+
+def load_prepared_data(csv_path=DATA_PATH, outlier_quantile=0.95, use_cache=True, cache_dir=CACHE_DIR,
+                       mmap_mode=None, streaming=False, chunksize=DEFAULT_CHUNKSIZE):
+    """Cleaned feature matrix, target and encoders, served from the .npy cache when possible
+
+    With ``streaming`` the CSV is read in chunks by stream_prepared_data().
+
+    Returns a dict with ``X``, ``y``, ``encoders``, ``year_min``,
+    ``year_max``, ``yield_cutoff``, ``unique_values``, ``cache_key`` and
+    ``cache_hit``.
+    """
+    settings = {
+        'pipeline_version': PIPELINE_VERSION,
+        'outlier_quantile': outlier_quantile,
+        'feature_columns': FEATURE_COLUMNS
+    }
+    if streaming:
+        # Streaming caches a float32 matrix, so keep it apart from the default one
+        settings['streaming'] = True
+    source = os.path.abspath(csv_path)
+    csv_digest = _file_digest(csv_path)
+    key = cache_key(csv_path, settings, csv_digest)
+    path = os.path.join(cache_dir, key)
+
+    if use_cache and os.path.exists(os.path.join(path, 'meta.json')):
+        data = _load_cache(path, mmap_mode)
+        print(f"⚡ Loaded cleaned dataset from cache {path} ({len(data['y'])} rows)")
+        return {**data, 'cache_key': key, 'cache_hit': True}
+
+    if streaming:
+        print(f"🌊 Streaming {csv_path} in chunks of {chunksize:,} rows...")
+        data = stream_prepared_data(csv_path, outlier_quantile, chunksize)
+        if use_cache:
+            _publish_cache(cache_dir, key, data, settings, source, csv_digest)
+        return {**data, 'cache_key': key, 'cache_hit': False}
+
+    # Load the dataset
+    df = pd.read_csv(csv_path)
+    print(f"Dataset shape: {df.shape}")
+    print(f"Columns: {df.columns.tolist()}")
+
+    # Clean the data
+    print("🧹 Cleaning data...")
+    df = clean_crop_data(df)
+    print(f"Cleaned dataset shape: {df.shape}")
+
+    print("🔧 Creating features...")
+    data = prepare_features(df, outlier_quantile)
+    print(f"Final dataset shape: {data['X'].shape}")
+
+    if use_cache:
+        _publish_cache(cache_dir, key, data, settings, source, csv_digest)
+
+    return {**data, 'cache_key': key, 'cache_hit': False}
+
+
+def save_split(train_index, test_index, cache_key, streaming=False, model_version=None, path=SPLIT_PATH):
+    """Persist the train/test row indices with the dataset they index and the model trained on them"""
+    tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(tmp_path, train_index=train_index, test_index=test_index,
+             cache_key=np.array(cache_key), streaming=np.array(streaming),
+             model_version=np.array(model_version or ''))
+    os.replace(tmp_path, path)
+
+
+def load_split(path=SPLIT_PATH):
+    """Train/test indices written by save_split(), or None if there are none"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as split:
+        return {
+            'train_index': split['train_index'],
+            'test_index': split['test_index'],
+            'cache_key': str(split['cache_key']),
+            'streaming': bool(split['streaming']),
+            # Splits written before versions were recorded have none
+            'model_version': (str(split['model_version']) or None) if 'model_version' in split.files else None
+        }
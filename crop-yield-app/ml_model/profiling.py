@@ -0,0 +1,183 @@
+"""On-demand cProfile captures of single API requests
+
+With ML_PROFILING=1 the API profiles prediction requests that send
+"X-Profile: 1", plus a random ML_PROFILE_SAMPLE_RATE share of them, and
+keeps the newest captures in memory for /admin/profiles. Captures include
+the Flask view, encoding, the model engine and sklearn/NumPy calls.
+"""
+import cProfile
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+from collections import defaultdict, deque
+from datetime import datetime
+
+# Stacks holding less time than this are dropped from collapsed output
+COLLAPSED_MIN_SECONDS = 1e-6
+COLLAPSED_MAX_DEPTH = 128
+
+
+class RequestProfiler:
+    """Bounded ring of cProfile captures of individual API requests
+
+    A request is profiled when the client asks for it or with probability
+    ``sample_rate``. cProfile hooks the interpreter's profiling slot, so at
+    most one request is profiled at a time; requests triggered meanwhile run
+    unprofiled and are counted as skipped. Only the newest ``ring_size``
+    captures are kept.
+
+    Each server worker process has its own ring, so ids are "<pid>-<n>"
+    and never repeat across workers.
+    """
+
+    def __init__(self, ring_size=20, sample_rate=0.0):
+        self.ring_size = ring_size
+        self.sample_rate = sample_rate
+        self._profiles = deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        self._ids = itertools.count(1)
+        self.captured = 0
+        self.skipped = 0
+
+    def start(self, requested=False):
+        """Start profiling the calling thread if requested or sampled; returns the Profile or None"""
+        if not requested and (self.sample_rate <= 0 or random.random() >= self.sample_rate):
+            return None
+        if not self._active.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            return None
+
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) already owns the hook
+            self._active.release()
+            with self._lock:
+                self.skipped += 1
+            return None
+        return profile
+
+    def stop(self, profile, **info):
+        """Stop a profile from start() and keep it with the request info; returns its id"""
+        profile.disable()
+        self._active.release()
+        profile.create_stats()
+        stats = profile.stats
+
+        with self._lock:
+            profile_id = f"{os.getpid()}-{next(self._ids)}"
+            self._profiles.append({
+                "id": profile_id,
+                "captured_at": datetime.now().isoformat(),
+                **info,
+                "calls": sum(entry[1] for entry in stats.values()),
+                "stats": stats
+            })
+            self.captured += 1
+        return profile_id
+
+    def discard(self, profile):
+        """Stop a profile from start() without keeping it, e.g. when the request failed"""
+        profile.disable()
+        self._active.release()
+
+    def get(self, profile_id):
+        """Stored capture by id (or 'latest'), or None once it has left the ring"""
+        with self._lock:
+            if profile_id == 'latest':
+                return self._profiles[-1] if self._profiles else None
+            for entry in self._profiles:
+                if entry['id'] == profile_id:
+                    return entry
+        return None
+
+    def summaries(self):
+        """Request info of every stored capture, newest first"""
+        with self._lock:
+            return [{key: value for key, value in entry.items() if key != 'stats'}
+                    for entry in reversed(self._profiles)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "worker_pid": os.getpid(),
+                "ring_size": self.ring_size,
+                "sample_rate": self.sample_rate,
+                "stored": len(self._profiles),
+                "captured": self.captured,
+                "skipped": self.skipped
+            }
+
+
+def _stats_object(stats, stream=None):
+    """pstats.Stats over a copy of raw cProfile stats"""
+    view = pstats.Stats(stream=stream)
+    view.stats = dict(stats)
+    view.get_top_level_stats()
+    return view
+
+
+def render_pstats(stats, sort='cumulative', limit=50):
+    """Text report as printed by pstats, sorted by a pstats key (KeyError for unknown keys)"""
+    out = io.StringIO()
+    _stats_object(stats, out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def dump_pstats(stats):
+    """Binary .prof contents, as written by Stats.dump_stats (for snakeviz or python -m pstats)"""
+    return marshal.dumps(dict(stats))
+
+
+def _frame_name(func):
+    filename, line, name = func
+    if filename == '~':
+        # Built-in and C-extension calls, e.g. NumPy ufuncs
+        return name
+    return f"{os.path.basename(filename)}:{name}:{line}"
+
+
+def render_collapsed(stats, min_seconds=COLLAPSED_MIN_SECONDS, max_depth=COLLAPSED_MAX_DEPTH):
+    """Collapsed stacks ("a;b;c <microseconds>") for flamegraph.pl or speedscope
+
+    cProfile records caller -> callee edges rather than whole stacks, so
+    stacks are rebuilt from the call graph: a function's time under one
+    caller is split across its callees in proportion to their time under
+    it. Recursive calls are not expanded again below their first frame.
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge[3]
+    roots = [func for func, entry in stats.items() if not any(caller in stats for caller in entry[4])]
+
+    totals = defaultdict(float)
+
+    def walk(func, stack, names, seconds):
+        cumulative = stats[func][3]
+        if cumulative <= 0 or seconds < min_seconds:
+            return
+        share = min(seconds / cumulative, 1.0)
+        stack = stack + (func,)
+        names = names + (_frame_name(func),)
+        if len(stack) >= max_depth:
+            totals[';'.join(names)] += seconds
+            return
+        totals[';'.join(names)] += stats[func][2] * share
+        for callee, edge_seconds in callees[func].items():
+            if callee not in stack:
+                walk(callee, stack, names, edge_seconds * share)
+
+    for root in roots:
+        walk(root, (), (), stats[root][3])
+
+    lines = [f"{path} {round(seconds * 1e6)}" for path, seconds in sorted(totals.items())
+             if round(seconds * 1e6) > 0]
+    return '\n'.join(lines) + '\n'
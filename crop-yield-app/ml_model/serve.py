@@ -0,0 +1,162 @@
+"""Production launcher for the ML API
+
+Runs app.py under gunicorn with a pre-forked pool of workers. The model is
+loaded once in the master before forking, so workers share it through the
+memory-mapped bundle (or copy-on-write for pickled artifacts).
+
+    python serve.py --workers 4 --threads 4
+    python serve.py --check            # readiness probe against /health
+
+/metrics on any worker reports counters and histograms summed over all
+workers (they share them through ML_METRICS_DIR, a temporary directory by
+default); gauges carry a pid label since they are per worker.
+
+Signals sent to the master: HUP gracefully restarts the workers, TERM shuts
+down gracefully, TTIN / TTOU add or remove a worker.
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import urllib.request
+
+from gunicorn.app.base import BaseApplication
+
+from metrics import reset_spool
+
+# Worker exit code that makes gunicorn stop instead of respawning forever
+WORKER_BOOT_ERROR = 3
+
+
+def check_health(flask_app):
+    """Return the /health payload if the model is loaded, else None"""
+    with flask_app.test_client() as client:
+        payload = client.get('/health').get_json()
+    return payload if payload and payload.get('model_loaded') else None
+
+
+def post_worker_init(worker):
+    # Readiness gate: a worker only accepts traffic once /health is green
+    if check_health(worker.wsgi) is None:
+        worker.log.error("Worker %s failed its /health readiness check", worker.pid)
+        sys.exit(WORKER_BOOT_ERROR)
+
+    # Workers forked after a retrain start from the master's older model
+    import app as ml_app
+    if ml_app.model_artifacts_changed():
+        ml_app.load_model_and_encoders()
+
+    # Each worker watches for new model bundles on its own
+    ml_app.start_model_watcher()
+
+    # ...and publishes its metrics for /metrics on the other workers
+    if ml_app.metrics_spool is not None:
+        ml_app.metrics_spool.start()
+
+
+def worker_exit(server, worker):
+    # Publish the last counts before the worker's file is archived
+    import app as ml_app
+    if ml_app.metrics_spool is not None:
+        ml_app.metrics_spool.write()
+
+
+def when_ready(server):
+    server.log.info("ML API ready with %s workers", server.num_workers)
+
+
+class MLApiServer(BaseApplication):
+    """gunicorn application that preloads the model in the master process"""
+
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        import app as ml_app
+
+        if not ml_app.load_model_and_encoders():
+            sys.exit("❌ Model could not be loaded; run train_model.py first")
+
+        health = check_health(ml_app.app)
+        if health is None:
+            sys.exit("❌ /health readiness check failed")
+        print(f"✅ Model ready ({health.get('inference_engine')}, version {health.get('model_version')})")
+
+        # Keep the loaded objects out of the GC's reach so refcount churn
+        # in the workers does not unshare their copy-on-write pages
+        gc.freeze()
+        return ml_app.app
+
+
+def probe(host, port, timeout):
+    """Readiness probe for a running server; exit code 0 when ready"""
+    url = f"http://{host}:{port}/health"
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            payload = json.load(response)
+    except Exception as e:
+        print(f"❌ {url} unreachable: {e}")
+        return 1
+
+    if not payload.get('model_loaded'):
+        print(f"❌ {url} reports status '{payload.get('status')}'")
+        return 1
+
+    print(f"✅ {url} ready (model version {payload.get('model_version')})")
+    return 0
+
+
+def main():
+    env = os.environ.get
+    parser = argparse.ArgumentParser(description="Run the Crop Yield ML API with pre-forked workers")
+    parser.add_argument('--host', default=env('ML_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(env('ML_PORT', 8000)))
+    parser.add_argument('--workers', type=int, default=int(env('ML_WORKERS', multiprocessing.cpu_count())),
+                        help="worker processes (default: one per core)")
+    parser.add_argument('--threads', type=int, default=int(env('ML_THREADS', 4)),
+                        help="threads per worker; >1 lets the micro-batcher coalesce requests")
+    parser.add_argument('--max-requests', type=int, default=int(env('ML_MAX_REQUESTS', 10000)),
+                        help="recycle a worker after this many requests (0 disables)")
+    parser.add_argument('--max-requests-jitter', type=int, default=int(env('ML_MAX_REQUESTS_JITTER', 1000)))
+    parser.add_argument('--timeout', type=int, default=int(env('ML_WORKER_TIMEOUT', 30)))
+    parser.add_argument('--graceful-timeout', type=int, default=int(env('ML_GRACEFUL_TIMEOUT', 30)))
+    parser.add_argument('--check', action='store_true', help="probe a running server's /health and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        host = '127.0.0.1' if args.host == '0.0.0.0' else args.host
+        sys.exit(probe(host, args.port, timeout=5))
+
+    # Workers merge their metrics through this directory; it must be set
+    # before app.py is imported, and is emptied so old counts do not leak in
+    metrics_dir = env('ML_METRICS_DIR') or tempfile.mkdtemp(prefix='ml-metrics-')
+    reset_spool(metrics_dir)
+    os.environ['ML_METRICS_DIR'] = metrics_dir
+
+    print(f"🚀 Starting ML API on port {args.port} with {args.workers} workers...")
+    MLApiServer({
+        'bind': f"{args.host}:{args.port}",
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'preload_app': True,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+        'when_ready': when_ready
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
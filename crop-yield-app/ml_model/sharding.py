@@ -0,0 +1,278 @@
+"""Per-crop model shards
+
+``train_model.py --sharded`` fits one compact model per crop instead of one
+global model over every crop. Crops with fewer than ``min_rows`` training
+rows share a single group shard. Shards are fitted in parallel worker
+processes and written as ordinary model bundles under
+``shards/<version>/``; the shard index (``shards/index.json``) is written
+last and is what the API watches for new versions.
+
+At serving time ShardedForest routes each row to its crop's shard, loads
+shards on first use and keeps at most ``max_resident`` of them mapped, so
+resident memory follows the crops actually being queried.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+from joblib import Parallel, delayed, parallel_config
+
+from forest_engine import FlatForest, verify_parity
+from model_bundle import load_bundle, save_bundle
+
+SHARD_ROOT = 'shards'
+SHARD_INDEX_PATH = os.path.join(SHARD_ROOT, 'index.json')
+SHARD_INDEX_FORMAT_VERSION = 1
+
+# Crops with fewer training rows than this share the group shard
+MIN_SHARD_ROWS = 200
+GROUP_SHARD_ID = 'group-small'
+
+# Shard versions kept on disk; servers still on the previous index may
+# lazily load shards from it until they reload
+KEEP_SHARD_VERSIONS = 2
+
+
+class ShardError(Exception):
+    """Raised when the shard index is missing, incompatible or cannot route a row"""
+
+
+def assign_shards(crop_codes, n_crops, min_rows=MIN_SHARD_ROWS):
+    """Shard id for every crop code: its own shard, or the group shard when it is small"""
+    counts = np.bincount(crop_codes, minlength=n_crops)
+    assignment = [f"crop-{code:04d}" if counts[code] >= min_rows else GROUP_SHARD_ID
+                  for code in range(n_crops)]
+
+    # Without any small crop rows there is no group shard to train; crops
+    # unseen in training then go to the largest shard
+    if not counts[[shard == GROUP_SHARD_ID for shard in assignment]].sum():
+        largest = f"crop-{int(np.argmax(counts)):04d}"
+        assignment = [largest if shard == GROUP_SHARD_ID else shard for shard in assignment]
+    return assignment
+
+
+def _fit_shard(shard_id, make_model, X, y, rows, bundle_args, path):
+    """Fit one shard in a worker process and write its bundle; returns a summary
+
+    Raises AssertionError (failing the whole run) if the flat engine does
+    not reproduce the shard's model.
+    """
+    started = time.time()
+    model = make_model()
+    model.fit(X[rows], y[rows])
+    fit_seconds = time.time() - started
+
+    engine = FlatForest.from_sklearn(model)
+    verify_parity(model, engine)
+    save_bundle(engine, **bundle_args, training_rows=len(rows), path=path)
+    return {
+        'shard_id': shard_id,
+        'file': os.path.basename(path),
+        'rows': int(len(rows)),
+        'n_trees': engine.n_trees,
+        'n_nodes': engine.n_nodes,
+        'size_mb': sum(array.nbytes for array in engine.arrays().values()) / 1e6,
+        'fit_seconds': fit_seconds
+    }
+
+
+def train_shards(X_train, y_train, make_model, encoder_classes, scaler, year_min, year_max,
+                 feature_columns, crop_column, min_rows=MIN_SHARD_ROWS, n_jobs=None, root=SHARD_ROOT):
+    """Fit every shard in parallel and write their bundles to a new version directory
+
+    ``make_model`` is a picklable callable returning an unfitted single-core
+    estimator. Returns the shard index (not yet published).
+    """
+    crop_codes = np.rint(X_train[:, crop_column] * scaler.scale_[crop_column]
+                         + scaler.mean_[crop_column]).astype(np.intp)
+    assignment = assign_shards(crop_codes, len(encoder_classes['crop']), min_rows)
+
+    shard_dir = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    os.makedirs(os.path.join(root, shard_dir))
+    shard_rows = {}
+    for shard_id in sorted(set(assignment)):
+        in_shard = np.array([shard == shard_id for shard in assignment])
+        shard_rows[shard_id] = np.flatnonzero(in_shard[crop_codes])
+
+    bundle_args = {
+        'encoder_classes': encoder_classes,
+        'scaler': scaler,
+        # Dropdown values live in the shard index only
+        'unique_values': {},
+        'year_min': year_min,
+        'year_max': year_max,
+        'feature_columns': feature_columns
+    }
+
+    # Largest shards first so the pool does not end on one long fit
+    order = sorted(shard_rows, key=lambda shard_id: -len(shard_rows[shard_id]))
+    print(f"🧩 Training {len(order)} shards on {n_jobs or os.cpu_count()} processes...")
+    with parallel_config(backend='loky', max_nbytes='1M', mmap_mode='r'):
+        summaries = Parallel(n_jobs=n_jobs or -1)(
+            delayed(_fit_shard)(shard_id, make_model, X_train, y_train, shard_rows[shard_id], bundle_args,
+                                os.path.join(root, shard_dir, f"{shard_id}.joblib"))
+            for shard_id in order
+        )
+
+    created_at = datetime.now()
+    return {
+        'format_version': SHARD_INDEX_FORMAT_VERSION,
+        'version': f"{created_at.strftime('%Y%m%d%H%M%S')}-sharded",
+        'created_at': created_at.isoformat(),
+        'sharded': True,
+        'shard_dir': shard_dir,
+        'crop_column': crop_column,
+        'crop_shards': {crop: assignment[code] for code, crop in enumerate(encoder_classes['crop'])},
+        'shards': {summary['shard_id']: summary for summary in summaries},
+        'feature_columns': list(feature_columns),
+        'year_min': int(year_min),
+        'year_max': int(year_max),
+        'encoder_classes': encoder_classes,
+        'scaler': {
+            'mean': np.asarray(scaler.mean_, dtype=float).tolist(),
+            'scale': np.asarray(scaler.scale_, dtype=float).tolist()
+        }
+    }
+
+
+def publish_shard_index(index, path=SHARD_INDEX_PATH, keep=KEEP_SHARD_VERSIONS):
+    """Atomically write the shard index, then delete all but the newest ``keep`` shard versions"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+    root = os.path.dirname(path)
+    versions = sorted(entry.name for entry in os.scandir(root) if entry.is_dir())
+    for stale in versions[:-keep] if keep > 0 else []:
+        if stale != index['shard_dir']:
+            shutil.rmtree(os.path.join(root, stale), ignore_errors=True)
+
+
+def load_shard_index(path=SHARD_INDEX_PATH):
+    if not os.path.exists(path):
+        raise ShardError(f"Shard index '{path}' not found")
+    with open(path, 'r') as f:
+        index = json.load(f)
+    if index.get('format_version') != SHARD_INDEX_FORMAT_VERSION:
+        raise ShardError(f"Unsupported shard index format {index.get('format_version')!r}")
+    return index
+
+
+class ShardedForest:
+    """Routes rows to per-crop shard engines, loading shards lazily into an LRU
+
+    Rows are grouped by the crop code recovered from the scaled crop
+    column, and each group is scored by its shard's FlatForest. At most
+    ``max_resident`` shards stay mapped; the least recently used one is
+    dropped when another is loaded. Requests already holding an evicted
+    shard finish with it.
+    """
+
+    def __init__(self, index, root=SHARD_ROOT, max_resident=16, verify=True):
+        self.version = index['version']
+        self.max_resident = max(1, max_resident)
+        self.verify = verify
+        self.shard_ids = sorted(index['shards'])
+        self.paths = {shard_id: os.path.join(root, index['shard_dir'], index['shards'][shard_id]['file'])
+                      for shard_id in self.shard_ids}
+        for path in self.paths.values():
+            if not os.path.exists(path):
+                raise ShardError(f"Shard bundle '{path}' not found")
+
+        # Crop code -> position in shard_ids
+        positions = {shard_id: i for i, shard_id in enumerate(self.shard_ids)}
+        self.route = np.array([positions[index['crop_shards'][crop]] for crop in index['encoder_classes']['crop']],
+                              dtype=np.intp)
+        self.crop_column = index['crop_column']
+        self.crop_mean = index['scaler']['mean'][self.crop_column]
+        self.crop_scale = index['scaler']['scale'][self.crop_column]
+
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+
+    @property
+    def n_shards(self):
+        return len(self.shard_ids)
+
+    def shard(self, shard_id):
+        """FlatForest for one shard, loading it on first use"""
+        with self._lock:
+            engine = self._resident.get(shard_id)
+            if engine is not None:
+                self._resident.move_to_end(shard_id)
+                self.hits += 1
+                return engine
+
+        # Load outside the lock so other shards keep serving meanwhile
+        started = time.perf_counter()
+        engine = load_bundle(self.paths[shard_id], verify=self.verify)['engine']
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            if shard_id in self._resident:
+                # Another thread loaded it first; keep a single copy
+                self._resident.move_to_end(shard_id)
+                return self._resident[shard_id]
+            self._resident[shard_id] = engine
+            self.loads += 1
+            self.load_seconds += elapsed
+            while len(self._resident) > self.max_resident:
+                self._resident.popitem(last=False)
+                self.evictions += 1
+            return engine
+
+    def shards_for(self, X):
+        """Shard position of every row of a scaled feature matrix"""
+        codes = np.rint(X[:, self.crop_column] * self.crop_scale + self.crop_mean).astype(np.intp)
+        if len(codes) and (codes.min() < 0 or codes.max() >= len(self.route)):
+            raise ShardError("Crop code outside the shard index")
+        return self.route[codes]
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        positions = self.shards_for(X)
+        if len(positions) and (positions == positions[0]).all():
+            return self.shard(self.shard_ids[positions[0]]).predict(X)
+
+        predictions = np.empty(len(X))
+        for position in np.unique(positions):
+            rows = positions == position
+            predictions[rows] = self.shard(self.shard_ids[position]).predict(X[rows])
+        return predictions
+
+    def predict_intervals(self, X, quantiles):
+        """FlatForest.predict_intervals, each row computed from its own shard's trees"""
+        X = np.asarray(X, dtype=np.float64)
+        positions = self.shards_for(X)
+        mean, std = np.empty(len(X)), np.empty(len(X))
+        values = np.empty((len(quantiles), len(X)))
+        for position in np.unique(positions):
+            rows = positions == position
+            mean[rows], std[rows], values[:, rows] = \
+                self.shard(self.shard_ids[position]).predict_intervals(X[rows], quantiles)
+        return mean, std, values
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.loads
+            return {
+                "version": self.version,
+                "shards": self.n_shards,
+                "resident": list(self._resident),
+                "max_resident": self.max_resident,
+                "hits": self.hits,
+                "loads": self.loads,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "load_seconds": round(self.load_seconds, 4)
+            }
@@ -0,0 +1,96 @@
+"""Parity of the flat NumPy engine with the sklearn models it is exported from
+
+    cd crop-yield-app/ml_model && python -m pytest tests
+"""
+import numpy as np
+import pytest
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+
+from forest_engine import FlatForest, verify_parity
+
+N_CATEGORIES = 12
+
+
+def make_data(n_rows=600, seed=0):
+    """Two integer-coded categorical columns plus two numeric ones"""
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([
+        rng.integers(0, N_CATEGORIES, n_rows),
+        rng.integers(0, 5, n_rows),
+        rng.standard_normal(n_rows),
+        rng.uniform(0, 100, n_rows)
+    ]).astype(float)
+    y = 3 * X[:, 0] + 10 * (X[:, 1] == 2) + X[:, 2] ** 2 + 0.1 * X[:, 3] + rng.normal(0, 0.1, n_rows)
+    return X, y
+
+
+def threshold_rows(engine, X, column):
+    """Rows of X with column set to each split threshold the engine uses on it"""
+    internal = ~engine.is_leaf()
+    thresholds = np.unique(engine.threshold[internal & (engine.feature == column)])
+    rows = np.repeat(X[:1], len(thresholds), axis=0)
+    rows[:, column] = thresholds
+    return rows
+
+
+@pytest.fixture(scope='module')
+def data():
+    return make_data()
+
+
+@pytest.fixture(scope='module')
+def forest(data):
+    X, y = data
+    return RandomForestRegressor(n_estimators=10, max_depth=8, random_state=0).fit(X, y)
+
+
+@pytest.fixture(scope='module')
+def boosting(data):
+    X, y = data
+    return HistGradientBoostingRegressor(max_iter=30, categorical_features=[True, True, False, False],
+                                         random_state=0).fit(X, y)
+
+
+@pytest.mark.parametrize('model_name', ['forest', 'boosting'])
+def test_verify_parity(model_name, request):
+    model = request.getfixturevalue(model_name)
+    assert verify_parity(model, n_rows=500) < 1e-6
+
+
+@pytest.mark.parametrize('model_name', ['forest', 'boosting'])
+def test_rows_on_split_thresholds(model_name, request, data):
+    model = request.getfixturevalue(model_name)
+    engine = FlatForest.from_sklearn(model)
+    X, _ = data
+    for column in range(X.shape[1]):
+        rows = threshold_rows(engine, X, column)
+        if not len(rows):
+            continue
+        # Exactly on the threshold, and on its float32 rounding (sklearn compares in float32)
+        for candidate in (rows, rows.astype(np.float32).astype(np.float64)):
+            np.testing.assert_allclose(engine.predict(candidate), model.predict(candidate), rtol=1e-9, atol=1e-6)
+
+
+@pytest.mark.parametrize('unseen_code', [N_CATEGORIES, N_CATEGORIES + 7, 31, 32, 255, 1000, -1])
+def test_unseen_category_codes(boosting, data, unseen_code):
+    engine = FlatForest.from_sklearn(boosting)
+    X, _ = data
+    rows = X[:50].copy()
+    rows[:, 0] = unseen_code
+    np.testing.assert_allclose(engine.predict(rows), boosting.predict(rows), rtol=1e-9, atol=1e-6)
+
+
+def test_unseen_codes_in_forest(forest, data):
+    # Random forests treat the codes as ordinal, so unseen codes just fall past the last threshold
+    engine = FlatForest.from_sklearn(forest)
+    X, _ = data
+    rows = X[:50].copy()
+    rows[:, 0] = N_CATEGORIES + 3
+    np.testing.assert_allclose(engine.predict(rows), forest.predict(rows), rtol=1e-9, atol=1e-6)
+
+
+def test_verify_parity_detects_mismatch(forest):
+    engine = FlatForest.from_sklearn(forest)
+    engine.value = engine.value + 1.0
+    with pytest.raises(AssertionError):
+        verify_parity(forest, engine, n_rows=100)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from history_cube import HistoryCube
+
+VOCABULARIES = {
+    'state': ['Bihar', 'Kerala'],
+    'district': ['Gaya', 'Idukki'],
+    'crop': ['Rice', 'Wheat'],
+    'season': ['Kharif', 'Rabi']
+}
+
+
+@pytest.fixture
+def cube():
+    # Wheat is only grown in Bihar
+    return HistoryCube.from_arrays({
+        'state': [0, 0, 0, 1, 1],
+        'district': [0, 0, 0, 1, 1],
+        'crop': [0, 0, 1, 0, 0],
+        'season': [0, 0, 1, 0, 0],
+        'year': [2000, 2001, 2000, 2000, 2001],
+        'production': [100.0, 300.0, 50.0, 40.0, 90.0],
+        'area': [10.0, 20.0, 5.0, 4.0, 3.0],
+        'records': [1, 2, 1, 1, 1]
+    }, VOCABULARIES)
+
+
+def test_aggregate_by_year(cube):
+    result = cube.aggregate({'crop': ['Rice']}, 'year')
+    assert result['groups'] == [2000, 2001]
+    np.testing.assert_allclose(result['production'], [140.0, 390.0])
+    np.testing.assert_allclose(result['yield'], [140.0 / 14.0, 390.0 / 23.0])
+    np.testing.assert_array_equal(result['records'], [2, 3])
+    np.testing.assert_allclose(result['yield_quantiles']['0.5'], [10.0, 22.5])
+
+
+@pytest.mark.parametrize('filters', [
+    {'state': ['Kerala'], 'crop': ['Wheat']},
+    {'year': [3000]}
+])
+def test_aggregate_without_matching_cells(cube, filters):
+    result = cube.aggregate(filters, 'state')
+    assert result['groups'] == []
+    assert result['production'].dtype == np.float64
+    assert len(result['yield']) == 0
+    assert all(len(values) == 0 for values in result['yield_quantiles'].values())
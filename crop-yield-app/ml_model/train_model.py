@@ -1,107 +1,194 @@
-
-
-import pandas as pd
 import numpy as np
-from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
 from sklearn.metrics import mean_squared_error, r2_score
 import joblib
+import json
+import os
 import warnings
+from functools import partial
+from encoding import CATEGORICAL_FIELDS, save_encoder_classes
+from forest_engine import FlatForest, verify_parity
+from history_builder import refresh_history_cube
+from model_bundle import save_bundle
+from preprocessing import DEFAULT_CHUNKSIZE, FEATURE_COLUMNS, load_prepared_data, save_split
+from sharding import MIN_SHARD_ROWS, SHARD_INDEX_PATH, SHARD_ROOT, ShardedForest, publish_shard_index, train_shards
+from tuning import TUNED_PARAMS_PATH, tune
 warnings.filterwarnings('ignore')
 
-def train_crop_yield_model():
-    print("🌾 Loading crop production dataset...")
-    
-    # Load the dataset
-    df = pd.read_csv('data/crop_production.csv')
-    
-    print(f"Dataset shape: {df.shape}")
-    print(f"Columns: {df.columns.tolist()}")
-    
-    # Clean the data
-    print("🧹 Cleaning data...")
-    
-    # Remove rows with missing values
-    df = df.dropna()
-    
-    # Clean numeric columns
-    df['Area'] = pd.to_numeric(df['Area'], errors='coerce')
-    df['Production'] = pd.to_numeric(df['Production'], errors='coerce')
-    df['Crop_Year'] = pd.to_numeric(df['Crop_Year'], errors='coerce')
-    
-    # Remove rows with invalid numeric values
-    df = df.dropna(subset=['Area', 'Production', 'Crop_Year'])
-    
-    # Remove rows with zero or negative values
-    df = df[(df['Area'] > 0) & (df['Production'] > 0) & (df['Crop_Year'] > 1900)]
-    
-    # Clean text columns
-    df['State_Name'] = df['State_Name'].str.strip()
-    df['District_Name'] = df['District_Name'].str.strip()
-    df['Season'] = df['Season'].str.strip()
-    df['Crop'] = df['Crop'].str.strip()
-    
-    # Remove rows with empty text values
-    df = df[(df['State_Name'] != '') & (df['District_Name'] != '') & 
-            (df['Season'] != '') & (df['Crop'] != '')]
-    
-    print(f"Cleaned dataset shape: {df.shape}")
-    
-    # Create features
-    print("🔧 Creating features...")
-    
-    # Encode categorical variables
-    le_state = LabelEncoder()
-    le_district = LabelEncoder()
-    le_season = LabelEncoder()
-    le_crop = LabelEncoder()
-    
-    df['state_encoded'] = le_state.fit_transform(df['State_Name'])
-    df['district_encoded'] = le_district.fit_transform(df['District_Name'])
-    df['season_encoded'] = le_season.fit_transform(df['Season'])
-    df['crop_encoded'] = le_crop.fit_transform(df['Crop'])
+# Random Forest hyperparameters (also used by evaluate_model.py cross-validation)
+MODEL_PARAMS = {
+    'n_estimators': 100,
+    'max_depth': 20,
+    'min_samples_split': 5,
+    'min_samples_leaf': 2,
+    'random_state': 42
+}
+
+# Histogram gradient boosting hyperparameters
+HGB_PARAMS = {
+    'max_iter': 300,
+    'learning_rate': 0.1,
+    'max_leaf_nodes': 31,
+    'random_state': 42
+}
+
+MODEL_BACKENDS = ['random_forest', 'hist_gradient_boosting']
+DEFAULT_PARAMS = {'random_forest': MODEL_PARAMS, 'hist_gradient_boosting': HGB_PARAMS}
+
+# Native categorical splits need at most max_bins (255) categories;
+# larger vocabularies (districts) stay ordinal
+MAX_NATIVE_CATEGORIES = 255
+
+def categorical_mask(encoders):
+    """Which feature columns the boosting backend treats as native categoricals"""
+    mask = [len(encoders[field].classes_) <= MAX_NATIVE_CATEGORIES for field in CATEGORICAL_FIELDS]
+    return mask + [False] * (len(FEATURE_COLUMNS) - len(mask))
+
+def build_model(backend, params, encoders=None, n_jobs=-1):
+    """Unfitted estimator for a backend"""
+    if backend == 'hist_gradient_boosting':
+        return HistGradientBoostingRegressor(**params, categorical_features=categorical_mask(encoders))
+    return RandomForestRegressor(**params, n_jobs=n_jobs)
+
+def identity_scaler(X):
+    """Fitted StandardScaler that leaves features unchanged
+    
+    Boosting splits on the raw category codes, but serving always applies
+    the saved scaler, so the boosting backend saves this one.
+    """
+    scaler = StandardScaler().fit(X)
+    scaler.mean_ = np.zeros(X.shape[1])
+    scaler.var_ = np.ones(X.shape[1])
+    scaler.scale_ = np.ones(X.shape[1])
+    return scaler
+
+def fit_scaler(backend, X_train):
+    if backend == 'hist_gradient_boosting':
+        return identity_scaler(X_train)
+    return StandardScaler().fit(X_train)
+
+def load_model_params(path, backend='random_forest'):
+    """Hyperparameters from a JSON file (e.g. written by --tune), on top of the backend defaults
+    
+    Raises ValueError if the file was written for another backend; files
+    without a "backend" entry predate it and hold random forest settings.
+    """
+    with open(path, 'r') as f:
+        config = json.load(f)
+    params_backend = config.get('backend', 'random_forest')
+    if params_backend != backend:
+        raise ValueError(f"{path} holds {params_backend} parameters, not {backend} ones; "
+                         f"pass --backend {params_backend} or use another --params file")
+    return {**DEFAULT_PARAMS[backend], **config['params']}
+
+def train_sharded_model(data, train_index, test_index, scaler, backend, model_params,
+                        min_shard_rows=MIN_SHARD_ROWS, n_jobs=None, streaming=False):
+    """Fit one model per crop (small crops share a group shard) and publish the shard index"""
+    encoders = data['encoders']
+    X_train_scaled = scaler.transform(data['X'][train_index])
+    X_test_scaled = scaler.transform(data['X'][test_index])
+    y_train, y_test = data['y'][train_index], data['y'][test_index]
+    encoder_classes = {field: encoder.classes_.tolist() for field, encoder in encoders.items()}
+    
+    os.makedirs(SHARD_ROOT, exist_ok=True)
+    index = train_shards(
+        X_train_scaled,
+        y_train,
+        partial(build_model, backend, model_params, encoders, n_jobs=1),
+        encoder_classes,
+        scaler,
+        data['year_min'],
+        data['year_max'],
+        FEATURE_COLUMNS,
+        crop_column=FEATURE_COLUMNS.index('crop_encoded'),
+        min_rows=min_shard_rows,
+        n_jobs=n_jobs
+    )
     
-    # Create additional features
-    df['year_normalized'] = (df['Crop_Year'] - df['Crop_Year'].min()) / (df['Crop_Year'].max() - df['Crop_Year'].min())
+    # Evaluate the shards together, routed the same way as in the API
+    engine = ShardedForest(index, root=SHARD_ROOT, max_resident=len(index['shards']), verify=False)
+    y_pred = engine.predict(X_test_scaled)
+    mse = mean_squared_error(y_test, y_pred)
+    r2 = r2_score(y_test, y_pred)
     
-    # Calculate yield per hectare
-    df['yield_per_hectare'] = df['Production'] / df['Area']
+    shards = sorted(index['shards'].values(), key=lambda shard: -shard['rows'])
+    print(f"📊 Sharded Model Performance ({len(shards)} shards):")
+    print(f"Mean Squared Error: {mse:.2f}")
+    print(f"R² Score: {r2:.4f}")
+    print(f"Root Mean Squared Error: {np.sqrt(mse):.2f}")
+    print(f"Largest shard: {shards[0]['shard_id']} ({shards[0]['rows']:,} rows, {shards[0]['size_mb']:.1f} MB), "
+          f"median {np.median([shard['size_mb'] for shard in shards]):.1f} MB")
     
-    # Remove outliers from yield_per_hectare (keep 95th percentile)
-    q95 = df['yield_per_hectare'].quantile(0.95)
-    df = df[df['yield_per_hectare'] <= q95]
+    save_encoder_classes(encoders)
+    with open('data/unique_values.json', 'w') as f:
+        json.dump(data['unique_values'], f, indent=2)
+    save_split(train_index, test_index, data['cache_key'], streaming, index['version'])
+    print("🗂️  Building historical statistics...")
+    refresh_history_cube(source_key=data['cache_key'])
+    
+    # The index goes last: it is what the API watches for new versions
+    index.update({
+        'estimator': backend,
+        'unique_values': data['unique_values'],
+        'metrics': {'mse': float(mse), 'r2': float(r2)},
+        'yield_cutoff': data['yield_cutoff'],
+        'training_rows': len(train_index),
+        'model_params': model_params
+    })
+    publish_shard_index(index)
+    print(f"Shard index version: {index['version']} ({SHARD_INDEX_PATH}); serve it with ML_SHARDED=1")
+    return index
+
+def train_crop_yield_model(use_cache=True, streaming=False, chunksize=DEFAULT_CHUNKSIZE, model_params=None,
+                           tune_options=None, backend='random_forest', sharded=False, min_shard_rows=MIN_SHARD_ROWS,
+                           shard_jobs=None):
+    model_params = model_params or DEFAULT_PARAMS[backend]
+    print("🌾 Loading crop production dataset...")
     
-    print(f"Final dataset shape: {df.shape}")
+    # Load, clean and encode the dataset (cached after the first run)
+    data = load_prepared_data(use_cache=use_cache, streaming=streaming, chunksize=chunksize)
+    encoders = data['encoders']
+    unique_values = data['unique_values']
     
     # Select features for training
-    feature_columns = ['state_encoded', 'district_encoded', 'season_encoded', 
-                      'crop_encoded', 'year_normalized', 'Area']
+    feature_columns = FEATURE_COLUMNS
     
-    X = df[feature_columns]
-    y = df['Production']  # Predict production
+    X = data['X']
+    y = data['y']  # Predict production
     
     print(f"Feature columns: {feature_columns}")
     print(f"Target: Production")
     
-    # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    # Split the data (by row index so evaluate_model.py can reuse the split)
+    train_index, test_index = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42)
+    X_train, X_test = X[train_index], X[test_index]
+    y_train, y_test = y[train_index], y[test_index]
     
-    # Scale features
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
+    # Scale features (a no-op scaler for boosting)
+    scaler = fit_scaler(backend, X_train)
+    X_train_scaled = scaler.transform(X_train)
     X_test_scaled = scaler.transform(X_test)
     
+    # Search forest settings instead of training (test rows stay unseen)
+    if tune_options is not None:
+        if backend != 'random_forest':
+            print("❌ --tune only supports the random_forest backend")
+            return
+        tune(X_train_scaled, y_train, model_params, **tune_options)
+        return
+    
+    # One model per crop instead of a single global model
+    if sharded:
+        train_sharded_model(data, train_index, test_index, scaler, backend, model_params,
+                            min_shard_rows, shard_jobs, streaming)
+        return
+    
     # Train model
-    print("🤖 Training Random Forest model...")
-    model = RandomForestRegressor(
-        n_estimators=100,
-        max_depth=20,
-        min_samples_split=5,
-        min_samples_leaf=2,
-        random_state=42,
-        n_jobs=-1
-    )
+    print(f"🤖 Training {backend.replace('_', ' ').title()} model...")
+    print(f"Parameters: {model_params}")
+    model = build_model(backend, model_params, encoders)
     
     model.fit(X_train_scaled, y_train)
     
@@ -115,48 +202,99 @@ def train_crop_yield_model():
     print(f"R² Score: {r2:.4f}")
     print(f"Root Mean Squared Error: {np.sqrt(mse):.2f}")
     
+    # The bundle serves the flat engine, so it must reproduce the model before anything is written
+    engine = FlatForest.from_sklearn(model)
+    max_diff = verify_parity(model, engine)
+    print(f"✅ Flat engine matches the model (max abs diff {max_diff:.2e})")
+    
     # Save model and encoders
     print("💾 Saving model and encoders...")
     joblib.dump(model, 'crop_yield_model.pkl')
     joblib.dump(scaler, 'scaler.pkl')
-    joblib.dump(le_state, 'label_encoders/state_encoder.pkl')
-    joblib.dump(le_district, 'label_encoders/district_encoder.pkl')
-    joblib.dump(le_season, 'label_encoders/season_encoder.pkl')
-    joblib.dump(le_crop, 'label_encoders/crop_encoder.pkl')
+    for field, encoder in encoders.items():
+        joblib.dump(encoder, f'label_encoders/{field}_encoder.pkl')
+    save_encoder_classes(encoders)
     
     # Save unique values for frontend
-    unique_states = sorted(df['State_Name'].unique())
-    unique_districts = sorted(df['District_Name'].unique())
-    unique_seasons = sorted(df['Season'].unique())
-    unique_crops = sorted(df['Crop'].unique())
-    
-    # Create a mapping for districts by state
-    district_state_mapping = {}
-    for state in unique_states:
-        districts = sorted(df[df['State_Name'] == state]['District_Name'].unique())
-        district_state_mapping[state] = districts
-    
-    # Save mappings
-    import json
     with open('data/unique_values.json', 'w') as f:
-        json.dump({
-            'states': unique_states,
-            'districts': unique_districts,
-            'seasons': unique_seasons,
-            'crops': unique_crops,
-            'district_state_mapping': district_state_mapping
-        }, f, indent=2)
+        json.dump(unique_values, f, indent=2)
+    
+    # Historical statistics for the analytics endpoints (rebuilt when the data changed)
+    print("🗂️  Building historical statistics...")
+    refresh_history_cube(source_key=data['cache_key'])
+    
+    # Save the single-file serving bundle (memory-mappable tree arrays)
+    print("📦 Writing model bundle...")
+    manifest = save_bundle(
+        engine,
+        {field: encoder.classes_.tolist() for field, encoder in encoders.items()},
+        scaler,
+        unique_values,
+        data['year_min'],
+        data['year_max'],
+        feature_columns,
+        metrics={'mse': float(mse), 'r2': float(r2)},
+        yield_cutoff=data['yield_cutoff'],
+        training_rows=len(train_index),
+        model_params=model_params
+    )
+    print(f"Bundle version: {manifest['version']}")
+    
+    # The held-out rows evaluate_model.py scores this bundle on
+    save_split(train_index, test_index, data['cache_key'], streaming, manifest['version'])
     
     print("✅ Model training completed successfully!")
     print(f"📈 Model can predict crop production for:")
-    print(f"   - {len(unique_states)} states")
-    print(f"   - {len(unique_districts)} districts")
-    print(f"   - {len(unique_seasons)} seasons")
-    print(f"   - {len(unique_crops)} crops")
+    print(f"   - {len(unique_values['states'])} states")
+    print(f"   - {len(unique_values['districts'])} districts")
+    print(f"   - {len(unique_values['seasons'])} seasons")
+    print(f"   - {len(unique_values['crops'])} crops")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the crop yield model")
+    parser.add_argument('--no-cache', action='store_true', help="re-parse the CSV instead of using data/cache")
+    parser.add_argument('--stream', action='store_true', help="read the CSV in chunks (for datasets larger than RAM)")
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="rows per chunk with --stream")
+    parser.add_argument('--backend', choices=MODEL_BACKENDS, default='random_forest', help="model family to train")
+    parser.add_argument('--params', help=f"train with the configuration written by --tune (e.g. {TUNED_PARAMS_PATH})")
+    parser.add_argument('--tune', action='store_true', help="search forest settings instead of training")
+    parser.add_argument('--budget', type=float, default=300, help="wall-clock seconds for --tune")
+    parser.add_argument('--tune-jobs', type=int, default=None, help="worker processes for --tune (default: all cores)")
+    parser.add_argument('--candidates', type=int, default=24, help="random configurations tried by --tune")
+    parser.add_argument('--max-r2-loss', type=float, default=0.01,
+                        help="relative R² loss accepted for a faster forest (default 1%%)")
+    parser.add_argument('--sharded', action='store_true', help="train one model per crop instead of a global model")
+    parser.add_argument('--min-shard-rows', type=int, default=MIN_SHARD_ROWS,
+                        help="crops with fewer training rows share one group shard")
+    parser.add_argument('--shard-jobs', type=int, default=None, help="worker processes for --sharded (default: all cores)")
+    args = parser.parse_args()
+    
     # Create label_encoders directory if it doesn't exist
-    import os
     os.makedirs('label_encoders', exist_ok=True)
     
-    train_crop_yield_model()
+    try:
+        model_params = load_model_params(args.params, args.backend) if args.params else None
+    except ValueError as e:
+        parser.error(str(e))
+    
+    tune_options = None
+    if args.tune:
+        tune_options = {
+            'budget_seconds': args.budget,
+            'n_candidates': args.candidates,
+            'n_jobs': args.tune_jobs,
+            'max_r2_loss': args.max_r2_loss
+        }
+    
+    train_crop_yield_model(
+        use_cache=not args.no_cache,
+        streaming=args.stream,
+        chunksize=args.chunksize,
+        model_params=model_params,
+        tune_options=tune_options,
+        backend=args.backend,
+        sharded=args.sharded,
+        min_shard_rows=args.min_shard_rows,
+        shard_jobs=args.shard_jobs
+    )
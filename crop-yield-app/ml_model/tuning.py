@@ -0,0 +1,236 @@
+"""Time-budgeted successive-halving search over the forest hyperparameters
+
+Candidates are trained in parallel worker processes on growing subsamples
+of the training rows. Each rung keeps the best third by Pareto rank over
+(validation R², single-row latency, size), and at least the whole front,
+so fast-but-accurate forests survive alongside the most accurate ones.
+The current settings are always carried along as the reference point.
+Used by ``train_model.py --tune``.
+"""
+import itertools
+import json
+import math
+import os
+import time
+
+import numpy as np
+from joblib import Parallel, delayed, parallel_config
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import r2_score
+
+from forest_engine import FlatForest
+
+# Written by --tune, read back with train_model.py --params
+TUNED_PARAMS_PATH = 'tuned_params.json'
+
+SEARCH_SPACE = {
+    'n_estimators': [10, 25, 50, 100, 200],
+    'max_depth': [8, 12, 16, 20, None],
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 5, 10],
+    'max_features': [1.0, 0.8, 0.5]
+}
+
+# Rows scored per call when timing batch prediction
+LATENCY_BATCH_SIZE = 1000
+
+
+def sample_candidates(n_candidates, baseline, seed=42):
+    """Random configurations from SEARCH_SPACE, always including the baseline"""
+    grid = [dict(zip(SEARCH_SPACE, values)) for values in itertools.product(*SEARCH_SPACE.values())]
+    rng = np.random.default_rng(seed)
+    picked = [grid[i] for i in rng.choice(len(grid), size=min(n_candidates, len(grid)), replace=False)]
+
+    baseline = {key: baseline.get(key, RandomForestRegressor().get_params()[key]) for key in SEARCH_SPACE}
+    return [baseline] + [params for params in picked if params != baseline]
+
+
+def _cpu_time_ms(fn, repeat):
+    """Median CPU time of fn() in milliseconds
+
+    CPU time rather than wall time, so timings stay comparable while other
+    candidates are training on the remaining cores.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        timings.append((time.process_time() - start) * 1000)
+    return float(np.median(timings))
+
+
+def evaluate_candidate(params, X_fit, y_fit, X_val, y_val, n_rows, random_state, deadline):
+    """Fit one candidate on the first n_rows fit rows and measure it; None past the deadline"""
+    if time.time() > deadline:
+        return None
+
+    started = time.time()
+    model = RandomForestRegressor(**params, random_state=random_state, n_jobs=1)
+    model.fit(X_fit[:n_rows], y_fit[:n_rows])
+    fit_seconds = time.time() - started
+
+    engine = FlatForest.from_sklearn(model)
+    row = np.asarray(X_val[:1])
+    batch = np.asarray(X_val[:LATENCY_BATCH_SIZE])
+    return {
+        'params': params,
+        'n_rows': n_rows,
+        'r2': float(r2_score(y_val, engine.predict(X_val))),
+        'single_ms': _cpu_time_ms(lambda: engine.predict(row), repeat=50),
+        'batch_ms_per_1k': _cpu_time_ms(lambda: engine.predict(batch), repeat=5) * 1000 / len(batch),
+        'size_mb': sum(array.nbytes for array in engine.arrays().values()) / 1e6,
+        'n_nodes': engine.n_nodes,
+        'fit_seconds': fit_seconds
+    }
+
+
+def dominates(a, b):
+    """True if a is at least as good as b on R², latency and size, and better on one"""
+    at_least = a['r2'] >= b['r2'] and a['single_ms'] <= b['single_ms'] and a['size_mb'] <= b['size_mb']
+    better = a['r2'] > b['r2'] or a['single_ms'] < b['single_ms'] or a['size_mb'] < b['size_mb']
+    return at_least and better
+
+
+def pareto_front(results):
+    """Results not dominated by any other result"""
+    return [a for a in results if not any(dominates(b, a) for b in results if b is not a)]
+
+
+def pareto_ranks(results):
+    """Non-dominated sorting: 0 for the front, 1 for the front once it is removed, ..."""
+    ranks = {}
+    remaining = list(results)
+    rank = 0
+    while remaining:
+        front = pareto_front(remaining)
+        for result in front:
+            ranks[id(result)] = rank
+        remaining = [result for result in remaining if id(result) not in ranks]
+        rank += 1
+    return ranks
+
+
+def successive_halving(X_train, y_train, candidates, budget_seconds, n_jobs=None, eta=3,
+                       min_rows=2000, validation_fraction=0.2, random_state=42):
+    """Run the search; returns the results of the last rung each candidate reached
+
+    The training rows are shuffled once and split into fit and validation
+    rows, so every rung trains on a prefix of the same fit rows. A rung is
+    only started if the previous one suggests it fits in the remaining
+    budget; workers skip candidates picked up after the deadline. The
+    first candidate is treated as the baseline and kept in every rung.
+    """
+    deadline = time.time() + budget_seconds
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    rng = np.random.default_rng(random_state)
+    order = rng.permutation(len(y_train))
+    n_val = int(len(order) * validation_fraction)
+    X_val, y_val = X_train[order[:n_val]], y_train[order[:n_val]]
+    X_fit, y_fit = X_train[order[n_val:]], y_train[order[n_val:]]
+
+    # Rungs grow the rows by eta while the candidates shrink by eta
+    n_rungs = max(1, min(int(math.log(len(candidates), eta)) + 1,
+                         int(math.log(max(len(y_fit) / min_rows, 1), eta)) + 1))
+    latest = {}
+    baseline = candidates[0]
+    survivors = list(candidates)
+    rung_seconds = 0.0
+
+    for rung in range(n_rungs):
+        n_rows = len(y_fit) // eta ** (n_rungs - 1 - rung)
+        remaining = deadline - time.time()
+        if rung and rung_seconds > remaining:
+            print(f"⏰ Stopping before rung {rung + 1}: ~{rung_seconds:.0f}s needed, {remaining:.0f}s left")
+            break
+
+        print(f"🔎 Rung {rung + 1}/{n_rungs}: {len(survivors)} candidates on {n_rows:,} rows")
+        started = time.time()
+        # joblib memory-maps the matrices once for all workers
+        with parallel_config(backend='loky', max_nbytes='1M', mmap_mode='r'):
+            results = Parallel(n_jobs=n_jobs)(
+                delayed(evaluate_candidate)(params, X_fit, y_fit, X_val, y_val, n_rows, random_state, deadline)
+                for params in survivors
+            )
+        rung_seconds = time.time() - started
+
+        results = [result for result in results if result is not None]
+        if not results:
+            print("⏰ Budget exhausted before the rung produced results")
+            break
+        for result in results:
+            latest[json.dumps(result['params'], sort_keys=True)] = result
+
+        # Keep the best 1/eta by Pareto rank (at least the front), breaking ties on R²
+        ranks = pareto_ranks(results)
+        results.sort(key=lambda result: (ranks[id(result)], -result['r2']))
+        n_keep = max(len(results) // eta, sum(1 for result in results if ranks[id(result)] == 0), 1)
+        survivors = [result['params'] for result in results[:n_keep]]
+        if baseline not in survivors:
+            survivors.append(baseline)
+
+    return list(latest.values())
+
+
+def pick_config(results, max_r2_loss=0.01):
+    """Fastest Pareto-optimal result within max_r2_loss (relative) of the best R²
+
+    Only results from the largest training size reached are compared, since
+    R² from smaller subsamples is not comparable.
+    """
+    n_rows = max(result['n_rows'] for result in results)
+    final = [result for result in results if result['n_rows'] == n_rows]
+    best_r2 = max(result['r2'] for result in final)
+    front = pareto_front(final)
+    eligible = [result for result in front if result['r2'] >= best_r2 - abs(best_r2) * max_r2_loss]
+    return min(eligible, key=lambda result: (result['single_ms'], -result['r2'])), front
+
+
+def format_result(result):
+    params = result['params']
+    return (f"n_estimators={params['n_estimators']:<4} max_depth={str(params['max_depth']):<5} "
+            f"min_split={params['min_samples_split']:<3} min_leaf={params['min_samples_leaf']:<3} "
+            f"max_features={params['max_features']:<4} | R² {result['r2']:.4f} | "
+            f"{result['single_ms']:.3f} ms/row | {result['batch_ms_per_1k']:.2f} ms/1k rows | "
+            f"{result['size_mb']:.1f} MB")
+
+
+def tune(X_train, y_train, baseline, budget_seconds=300, n_candidates=24, n_jobs=None,
+         max_r2_loss=0.01, random_state=42, path=TUNED_PARAMS_PATH):
+    """Search, report every candidate and write the chosen configuration to path"""
+    candidates = sample_candidates(n_candidates, baseline, seed=random_state)
+    print(f"🎛️  Tuning {len(candidates)} forest configurations for up to {budget_seconds:.0f}s...")
+    results = successive_halving(X_train, y_train, candidates, budget_seconds, n_jobs,
+                                 random_state=random_state)
+    if not results:
+        print("❌ No candidate finished within the budget; nothing written")
+        return None
+
+    chosen, front = pick_config(results, max_r2_loss)
+    print("\n📋 Candidates (validation R² vs CPU latency and size):")
+    for result in sorted(results, key=lambda result: (-result['n_rows'], -result['r2'])):
+        marker = '★' if result is chosen else ('•' if result in front else ' ')
+        print(f" {marker} [{result['n_rows']:>7,} rows] {format_result(result)}")
+
+    baseline_params = candidates[0]
+    baseline_result = next((result for result in results
+                            if result['params'] == baseline_params and result['n_rows'] == chosen['n_rows']), None)
+    if baseline_result is not None:
+        print(f"\n⚖️  Versus the current settings: {baseline_result['single_ms'] / chosen['single_ms']:.1f}x faster, "
+              f"{baseline_result['size_mb'] / chosen['size_mb']:.1f}x smaller, "
+              f"R² {chosen['r2'] - baseline_result['r2']:+.4f}")
+
+    with open(path, 'w') as f:
+        json.dump({
+            # Only random forests are tuned; train_model.py --params checks this
+            'backend': 'random_forest',
+            'params': chosen['params'],
+            'metrics': {key: value for key, value in chosen.items() if key != 'params'},
+            'baseline': baseline_result,
+            'max_r2_loss': max_r2_loss,
+            'pareto_front': front,
+            'candidates': results
+        }, f, indent=2)
+    print(f"✅ Wrote the chosen configuration to {path}")
+    print(f"   Train with it: python train_model.py --params {path}")
+    return chosen
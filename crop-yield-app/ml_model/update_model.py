@@ -0,0 +1,274 @@
+import json
+import time
+import warnings
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import r2_score
+from sklearn.model_selection import train_test_split
+from sklearn.preprocessing import StandardScaler
+
+from encoding import CATEGORICAL_FIELDS, save_encoder_classes
+from forest_engine import FlatForest, verify_parity
+from history_builder import merge_history_rows
+from model_bundle import load_bundle, save_bundle
+from model_store import LEGACY_MODEL_PATH
+from preprocessing import (DATA_PATH, FEATURE_COLUMNS, TEXT_COLUMNS, clean_crop_data,
+                           encoders_from_classes, load_split, prepare_features, save_split)
+warnings.filterwarnings('ignore')
+
+# Share of trees refreshed when the manifest does not record the training size
+DEFAULT_TREE_FRACTION = 0.1
+
+
+def extend_classes(classes, df):
+    """Append unseen category names to each vocabulary without renumbering existing codes
+
+    The extended lists are no longer sorted, so they are only valid through
+    encoder_classes.json / EncoderIndex, not LabelEncoder.transform.
+    """
+    extended = {}
+    for field, column in TEXT_COLUMNS.items():
+        known = set(classes[field])
+        added = sorted(set(df[column]) - known)
+        extended[field] = list(classes[field]) + added
+    return extended
+
+
+def merge_unique_values(unique_values, df):
+    """Add the new rows' states, districts, seasons and crops to the served dropdowns"""
+    mapping = {state: set(districts) for state, districts in unique_values['district_state_mapping'].items()}
+    for state, district in df[['State_Name', 'District_Name']].drop_duplicates().itertuples(index=False):
+        mapping.setdefault(state, set()).add(district)
+
+    return {
+        'states': sorted(set(unique_values['states']) | set(df['State_Name'])),
+        'districts': sorted(set(unique_values['districts']) | set(df['District_Name'])),
+        'seasons': sorted(set(unique_values['seasons']) | set(df['Season'])),
+        'crops': sorted(set(unique_values['crops']) | set(df['Crop'])),
+        'district_state_mapping': {state: sorted(mapping[state]) for state in sorted(mapping)}
+    }
+
+
+def encode_frame(df, classes, year_min, year_max):
+    """Unscaled feature matrix for cleaned rows, using codes = position in classes"""
+    X = np.empty((len(df), len(FEATURE_COLUMNS)))
+    for column, field in enumerate(CATEGORICAL_FIELDS):
+        codes = {name: code for code, name in enumerate(classes[field])}
+        X[:, column] = df[TEXT_COLUMNS[field]].map(codes).to_numpy(dtype=float)
+    X[:, 4] = (df['Crop_Year'].to_numpy(dtype=float) - year_min) / (year_max - year_min)
+    X[:, 5] = df['Area'].to_numpy(dtype=float)
+    return X
+
+
+def filter_outliers(df, yield_cutoff):
+    """Drop rows above the training run's yield_per_hectare cutoff"""
+    return df[df['Production'] / df['Area'] <= yield_cutoff]
+
+
+def update_forest(model, X_scaled, y, n_trees, replace=True):
+    """Train n_trees new trees on the new rows only (warm_start)
+
+    With ``replace`` the oldest n_trees are dropped so the forest keeps its
+    size and scoring latency; otherwise it grows by n_trees.
+    """
+    n_before = len(model.estimators_)
+    model.set_params(warm_start=True, n_estimators=n_before + n_trees, n_jobs=-1)
+    model.fit(X_scaled, y)
+
+    if replace:
+        model.estimators_ = model.estimators_[n_trees:]
+        model.set_params(n_estimators=len(model.estimators_))
+    model.set_params(warm_start=False)
+    return model
+
+
+def trees_to_refresh(n_trees, new_rows, training_rows):
+    """Trees to retrain, proportional to the new rows' share of all training rows"""
+    if not training_rows:
+        return max(1, round(n_trees * DEFAULT_TREE_FRACTION))
+    return max(1, round(n_trees * new_rows / (training_rows + new_rows)))
+
+
+def load_current_artifacts():
+    """Bundle (vocabularies, year range, cutoff) plus the sklearn model and scaler it was built from"""
+    bundle = load_bundle(mmap_mode=None)
+    model = joblib.load(LEGACY_MODEL_PATH)
+    scaler = joblib.load('scaler.pkl')
+    if not hasattr(model, 'estimators_'):
+        raise ValueError("Incremental updates need the random_forest backend; run train_model.py instead")
+    if len(model.estimators_) != bundle['manifest']['n_trees']:
+        raise ValueError(f"{LEGACY_MODEL_PATH} does not match the model bundle; run train_model.py")
+    return bundle, model, scaler
+
+
+def read_new_rows(path, manifest):
+    """Clean the new rows and apply the training run's outlier cutoff"""
+    raw = pd.read_csv(path)
+    df = clean_crop_data(raw.copy())
+
+    yield_cutoff = manifest.get('yield_cutoff')
+    if yield_cutoff is None:
+        # Bundles from before the cutoff was recorded: use the new rows' own
+        yield_cutoff = float((df['Production'] / df['Area']).quantile(0.95))
+        print(f"⚠️  Bundle has no yield cutoff; using {yield_cutoff:.2f} from the new rows")
+    return raw, filter_outliers(df, yield_cutoff)
+
+
+def append_rows(raw, path=DATA_PATH):
+    """Append raw rows to the training CSV so the next full retrain includes them"""
+    columns = pd.read_csv(path, nrows=0).columns
+    with open(path, 'rb+') as f:
+        f.seek(0, 2)
+        if f.tell():
+            f.seek(-1, 2)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    raw[columns].to_csv(path, mode='a', header=False, index=False)
+
+
+def update_crop_yield_model(new_data_path, n_trees=None, replace=True, append=True):
+    """Fold a new batch of rows into the deployed model without refitting from scratch"""
+    started = time.time()
+    print("📦 Loading current model artifacts...")
+    bundle, model, scaler = load_current_artifacts()
+    manifest = bundle['manifest']
+
+    print(f"🌾 Reading new rows from {new_data_path}...")
+    raw, df = read_new_rows(new_data_path, manifest)
+    if not len(df):
+        print("❌ No usable rows in the new data")
+        return None
+    print(f"New rows after cleaning: {len(df)}")
+
+    # Extend vocabularies; existing codes keep their meaning for the old trees
+    classes = extend_classes(bundle['encoder_classes'], df)
+    for field in CATEGORICAL_FIELDS:
+        added = len(classes[field]) - len(bundle['encoder_classes'][field])
+        if added:
+            print(f"   + {added} new {field} value(s)")
+
+    # The scaler and year range stay fixed so old splits remain valid
+    X_new = scaler.transform(encode_frame(df, classes, manifest['year_min'], manifest['year_max']))
+    y_new = df['Production'].to_numpy(dtype=float)
+
+    training_rows = manifest.get('training_rows')
+    n_trees = n_trees or trees_to_refresh(len(model.estimators_), len(df), training_rows)
+    print(f"🌲 {'Replacing' if replace else 'Adding'} {n_trees} of {len(model.estimators_)} trees...")
+    model = update_forest(model, X_new, y_new, n_trees, replace)
+
+    # Check the flat engine against the updated forest before anything is written
+    engine = FlatForest.from_sklearn(model)
+    verify_parity(model, engine)
+
+    unique_values = merge_unique_values(bundle['unique_values'], df)
+
+    # Save model and vocabularies (the per-field LabelEncoder pickles are not
+    # rewritten: extended vocabularies are unsorted, which LabelEncoder cannot use)
+    print("💾 Saving updated model...")
+    joblib.dump(model, LEGACY_MODEL_PATH)
+    save_encoder_classes(encoders_from_classes(classes))
+    with open('data/unique_values.json', 'w') as f:
+        json.dump(unique_values, f, indent=2)
+
+    if append:
+        append_rows(raw)
+        print(f"📝 Appended {len(raw)} rows to {DATA_PATH}")
+        merge_history_rows(raw)
+
+    # The bundle goes last: it is what the API watches for new versions
+    new_manifest = save_bundle(
+        engine,
+        classes,
+        scaler,
+        unique_values,
+        manifest['year_min'],
+        manifest['year_max'],
+        FEATURE_COLUMNS,
+        metrics={**manifest.get('metrics', {}), 'updated_rows': len(df), 'updated_trees': n_trees},
+        yield_cutoff=manifest.get('yield_cutoff'),
+        training_rows=(training_rows or 0) + len(df),
+        model_params=manifest.get('model_params')
+    )
+    print(f"Bundle version: {new_manifest['version']}")
+
+    # Without the append the dataset and its held-out rows are unchanged, so
+    # the saved split now belongs to the updated model
+    split = load_split()
+    if not append and split is not None and split['model_version'] == manifest['version']:
+        save_split(split['train_index'], split['test_index'], split['cache_key'], split['streaming'],
+                   new_manifest['version'])
+    print(f"✅ Model updated in {time.time() - started:.1f}s")
+    return new_manifest
+
+
+def compare_with_full_retrain(new_data_path, n_trees=None, replace=True, test_size=0.2):
+    """Update vs full retrain on the same rows, scored on held-out new rows; writes nothing"""
+    bundle, model, scaler = load_current_artifacts()
+    manifest = bundle['manifest']
+    _, df = read_new_rows(new_data_path, manifest)
+    df_update, df_test = train_test_split(df, test_size=test_size, random_state=42)
+
+    # Incremental update on the new rows only
+    started = time.time()
+    classes = extend_classes(bundle['encoder_classes'], df_update)
+    X_update = scaler.transform(encode_frame(df_update, classes, manifest['year_min'], manifest['year_max']))
+    n_trees = n_trees or trees_to_refresh(len(model.estimators_), len(df_update), manifest.get('training_rows'))
+    full_params = model.get_params()
+    update_forest(model, X_update, df_update['Production'].to_numpy(dtype=float), n_trees, replace)
+    update_seconds = time.time() - started
+
+    # Full retrain over history plus the same new rows
+    print("🤖 Retraining from scratch for comparison...")
+    started = time.time()
+    history = clean_crop_data(pd.read_csv(DATA_PATH))
+    data = prepare_features(pd.concat([history, df_update], ignore_index=True))
+    full_scaler = StandardScaler()
+    full_model = RandomForestRegressor(**{**full_params, 'warm_start': False, 'n_jobs': -1})
+    full_model.fit(full_scaler.fit_transform(data['X']), data['y'])
+    retrain_seconds = time.time() - started
+
+    # Only test rows both models can encode are scored
+    full_classes = {field: encoder.classes_.tolist() for field, encoder in data['encoders'].items()}
+    known = np.ones(len(df_test), dtype=bool)
+    for field, column in TEXT_COLUMNS.items():
+        known &= df_test[column].isin(set(classes[field])).to_numpy()
+    df_test = df_test[known]
+    y_test = df_test['Production'].to_numpy(dtype=float)
+
+    X_test = scaler.transform(encode_frame(df_test, classes, manifest['year_min'], manifest['year_max']))
+    X_test_full = full_scaler.transform(encode_frame(df_test, full_classes, data['year_min'], data['year_max']))
+    update_r2 = r2_score(y_test, model.predict(X_test))
+    retrain_r2 = r2_score(y_test, full_model.predict(X_test_full))
+
+    print(f"\n📊 Held-out new rows ({len(df_test)}):")
+    print(f"   Incremental update: R² {update_r2:.4f} in {update_seconds:.1f}s ({n_trees} trees on {len(df_update)} rows)")
+    print(f"   Full retrain:       R² {retrain_r2:.4f} in {retrain_seconds:.1f}s ({len(data['y'])} rows)")
+    print(f"   Difference: {update_r2 - retrain_r2:+.4f} R², {retrain_seconds / max(update_seconds, 1e-9):.1f}x faster")
+    return {
+        'update_r2': update_r2,
+        'retrain_r2': retrain_r2,
+        'update_seconds': update_seconds,
+        'retrain_seconds': retrain_seconds,
+        'test_rows': len(df_test)
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Fold new rows into the trained crop yield model")
+    parser.add_argument('new_data', help="CSV with the same columns as data/crop_production.csv")
+    parser.add_argument('--trees', type=int, default=None,
+                        help="trees to train on the new rows (default: proportional to their share of the data)")
+    parser.add_argument('--grow', action='store_true', help="add the new trees instead of replacing the oldest ones")
+    parser.add_argument('--no-append', action='store_true', help=f"do not append the rows to {DATA_PATH}")
+    parser.add_argument('--compare', action='store_true',
+                        help="compare against a full retrain on held-out new rows without saving anything")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_with_full_retrain(args.new_data, args.trees, replace=not args.grow)
+    else:
+        update_crop_yield_model(args.new_data, args.trees, replace=not args.grow, append=not args.no_append)